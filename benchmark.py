@@ -0,0 +1,293 @@
+# Benchmarks of the hot paths of the player on synthetic sequences: loading, evaluation of the variables, routines and
+# playlist, compilation of the active playlist, compilation of scan points and processing by the hardware (dummy
+# backend and ARTIQ encoder without connecting to a master; the PYON encoding of the ARTIQ arguments is only measured
+# when sipyco is installed).
+# Every stage is timed (best of several repeats) and its peak memory is measured in a separate run with tracemalloc.
+# Results are compared with the stored baseline so that regressions show up. The speed of the machine changes from one
+# run to another (by up to 1.7 times), so every stage is also compared relative to a fixed reference workload timed right
+# after each of its repeats. Not every stage follows the speed of the reference, so a stage is only reported when it is
+# slower both in time and relative to the reference, and it is timed again before being reported.
+#
+#   python benchmark.py                   # run all the scenarios and compare with benchmark_baseline.json
+#   python benchmark.py --save-baseline   # run and store the results as the new baseline
+#   python benchmark.py --scenario long_ramps --repeats 20
+import os
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+import argparse
+import gc
+import json
+import sys
+import time
+import tracemalloc
+
+from PyQt5.QtGui import QGuiApplication
+
+import config
+import definitions
+import hardware
+from hardware_specific import artiq
+from variables import VariablesModel
+from routines import RoutinesModel
+from playlist import PlaylistModel
+from sequence import Sequence
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_baseline.json")
+DUMMY_CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "examples", "dummy", "config_dummy.json")
+
+# Synthetic sequences: number of variables, of routines, of events per track, of tracks per routine, depth of the
+# playlist, number of analog ramps per routine and number of points of each ramp (ARTIQ)
+SCENARIOS = {
+    "small": dict(num_variables=10, num_routines=3, num_events=5, num_tracks=4, playlist_depth=2, num_ramps=1,
+                  ramp_points=100),
+    "many_variables": dict(num_variables=500, num_routines=3, num_events=5, num_tracks=4, playlist_depth=2,
+                           num_ramps=1, ramp_points=100),
+    "many_events": dict(num_variables=20, num_routines=20, num_events=50, num_tracks=16, playlist_depth=2,
+                        num_ramps=2, ramp_points=100),
+    "deep_playlist": dict(num_variables=20, num_routines=10, num_events=5, num_tracks=4, playlist_depth=100,
+                          num_ramps=1, ramp_points=100),
+    "long_ramps": dict(num_variables=20, num_routines=4, num_events=5, num_tracks=4, playlist_depth=4, num_ramps=10,
+                       ramp_points=10000),
+}
+
+
+# Returns a sequence in the format of the sequence files. One variable out of ten is a code variable that depends on the
+# previous one and the last one is an iterator. Digital events alternate their state and last a fraction of a variable.
+def make_sequence(digital_card, analog_card, num_variables, num_routines, num_events, num_tracks, playlist_depth,
+                  num_ramps, ramp_points=None):
+    parameters = []
+    for v in range(num_variables):
+        variable = {"name": "v%d" % v, "set": "%g" % (1 + v % 7), "iterator": False, "start": None, "stop": None,
+                    "increment": None, "comment": None, "scan index": None, "nesting level": None}
+        if v % 10 == 9:
+            variable["set"] = "return v%d * 1.5" % (v - 1)
+        parameters.append(variable)
+    parameters.append({"name": "scan", "set": None, "iterator": True, "start": "10", "stop": "1", "increment": "-1",
+                       "comment": None, "scan index": "0", "nesting level": 0})
+
+    routines = {}
+    for r in range(num_routines):
+        tracks = []
+        for c in range(min(num_tracks, digital_card.num_channels)):
+            events = [{"duration": "v%d/10" % ((r + c + e) % num_variables), "state": e % 2 == 1}
+                      for e in range(num_events)]
+            tracks.append({"chan": {"index": c, "card": digital_card.name}, "offset": "0", "events": events})
+        events = []
+        for e in range(num_ramps):
+            events.append({"duration": "1", "function": "linear", "start_val": "0", "end_val": "scan/4"})
+            events.append({"duration": "v0/10", "function": "constant", "val": "1.5"})
+        tracks.append({"chan": {"index": r % analog_card.num_channels, "card": analog_card.name}, "offset": "0",
+                       "events": events})
+        routines["r%d" % r] = tracks
+
+    # Each routine of the playlist is the child of the previous one
+    node = {"type": definitions.Routine, "children": [], "name": "r%d" % ((playlist_depth - 1) % num_routines),
+            "repeat": "1"}
+    for d in reversed(range(playlist_depth - 1)):
+        node = {"type": definitions.Routine, "children": [node], "name": "r%d" % (d % num_routines),
+                "repeat": "2" if d == 0 else "1"}
+    playlist = [{"name": "benchmark", "children": [node]}]
+
+    return {"variables": {"parameters": parameters}, "routines": routines, "playlist": playlist}
+
+
+# Returns the first digital and the first analog card of the hardware
+def find_cards(hw):
+    cards = hw.get_cards().values()
+    digital_card = next(card for card in cards if card.type == definitions.DigitalTrack)
+    analog_card = next(card for card in cards if card.type == definitions.AnalogTrack)
+    return digital_card, analog_card
+
+
+# Builds an offline ARTIQ output system (never connected to a master) with one TTL and one Zotino card
+def make_offline_artiq_hardware(ramp_points):
+    system_spec = {"name": "ARTIQ", "offline": True, "cards": [
+        {"class": "TTLOutARTIQCard", "name": "ttl",
+         "channels": ["ttl%d" % i for i in range(artiq.TTLOutARTIQCard.num_channels)]},
+        {"class": "ZotinoARTIQCard", "name": "zotino0",
+         "channels": ["dac%d" % i for i in range(artiq.ZotinoARTIQCard.num_channels)],
+         "samplerate": 100, "ramp_points": ramp_points}]}
+    return hardware.Hardware({"ARTIQ": artiq.ARTIQOutputSystem(system_spec)})
+
+
+class Models:
+    def __init__(self, hw, sequence_dict):
+        self.variables = VariablesModel()
+        self.routines = RoutinesModel(self.variables, hw)
+        self.playlist = PlaylistModel(self.variables, self.routines)
+        self.sequence = Sequence(self.variables, self.routines, self.playlist)
+        self.sequence.load_sequence_from_dict(sequence_dict)
+        self.playlist.set_active_playlist(0)
+
+
+# Returns the stages of a scenario as a list of (name, setup, function): setup() returns the argument of function and
+# is not measured.
+def make_stages(scenario, dummy_hw, artiq_hw):
+    digital_card, analog_card = find_cards(dummy_hw)
+    sequence_dict = make_sequence(digital_card, analog_card, **scenario)
+    models = Models(dummy_hw, sequence_dict)
+    csequence = models.playlist.compile_active_playlist()
+
+    def cold_compile_setup():
+        models.routines._invalidate_caches()
+
+    def core_sequence_setup():
+        return models.sequence.get_core_sequence()
+
+    stages = [
+        ("load_sequence", lambda: None, lambda _: Models(dummy_hw, sequence_dict)),
+        ("variables_update_values", lambda: None, lambda _: models.variables.update_values()),
+        ("routines_update_values", lambda: None, lambda _: models.routines.update_values()),
+        ("playlist_update_values", lambda: None, lambda _: models.playlist.update_values()),
+        ("compile_active_playlist", cold_compile_setup, lambda _: models.playlist.compile_active_playlist()),
+        ("compile_active_playlist_cached", lambda: None, lambda _: models.playlist.compile_active_playlist()),
+        ("get_core_sequence", lambda: None, lambda _: models.sequence.get_core_sequence()),
+        ("compile_scan_points", core_sequence_setup,
+         lambda core_sequence: [core_sequence.compile_point({"scan": i}) for i in range(10)]),
+        ("dummy_process_sequence", lambda: None, lambda _: dummy_hw.process_sequence(csequence, 0)),
+    ]
+
+    digital_card, analog_card = find_cards(artiq_hw)
+    artiq_models = Models(artiq_hw, make_sequence(digital_card, analog_card, **scenario))
+    artiq_csequence = artiq_models.playlist.compile_active_playlist()
+    artiq_outsys = artiq_hw.output_systems["ARTIQ"]
+    stages.append(("artiq_encode_sequence", lambda: None, lambda _: artiq_outsys.encode_sequence(artiq_csequence)))
+    if artiq.pyon is not None:
+        stages.append(("artiq_prepare_sequence", lambda: None,
+                       lambda _: artiq_hw.prepare_sequence(artiq_csequence, 0)))
+    return stages
+
+
+# Pure python work (dictionaries, strings, loops) whose duration only depends on the speed of the machine
+def reference_workload():
+    values = {}
+    for i in range(100000):
+        values[i % 1000] = str(i)
+    return values
+
+
+# Returns {stage name: {"time": best time in seconds, "reference": best time of reference_workload in seconds,
+# "peak": peak memory in bytes}}
+def run_stages(stages, repeats):
+    results = {}
+    for name, setup, function in stages:
+        times = []
+        reference_times = []
+        for _ in range(repeats):
+            argument = setup()
+            gc.collect()
+            start = time.perf_counter()
+            function(argument)
+            times.append(time.perf_counter() - start)
+            start = time.perf_counter()
+            reference_workload()
+            reference_times.append(time.perf_counter() - start)
+
+        # tracemalloc slows everything down so memory is measured in its own run
+        argument = setup()
+        gc.collect()
+        tracemalloc.start()
+        function(argument)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        results[name] = {"time": min(times), "reference": min(reference_times), "peak": peak}
+    return results
+
+
+# Returns how many times slower than `base` the stage has been: the smallest of the ratio of times and the ratio of
+# times relative to the reference workload. None if there is nothing to compare with.
+def slowdown(result, base):
+    if base is None or base["time"] == 0 or "reference" not in base: # older baselines have no reference
+        return None
+    return min(result["time"] / base["time"],
+               (result["time"] / result["reference"]) / (base["time"] / base["reference"]))
+
+
+# Returns the report as text and the list of (scenario, stage) that are slower than the baseline by more than
+# `tolerance` (0.5 means 50% slower)
+def compare(results, baseline, tolerance):
+    lines = []
+    regressions = []
+    for scenario_name, stages in results.items():
+        lines.append("== %s ==" % scenario_name)
+        lines.append("%-32s %12s %12s %12s %10s" % ("stage", "time (ms)", "baseline", "ratio", "peak (kB)"))
+        for stage_name, result in stages.items():
+            base = baseline.get(scenario_name, {}).get(stage_name)
+            ratio = slowdown(result, base)
+            if ratio is None:
+                base_str, ratio_str = "-", "-"
+            else:
+                base_str, ratio_str = "%.3f" % (1e3*base["time"]), "%.2f" % ratio
+                if ratio > 1 + tolerance:
+                    regressions.append((scenario_name, stage_name))
+                    ratio_str += " !"
+            lines.append("%-32s %12.3f %12s %12s %10.1f" % (stage_name, 1e3*result["time"], base_str, ratio_str,
+                                                          result["peak"]/1024))
+        # Stages of the baseline that couldn't be run here (e.g. artiq_prepare_sequence without sipyco)
+        for stage_name in sorted(set(baseline.get(scenario_name, {})) - set(stages)):
+            lines.append("%-32s %12s" % (stage_name, "not run"))
+    return "\n".join(lines), regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Quantum Player benchmarks.')
+    parser.add_argument('--scenario', action='append', choices=sorted(SCENARIOS),
+                        help='Scenario to run, can be repeated (default: all).')
+    parser.add_argument('--repeats', type=int, default=10, help='Number of timed runs of every stage.')
+    parser.add_argument('--config', default=DUMMY_CONFIG_PATH, help='Config with the dummy output system.')
+    parser.add_argument('--baseline', default=BASELINE_PATH, help='Baseline file.')
+    parser.add_argument('--save-baseline', action='store_true', help='Store the results as the new baseline.')
+    parser.add_argument('--tolerance', type=float, default=0.5,
+                        help='Relative slowdown above which a stage is reported as a regression.')
+    parser.add_argument('--retries', type=int, default=2,
+                        help='Number of times the stages reported as regressions are timed again.')
+    parser.add_argument('--output', help='Also write the report to this file.')
+    args = parser.parse_args()
+
+    app = QGuiApplication([])
+    dummy_hw = config.Config(args.config).get_hardware()
+
+    results = {}
+    scenario_stages = {}
+    for scenario_name in args.scenario or SCENARIOS:
+        scenario = SCENARIOS[scenario_name]
+        artiq_hw = make_offline_artiq_hardware(scenario["ramp_points"])
+        scenario_stages[scenario_name] = make_stages(scenario, dummy_hw, artiq_hw)
+        results[scenario_name] = run_stages(scenario_stages[scenario_name], args.repeats)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+
+    # A real regression is slow every time, so the stages that look slower are timed again and the fastest run is kept
+    report, regressions = compare(results, baseline, args.tolerance)
+    for _ in range(0 if args.save_baseline else args.retries):
+        if not regressions:
+            break
+        for scenario_name, stage_name in regressions:
+            stages = [stage for stage in scenario_stages[scenario_name] if stage[0] == stage_name]
+            result = run_stages(stages, args.repeats)[stage_name]
+            base = baseline[scenario_name][stage_name]
+            if slowdown(result, base) < slowdown(results[scenario_name][stage_name], base):
+                results[scenario_name][stage_name] = result
+        report, regressions = compare(results, baseline, args.tolerance)
+    if regressions:
+        report += "\n\nRegressions (slower than %g x baseline): %s" % (1 + args.tolerance,
+                                                                     ", ".join("%s/%s" % r for r in regressions))
+    print(report)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            output_file.write(report + "\n")
+
+    if args.save_baseline:
+        # Stages that weren't run keep their previous baseline
+        for scenario_name, stages in results.items():
+            baseline.setdefault(scenario_name, {}).update(stages)
+        with open(args.baseline, "w") as baseline_file:
+            json.dump(baseline, baseline_file, indent=2, sort_keys=True)
+            baseline_file.write("\n")
+        print("Baseline saved to %s" % args.baseline)
+    elif regressions:
+        sys.exit(1)
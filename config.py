@@ -1,9 +1,10 @@
 
 import json
-import utils
+import definitions
 import hardware
 import database
 import importlib
+import tracing
 
 from notify import publisher
 
@@ -20,7 +21,7 @@ class Config:
         outsys_names = []
         for output_system in self.data["output systems"]:
             if output_system["name"] in outsys_names:
-                raise utils.ConfigException("Output system names must be unique")
+                raise definitions.ConfigException("Output system names must be unique")
             else:
                 outsys_names.append(output_system["name"])
 
@@ -29,7 +30,7 @@ class Config:
         for output_system in self.data["output systems"]:
             for card in output_system["cards"]:
                 if card["name"] in card_names:
-                    raise utils.ConfigException("Card names must be unique")
+                    raise definitions.ConfigException("Card names must be unique")
                 else:
                     card_names.append(card["name"])
 
@@ -61,12 +62,33 @@ class Config:
                     host = self.data["database"]["host"]
                     port = self.data["database"]["port"]
                     db_name = self.data["database"]["database"]
-                    return CouchDBDatabase(username, password, host, port, db_name)
+                    return self._write_behind(CouchDBDatabase(username, password, host, port, db_name))
+                elif self.data["database"]["type"] == "sqlite":
+                    from databases.sqlite import SQLiteDatabase
+                    return self._write_behind(SQLiteDatabase(self.data["database"]["path"]))
+                elif self.data["database"]["type"] == "textfile":
+                    from databases.textfile import TextfileDatabase
+                    max_size = self.data["database"].get("max size", 100*1024*1024)
+                    return self._write_behind(TextfileDatabase(self.data["database"]["path"], max_size))
+                else:
+                    raise definitions.ConfigException("Unknown database type: %s" % self.data["database"]["type"])
             else:
-                raise utils.SequenceException("Database section present but no type is defined.")
+                raise definitions.SequenceException("Database section present but no type is defined.")
         else:
             return database.Database()
 
+    # Unless the database section has "write behind": false, the runs are stored from a background thread. The options
+    # can be given as {"write behind": {"queue size": 10000, "batch size": 100, "flush interval": 0.5}}.
+    def _write_behind(self, db):
+        options = self.data["database"].get("write behind", True)
+        if options is False:
+            return db
+        if options is True:
+            options = {}
+        return database.WriteBehindDatabase(db, max_pending=options.get("queue size", 10000),
+                                            batch_size=options.get("batch size", 100),
+                                            flush_interval=options.get("flush interval", 0.5))
+
     def get_publisher(self):
         if "notify_server" in self.data:
             if "host" in self.data["notify_server"] and "port" in self.data["notify_server"]:
@@ -75,6 +97,12 @@ class Config:
                 print(host, port)
                 return publisher.PublisherClient(host, port)
             else:
-                raise utils.ConfigException("host and port not specified for notify_server. Remove the notify_server section from config if not using it.")
+                raise definitions.ConfigException("host and port not specified for notify_server. Remove the notify_server section from config if not using it.")
         else:
             return publisher.DummyPublisherClient()
+
+    # Optional "tracing" section: {"capacity": number of shots kept in memory, "path": CSV (.csv) or JSONL file where
+    # the timestamps of every shot are appended}
+    def get_tracer(self):
+        tracing_spec = self.data.get("tracing", {})
+        return tracing.Tracer(tracing_spec.get("capacity", 1000), tracing_spec.get("path"))
@@ -0,0 +1,495 @@
+# Plain python representation of a sequence.
+# The Qt models (VariablesModel, RoutinesModel and PlaylistModel) are the views used to edit a sequence. The classes in
+# this module hold the same data without depending on Qt, so that a sequence can be evaluated and compiled outside of the
+# GUI thread (in worker threads or processes) and by tools that don't use the GUI. They are built from the same python
+# structures that are used to save sequences, see Sequence.from_pystruct.
+
+import numpy as np
+import scipy
+import scipy.interpolate
+
+import definitions
+import expressions
+
+EPS = 1e-12
+
+
+# Returns a new namespace to evaluate variables in
+def variables_namespace():
+    namespace = {'np':np, 'int':int, 'scipy':scipy, 'print':print}
+
+    # __builtins__ is added so eval treats 'variables' as we want
+    # (it doesn't add the builtin python variables)
+    namespace["__builtins__"] = {}
+    return namespace
+
+
+# Returns a new namespace to evaluate the expressions of routines and playlists given the values of the variables
+def sequence_namespace(variables_dict):
+    namespace = dict(variables_dict)
+    namespace["__builtins__"] = {}
+
+    # Make numpy available
+    namespace['np'] = np
+    return namespace
+
+
+# Counts the values of an iteration (including start) without building the array
+def count_steps(fstart, fstop, finc):
+    steps_float = (fstop - fstart) / finc
+    n = int(np.floor(steps_float + EPS)) + 1
+    return max(n, 0)
+
+
+# Returns the description of an iterating variable that the Scheduler uses from the content of its fields:
+# {"start", "stop", "increment", "nesting level", "num_values", "scan_index"}, or None if they are not well defined.
+# Only decreasing scans (stop < start) are accepted. VariablesModel and Variables both use it so that a scan is the same
+# whether its points are compiled by the GUI or in the background.
+def iterator_description(start, stop, increment, nesting_level, scan_index):
+    try:
+        start = float(start)
+        stop = float(stop)
+        if stop >= start:
+            return None
+        increment = float(increment)
+        nesting_lvl = int(nesting_level)
+        scan_index = int(scan_index)
+        # TODO: replace this with something that doesn't require allocating memory
+        num_values = len(np.arange(start, stop + increment, increment))
+    except (TypeError, ValueError, ZeroDivisionError):
+        return None
+    return {"start": start, "stop": stop, "increment": increment, "nesting level": nesting_lvl,
+            "num_values": num_values, "scan_index": scan_index}
+
+
+# Executes the code of a code variable and returns the value it returns
+def evaluate_code_variable(code, namespace):
+    loc_dict = {}
+    expressions.execute(code, namespace, loc_dict)
+    value = loc_dict["_return_"]
+    "%.9g" % value # Make sure that the value is a number
+    return value
+
+
+# Analyses the code of the code variables. `code` maps variable names to their code, `variable_names` are the names of
+# all the variables and `namespace_names` the other names that the code may use.
+# Returns (used_names, dependencies, order, unresolvable) where `used_names` maps each code variable to the names it
+# reads, `dependencies` to the variables it uses, `order` is an evaluation order and `unresolvable` the set of code
+# variables that cannot be evaluated (syntax errors, undefined names and circular dependencies).
+def analyse_code_variables(code, variable_names, namespace_names):
+    used_names = {}
+    dependencies = {}
+    unresolvable = set()
+    for var_name, var_set in code.items():
+        try:
+            names = expressions.free_names(var_set)
+        except SyntaxError as e:
+            print("Error: Variable %s has invalid code: %s" % (var_name, e))
+            names = frozenset()
+            unresolvable.add(var_name)
+        undefined = names - variable_names - namespace_names
+        if len(undefined) > 0:
+            print("Error: Variable %s uses undefined names: %s" % (var_name, ", ".join(sorted(undefined))))
+            unresolvable.add(var_name)
+        used_names[var_name] = names
+        dependencies[var_name] = names & variable_names
+
+    order, cycles = expressions.dependency_order(
+        {var_name: dependencies[var_name] & code.keys() for var_name in code})
+    for cycle in cycles:
+        print("Error: Circular dependency between variables: %s" % ", ".join(sorted(cycle)))
+        unresolvable.update(cycle)
+        order.extend(sorted(cycle))
+
+    return used_names, dependencies, order, unresolvable
+
+
+class Variable:
+    __slots__ = ("name", "set", "iterator", "start", "stop", "increment", "scan_index", "nesting_level")
+
+    def __init__(self, name, set=None, iterator=False, start=None, stop=None, increment=None, scan_index=None,
+                 nesting_level=None):
+        self.name = name
+        self.set = set
+        self.iterator = iterator
+        self.start = start
+        self.stop = stop
+        self.increment = increment
+        self.scan_index = scan_index
+        self.nesting_level = nesting_level
+
+    @classmethod
+    def from_pystruct(cls, variable):
+        return cls(variable["name"], variable.get("set"), bool(variable.get("iterator")), variable.get("start"),
+                   variable.get("stop"), variable.get("increment"), variable.get("scan index"),
+                   variable.get("nesting level"))
+
+    # Returns a copy of the variable with a different scan index
+    def with_scan_index(self, scan_index):
+        return Variable(self.name, self.set, self.iterator, self.start, self.stop, self.increment, str(scan_index),
+                        self.nesting_level)
+
+    # Returns (kind, definition). kind is "iterator", "numeric" (definition is the value), "code" (definition is the
+    # code to execute) or None if the variable is not defined.
+    def definition(self):
+        if self.iterator:
+            return "iterator", None
+        if type(self.set) != str:
+            return None, None
+        try:
+            return "numeric", float(self.set)
+        except ValueError:
+            return "code", self.set.replace("return","_return_ =")
+
+    # Returns (start, stop, increment, number of values) of an iterating variable or None if they are not valid
+    def iteration_range(self):
+        try:
+            fstart = float(self.start)
+            fstop = float(self.stop)
+            finc = float(self.increment)
+        except (TypeError, ValueError):
+            return None
+        if finc > 0 and not (fstart < fstop - EPS):
+            return None
+        if finc < 0 and not (fstart > fstop + EPS):
+            return None
+        if finc == 0:
+            return None
+        return fstart, fstop, finc, count_steps(fstart, fstop, finc)
+
+    # Returns the current value of an iterating variable or None if it is not well defined
+    def iteration_value(self):
+        iteration_range = self.iteration_range()
+        if iteration_range is None:
+            return None
+        fstart, _, finc, n_steps = iteration_range
+        try:
+            isidx = int(self.scan_index)
+        except (TypeError, ValueError):
+            return None
+        if not (0 <= isidx < n_steps):
+            return None
+        return round(fstart + isidx * finc, 10)
+
+
+# The variables of a sequence. It offers the same interface as VariablesModel to the Scheduler.
+class Variables:
+    __slots__ = ("groups", "_variables", "_values")
+
+    def __init__(self, groups):
+        self.groups = groups # dict group name -> list of Variable
+        self._variables = {variable.name: variable for group in groups.values() for variable in group}
+        self._values = None # cached result of get_variables_dict
+
+    @classmethod
+    def from_pystruct(cls, variables_dict):
+        return cls({group: [Variable.from_pystruct(variable) for variable in variables]
+                    for group, variables in variables_dict.items()})
+
+    def variable_exists(self, var_name):
+        return var_name in self._variables
+
+    # Returns a copy of the variables in which the iterating variables have the indices in `scanvars_indices`.
+    # Variables that don't change are shared with this instance.
+    def with_indices(self, scanvars_indices):
+        groups = {}
+        for group, variables in self.groups.items():
+            groups[group] = [variable.with_scan_index(scanvars_indices[variable.name])
+                             if variable.name in scanvars_indices else variable for variable in variables]
+        return Variables(groups)
+
+    # Returns a dictionary of all variables and their values. This includes iterating variables.
+    # Values are rounded to the same precision with which VariablesModel displays them.
+    def get_variables_dict(self):
+        if self._values is None:
+            self._values = self._evaluate()
+        return dict(self._values)
+
+    def _evaluate(self):
+        namespace = variables_namespace()
+        code = {}
+        for var_name, variable in self._variables.items():
+            kind, definition = variable.definition()
+            if kind == "iterator":
+                value = variable.iteration_value()
+                if value is not None:
+                    namespace[var_name] = value
+            elif kind == "numeric":
+                namespace[var_name] = definition
+            elif kind == "code":
+                code[var_name] = definition
+
+        _, dependencies, order, unresolvable = analyse_code_variables(code, self._variables.keys(),
+                                                                      namespace.keys())
+        for var_name in order:
+            if var_name in unresolvable or dependencies[var_name] - namespace.keys():
+                continue
+            try:
+                namespace[var_name] = evaluate_code_variable(code[var_name], namespace)
+            except Exception as e:
+                print("Error: Variable %s cannot be numerically evaluated: %r" % (var_name, e))
+
+        return {var_name: float("%.9g" % namespace[var_name]) for var_name in self._variables
+                if var_name in namespace}
+
+    def get_iterating_variables(self):
+        iter_vars = {}
+        for var_name, variable in self._variables.items():
+            if variable.iterator:
+                description = iterator_description(variable.start, variable.stop, variable.increment,
+                                                   variable.nesting_level, variable.scan_index)
+                if description is None: # When values are not well defined
+                    return {}
+                iter_vars[var_name] = description
+        return iter_vars
+
+    def reset_indices(self):
+        for variable in self._variables.values():
+            if variable.iterator:
+                variable.scan_index = "0"
+        self._values = None
+
+    def set_iterating_variables_indices(self, scanvars_indices):
+        for var_name, idx in scanvars_indices.items():
+            self._variables[var_name].scan_index = str(idx)
+        self._values = None
+
+
+class DigitalEvent:
+    __slots__ = ("duration", "state")
+
+    def __init__(self, duration, state):
+        self.duration = duration
+        self.state = state
+
+    def compile(self, namespace):
+        return {'type': 'boolean',
+                'duration': expressions.evaluate(self.duration, namespace),
+                'state': int(self.state)}
+
+
+class AnalogEvent:
+    __slots__ = ("duration", "function", "parameters")
+
+    # Parameters of each function type, with the names used in the compiled events
+    function_parameters = {"constant": ["val"],
+                           "linear": ["start_val", "end_val"],
+                           "exp": ["start_val", "end_val", "gamma"],
+                           "sin": ["frequency", "amplitude", "offset", "phase"]}
+    compiled_names = {"val": "value"}
+
+    def __init__(self, duration, function, parameters):
+        self.duration = duration
+        self.function = function
+        self.parameters = parameters # dict parameter name -> expression
+
+    @classmethod
+    def from_pystruct(cls, event):
+        function = event['function']
+        if function not in cls.function_parameters:
+            raise definitions.SequenceException('Unknown function type: %s' % function)
+        return cls(event['duration'], function,
+                   {parameter: event[parameter] for parameter in cls.function_parameters[function]})
+
+    def compile(self, namespace):
+        compiled_event = {'type': self.function,
+                          'duration': expressions.evaluate(self.duration, namespace)}
+        for parameter, expression in self.parameters.items():
+            compiled_event[self.compiled_names.get(parameter, parameter)] = expressions.evaluate(expression, namespace)
+        return compiled_event
+
+
+class Track:
+    __slots__ = ("chan", "offset", "events")
+
+    def __init__(self, chan, offset, events):
+        self.chan = chan # hardware.Channel
+        self.offset = offset
+        self.events = events
+
+    @classmethod
+    def from_pystruct(cls, track, cards):
+        chan = cards[track["chan"]["card"]].channels[track["chan"]["index"]]
+        if chan.card.type == definitions.DigitalTrack:
+            events = [DigitalEvent(event["duration"], event["state"]) for event in track["events"]]
+        else:
+            events = [AnalogEvent.from_pystruct(event) for event in track["events"]]
+        return cls(chan, track["offset"], events)
+
+
+class Routine:
+    __slots__ = ("name", "tracks", "_used_names", "_compiled")
+
+    # Number of compiled versions of each routine kept by compile_cached, the oldest ones are discarded first
+    compiled_cache_size = 16
+
+    def __init__(self, name, tracks):
+        self.name = name
+        self.tracks = tracks
+        self._used_names = None
+        self._compiled = {} # fingerprint -> compiled routine
+
+    @classmethod
+    def from_pystruct(cls, name, tracks, cards):
+        return cls(name, [Track.from_pystruct(track, cards) for track in tracks])
+
+    # Returns a dict representing the routine in which the variables have been replaced by their numerical values.
+    # The dict has the structure key->{'offset':num, 'events':[], 'chan':cards.Channel} where key is a pair
+    # (card, chan_num)
+    def compile(self, namespace):
+        points = {}
+        for track in self.tracks:
+            chan_dict = track.chan.get_channel_dict()
+            chan_key = (chan_dict['card'], chan_dict['index'])
+            points[chan_key] = {"offset": expressions.evaluate(track.offset, namespace),
+                                "events": [event.compile(namespace) for event in track.events],
+                                "chan": track.chan}
+        return points
+
+    # Returns the sorted tuple of names that the expressions of the routine read
+    def used_names(self):
+        if self._used_names is None:
+            names = set()
+            for track in self.tracks:
+                names |= expressions.free_names(track.offset, "eval")
+                for event in track.events:
+                    names |= expressions.free_names(event.duration, "eval")
+                    if isinstance(event, AnalogEvent):
+                        for expression in event.parameters.values():
+                            names |= expressions.free_names(expression, "eval")
+            self._used_names = tuple(sorted(names))
+        return self._used_names
+
+    # Same as compile, but the result is reused while the variables that the routine reads keep their values, so during
+    # a scan only the routines that use the scanned variables are compiled again. The result must not be modified.
+    def compile_cached(self, variables_dict, namespace):
+        fingerprint = tuple((name, type(variables_dict[name]), variables_dict[name])
+                            for name in self.used_names() if name in variables_dict)
+        try:
+            compiled = self._compiled.get(fingerprint)
+        except TypeError: # Values that can't be hashed (e.g. arrays) are not cached
+            return self.compile(namespace)
+
+        if compiled is None:
+            compiled = self.compile(namespace)
+            if len(self._compiled) >= self.compiled_cache_size:
+                del self._compiled[next(iter(self._compiled))]
+            self._compiled[fingerprint] = compiled
+        return compiled
+
+
+class PlaylistNode:
+    __slots__ = ("type", "name", "repeat", "duration", "children")
+
+    def __init__(self, type, name=None, repeat=None, duration=None, children=None):
+        self.type = type # definitions.Routine, definitions.Gap or None for the root of a playlist
+        self.name = name
+        self.repeat = repeat
+        self.duration = duration
+        self.children = children if children is not None else []
+
+    @classmethod
+    def from_pystruct(cls, node):
+        children = [cls.from_pystruct(child) for child in node['children']]
+        if 'type' not in node: # Root of a playlist
+            return cls(None, node['name'], children=children)
+        return cls(node['type'], node.get('name'), node.get('repeat'), node.get('duration'), children)
+
+    # Returns a representation of the branch written in absolute times with all variable values replaced.
+    # `compile_routine` is a function that returns the compiled routine (see Routine.compile) given its name.
+    def compile(self, compile_routine, namespace):
+        sequence = {}
+        tend = 0 # end time of current routine (including repeats)
+
+        if self.type == definitions.Routine:
+            # find routine points relative to routine start
+            routine_points = compile_routine(self.name)
+            routine_repeat = int(expressions.evaluate(self.repeat, namespace))
+
+            tstart = 0 # When we repeat a routine we need to keep track of the duration to know the start time of the next one
+
+            for _ in range(routine_repeat):
+                tstart = tend
+                for chan_key in routine_points:
+                    offset = routine_points[chan_key]["offset"]
+                    events = routine_points[chan_key]["events"]
+                    channel = routine_points[chan_key]["chan"]
+
+                    if chan_key not in sequence:
+                        sequence[chan_key] = {'chan': channel, 'events': []}
+                    t = offset + tstart
+                    for event in events:
+                        compiled_event = event.copy()
+                        compiled_event['time'] = t
+                        sequence[chan_key]['events'].append(compiled_event)
+                        t += event['duration']
+                        tend = max(tend, t)
+
+        elif self.type == definitions.Gap:
+            # TODO: children of gaps are added but with the gap missing.
+            pass
+
+        for child in self.children:
+            child_points = child.compile(compile_routine, namespace)
+
+            for chan_key in child_points:
+                if chan_key not in sequence:
+                    sequence[chan_key] = {'chan': child_points[chan_key]['chan'], 'events': []}
+                for chan_point in child_points[chan_key]['events']:
+                    chan_point['time'] = chan_point['time']+tend
+                    sequence[chan_key]['events'].append(chan_point)
+
+        return sequence
+
+
+# The playlists of a sequence. It offers the same interface as PlaylistModel to the Scheduler.
+class Playlist:
+    __slots__ = ("playlists", "active_playlist", "variables", "routines")
+
+    def __init__(self, playlists, variables: Variables, routines):
+        self.playlists = playlists # list of PlaylistNode
+        self.active_playlist = None
+        self.variables = variables
+        self.routines = routines # dict name -> Routine
+
+    def set_active_playlist(self, index):
+        self.active_playlist = index
+
+    # Returns a representation of the sequence written in absolute times with all variable values replaced.
+    # See PlaylistModel.compile_active_playlist
+    def compile_active_playlist(self, variables_dict=None):
+        if self.active_playlist is None:
+            return None
+        if variables_dict is None:
+            variables_dict = self.variables.get_variables_dict()
+        namespace = sequence_namespace(variables_dict)
+        return self.playlists[self.active_playlist].compile(
+            lambda routine_name: self.routines[routine_name].compile_cached(variables_dict, namespace), namespace)
+
+
+class Sequence:
+    __slots__ = ("variables", "routines", "playlist")
+
+    def __init__(self, variables: Variables, routines, playlist: Playlist):
+        self.variables = variables
+        self.routines = routines
+        self.playlist = playlist
+
+    # Builds a sequence from the structure saved in sequence files. `cards` are the cards of the hardware
+    # (see Hardware.get_cards), used to find the channel of each track.
+    @classmethod
+    def from_pystruct(cls, sequence, cards):
+        variables = Variables.from_pystruct(sequence["variables"])
+        routines = {name: Routine.from_pystruct(name, tracks, cards) for name, tracks in sequence["routines"].items()}
+        playlist = Playlist([PlaylistNode.from_pystruct(node) for node in sequence["playlist"]], variables, routines)
+        return cls(variables, routines, playlist)
+
+    # Compiles the active playlist with the iterating variables set to the indices in `scanvars_indices`. The sequence
+    # is not modified so several points can be compiled at the same time from different threads.
+    # Returns (compiled sequence, variables dict, iterating variables dict)
+    def compile_point(self, scanvars_indices):
+        variables = self.variables.with_indices(scanvars_indices)
+        variables_dict = variables.get_variables_dict()
+        playlist = Playlist(self.playlist.playlists, variables, self.routines)
+        playlist.set_active_playlist(self.playlist.active_playlist)
+        return playlist.compile_active_playlist(variables_dict), variables_dict, variables.get_iterating_variables()
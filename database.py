@@ -1,3 +1,6 @@
+import collections
+import threading
+import time
 
 
 class Database:
@@ -5,5 +8,216 @@ class Database:
     def store_run_parameters(self, run_id, variables, iterators):
         pass
 
+    # Stores a list of (run_id, variables, iterators). Databases that can store several runs in one request should
+    # override it. A batch that fails may be retried as a whole by WriteBehindDatabase.
+    def store_run_parameters_batch(self, records):
+        for run_id, variables, iterators in records:
+            self.store_run_parameters(run_id, variables, iterators)
+
     def get_latest_run_id(self):
-        return 0
\ No newline at end of file
+        return 0
+
+    next_run_id = None # used by the default reserve_run_ids
+
+    # Reserves `count` consecutive run ids and returns the first one. Databases that can be shared by several instances
+    # of the player must do it atomically, by default the ids are only unique within this instance.
+    def reserve_run_ids(self, count):
+        if self.next_run_id is None:
+            self.next_run_id = self.get_latest_run_id() + 1
+        first = self.next_run_id
+        self.next_run_id += count
+        return first
+
+    # Writes what hasn't been stored yet and waits at most `timeout` seconds for it (None waits until it is done, 0
+    # doesn't wait). Returns True if everything has been stored.
+    def flush(self, timeout=None):
+        return True
+
+    # Stores what is left and releases the database
+    def close(self, timeout=10):
+        pass
+
+
+# Stores the run parameters of another Database from a background thread so that the latency of the database never
+# delays the next shot. Records are queued (at most `max_pending`, newer ones are dropped when the queue is full) and
+# written in batches of up to `batch_size` records, every `flush_interval` seconds or as soon as a batch is full.
+# Batches that fail are retried with exponential backoff until they are stored or the writer is closed.
+# Run ids are read and reserved without waiting for the batch being written, so the database must allow
+# get_latest_run_id and reserve_run_ids to be called while store_run_parameters_batch runs in another thread.
+class WriteBehindDatabase(Database):
+    def __init__(self, database, max_pending=10000, batch_size=100, flush_interval=0.5, retry_delay=1.0,
+                 max_retry_delay=30.0):
+        self.database = database
+        self.max_pending = max_pending
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+
+        self.database_lock = threading.Lock() # serializes the writes of the writer thread and close
+        self.condition = threading.Condition()
+        self.pending = collections.deque() # (run_id, variables, iterators) waiting to be written
+        self.writing = 0 # number of records being written by the writer thread
+        self.flushing = False # True until the queue has been written and the database flushed
+        self.closing = False
+        self.close_deadline = None
+        self.dropped = 0 # number of records that could not be stored
+        self.latest_run_id = None # latest run_id queued, it may not have reached the database yet
+
+        self.thread = threading.Thread(target=self._run, name="database writer", daemon=True)
+        self.thread.start()
+
+    def store_run_parameters(self, run_id, variables, iterators):
+        with self.condition:
+            if self.closing or len(self.pending) >= self.max_pending:
+                self.dropped += 1
+                print("Database: write queue %s, run %d not stored" % ("closed" if self.closing else "full", run_id))
+                return
+            self.pending.append((run_id, variables, iterators))
+            if self.latest_run_id is None or run_id > self.latest_run_id:
+                self.latest_run_id = run_id
+            if len(self.pending) >= self.batch_size:
+                self.condition.notify_all()
+
+    def get_latest_run_id(self):
+        latest_run_id = self.database.get_latest_run_id()
+        with self.condition:
+            if self.latest_run_id is not None and self.latest_run_id > latest_run_id:
+                latest_run_id = self.latest_run_id
+        return latest_run_id
+
+    def reserve_run_ids(self, count):
+        return self.database.reserve_run_ids(count)
+
+    # The writer thread writes the queue and then flushes the database, so that nothing waits for it with timeout 0
+    def flush(self, timeout=None):
+        with self.condition:
+            if self.closing: # close flushes the database itself
+                done = lambda: not self.pending and not self.writing
+            else:
+                self.flushing = True
+                self.condition.notify_all()
+                done = lambda: not self.pending and not self.writing and not self.flushing
+            if timeout == 0:
+                return done()
+            return self.condition.wait_for(done, timeout)
+
+    def close(self, timeout=10):
+        with self.condition:
+            self.closing = True
+            self.close_deadline = time.monotonic() + timeout
+            self.condition.notify_all()
+        self.thread.join(timeout + 1)
+        if self.dropped:
+            print("Database: %d runs could not be stored" % self.dropped)
+        with self.database_lock:
+            self.database.close(timeout)
+
+    # This function runs in the writer thread
+    def _run(self):
+        while True:
+            with self.condition:
+                deadline = time.monotonic() + self.flush_interval
+                while not (self.closing or self.flushing or len(self.pending) >= self.batch_size):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self.condition.wait(remaining)
+
+                if not self.pending:
+                    if self.closing or not self.flushing:
+                        self.flushing = False
+                        self.condition.notify_all()
+                        if self.closing:
+                            return
+                        continue
+                    batch = None # everything queued has been written, the database has to be flushed
+                elif self.closing and time.monotonic() >= self.close_deadline:
+                    self.dropped += len(self.pending)
+                    self.pending.clear()
+                    self.condition.notify_all()
+                    return
+                else:
+                    batch = [self.pending.popleft() for _ in range(min(self.batch_size, len(self.pending)))]
+                    self.writing = len(batch)
+
+            if batch is None:
+                self._flush_database()
+                with self.condition:
+                    if not self.pending: # otherwise the records queued in the meantime are written and flushed too
+                        self.flushing = False
+                    self.condition.notify_all()
+                continue
+
+            self._write(batch)
+
+            with self.condition:
+                self.writing = 0
+                self.condition.notify_all()
+
+    def _flush_database(self):
+        try:
+            with self.database_lock:
+                self.database.flush()
+        except Exception as e:
+            print("Database: could not flush (%s: %s)" % (type(e).__name__, e))
+
+    # Stores `batch`, retrying until it works or the writer is closed and its deadline has passed
+    def _write(self, batch):
+        delay = self.retry_delay
+        while True:
+            try:
+                with self.database_lock:
+                    self.database.store_run_parameters_batch(batch)
+                return
+            except Exception as e:
+                print("Database: could not store runs %d to %d, retrying in %g s (%s: %s)" %
+                      (batch[0][0], batch[-1][0], delay, type(e).__name__, e))
+
+            with self.condition:
+                if self.closing:
+                    remaining = self.close_deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.dropped += len(batch)
+                        return
+                    self.condition.wait(min(delay, remaining))
+                else:
+                    # Only closing cuts the delay short, new records must not make it retry more often
+                    self.condition.wait_for(lambda: self.closing, delay)
+            delay = min(2*delay, self.max_retry_delay)
+
+
+# Hands out run ids from blocks of `block_size` ids reserved with Database.reserve_run_ids, so that several instances
+# sharing a database get different ids while the database is only queried once per block.
+class RunIdAllocator:
+    def __init__(self, db, block_size=100):
+        self.database = db
+        self.block_size = block_size
+        self.lock = threading.Lock()
+        self.blocks = collections.deque() # [first, end) of the reserved ids that haven't been used, in order
+
+    # Returns the run id that comes `offset` ids after the next one, without using it. Blocks are reserved as needed.
+    def peek(self, offset=0):
+        with self.lock:
+            available = sum(end - first for first, end in self.blocks)
+            if available <= offset:
+                count = max(self.block_size, offset + 1 - available)
+                first = self.database.reserve_run_ids(count)
+                if self.blocks and self.blocks[-1][1] == first:
+                    self.blocks[-1][1] += count
+                else:
+                    self.blocks.append([first, first + count])
+
+            for first, end in self.blocks:
+                if offset < end - first:
+                    return first + offset
+                offset -= end - first
+
+    # Uses the next run id and returns it
+    def take(self):
+        run_id = self.peek()
+        with self.lock:
+            self.blocks[0][0] += 1
+            if self.blocks[0][0] == self.blocks[0][1]:
+                self.blocks.popleft()
+        return run_id
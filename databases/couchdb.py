@@ -1,22 +1,57 @@
-
 import couchdb
 
-class CouchDBDatabase:
+import database
+import definitions
+
+# Mango index on run_id, created when connecting so that the latest run_id is found without scanning the database
+RUN_ID_INDEX = "run_id-json-index"
+# Document with the next run id that hasn't been reserved, see reserve_run_ids
+RUN_ID_COUNTER = "run_id_counter"
+
+class CouchDBDatabase(database.Database):
 
     def __init__(self,username, password, host, port, database):
         self.couch = couchdb.Server(f'http://{username}:{password}@{host}:{port}/')
         self.db = self.couch[database]
+        # Creating an index that already exists does nothing
+        self.db.index()[RUN_ID_INDEX, RUN_ID_INDEX] = [{"run_id": "desc"}]
+
+    # The id of the document of each run is derived from its run_id, so storing a run again (e.g. when a batch is
+    # retried after a partial failure) is a conflict instead of a duplicate
+    @staticmethod
+    def run_document(run_id, variables, iterators):
+        return {'_id': 'run-%012d' % run_id, 'run_id': run_id, 'variables': variables, 'iterators': iterators}
 
     def store_run_parameters(self, run_id, variables, iterators):
-        self.db.save({'run_id':run_id, 'variables':variables, 'iterators': iterators})
+        self.store_run_parameters_batch([(run_id, variables, iterators)])
+
+    # All the runs are sent in a single _bulk_docs request
+    def store_run_parameters_batch(self, records):
+        results = self.db.update([self.run_document(*record) for record in records])
+        errors = [(doc_id, error) for success, doc_id, error in results
+                  if not success and not isinstance(error, couchdb.ResourceConflict)]
+        if errors:
+            raise definitions.DatabaseException("Could not store %d documents: %s" %
+                                                (len(errors), ", ".join("%s (%s)" % e for e in errors[:5])))
 
     def get_latest_run_id(self):
-        # TODO add code to creat index if it does't exist
-        # {"index": {"fields": [{"run_id":"desc"}]},"name": "run_id-json-index","type": "json"}
-        mango = {"selector": {"run_id": {"$gte": 0}}, "sort": [{"run_id": "desc"}], "limit": 1}
-        # print(mango)
+        mango = {"selector": {"run_id": {"$gte": 0}}, "sort": [{"run_id": "desc"}], "fields": ["run_id"], "limit": 1,
+                 "use_index": [RUN_ID_INDEX, RUN_ID_INDEX]}
         try:
             row = next(self.db.find(mango))
             return row['run_id']
         except StopIteration: # New database
-            return 0
\ No newline at end of file
+            return 0
+
+    # The counter document is updated with its revision, so when two instances reserve ids at the same time one of them
+    # gets a conflict and tries again with the new value
+    def reserve_run_ids(self, count):
+        while True:
+            counter = self.db.get(RUN_ID_COUNTER) or {"_id": RUN_ID_COUNTER, "next_run_id": 1}
+            first = max(counter["next_run_id"], self.get_latest_run_id() + 1)
+            counter["next_run_id"] = first + count
+            try:
+                self.db.save(counter)
+                return first
+            except couchdb.ResourceConflict:
+                continue
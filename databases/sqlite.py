@@ -0,0 +1,146 @@
+# Run history in a local SQLite file, no server needed.
+# Every run is a row of `runs` (run_id, time when it was stored). The values of the variables and the definition of the
+# iterating variables are stored one row per variable in `run_variables` and `run_iterators`, with the variable names
+# replaced by ids from `names` to keep the rows small. `run_iterators` is indexed by name so that the runs where a
+# variable was scanned are found without reading the others.
+#
+#   db = SQLiteDatabase("runs.sqlite")
+#   db.find_scanned_runs("detuning")  # [run_id, ...]
+#   db.get_run_parameters(run_id)     # (variables, iterators) as given to store_run_parameters
+import sqlite3
+import threading
+import time
+
+import database
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (run_id INTEGER PRIMARY KEY, time REAL NOT NULL);
+CREATE INDEX IF NOT EXISTS runs_time ON runs (time);
+CREATE TABLE IF NOT EXISTS names (name_id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE);
+CREATE TABLE IF NOT EXISTS run_variables (
+    run_id INTEGER NOT NULL, name_id INTEGER NOT NULL, value REAL,
+    PRIMARY KEY (run_id, name_id)) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS run_iterators (
+    run_id INTEGER NOT NULL, name_id INTEGER NOT NULL, start REAL, stop REAL, increment REAL, nesting_level INTEGER,
+    num_values INTEGER, scan_index INTEGER,
+    PRIMARY KEY (run_id, name_id)) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS run_iterators_name ON run_iterators (name_id, run_id);
+CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL);
+"""
+
+# Columns of run_iterators and the corresponding keys of the iterators dictionary
+ITERATOR_FIELDS = (("start", "start"), ("stop", "stop"), ("increment", "increment"),
+                   ("nesting_level", "nesting level"), ("num_values", "num_values"), ("scan_index", "scan_index"))
+
+
+class SQLiteDatabase(database.Database):
+
+    def __init__(self, path):
+        self.path = path
+        # The connection may be used from the thread of WriteBehindDatabase, calls are serialized by the lock
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock:
+            # WAL lets readers (e.g. analysis scripts) run while runs are written, and with synchronous=NORMAL commits
+            # don't wait for the disk
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("PRAGMA synchronous=NORMAL")
+            self.connection.execute("PRAGMA busy_timeout=5000")
+            self.connection.executescript(SCHEMA)
+            self.name_ids = dict(self.connection.execute("SELECT name, name_id FROM names"))
+
+    # Returns the id of every name, adding the new ones to `names`. Must be called inside a transaction: the result is
+    # only valid once it is committed, so it is not stored in self.name_ids here.
+    def _get_name_ids(self, names):
+        new_names = [(name,) for name in names if name not in self.name_ids]
+        if new_names:
+            self.connection.executemany("INSERT OR IGNORE INTO names (name) VALUES (?)", new_names)
+            return dict(self.connection.execute("SELECT name, name_id FROM names"))
+        return self.name_ids
+
+    def store_run_parameters(self, run_id, variables, iterators):
+        self.store_run_parameters_batch([(run_id, variables, iterators)])
+
+    # All the runs are stored in a single transaction. Storing a run again replaces it.
+    def store_run_parameters_batch(self, records):
+        now = time.time()
+        names = set()
+        for _, variables, iterators in records:
+            names.update(variables)
+            names.update(iterators)
+        with self.lock:
+            with self.connection:
+                name_ids = self._get_name_ids(names)
+
+                run_ids = [(run_id,) for run_id, _, _ in records]
+                self.connection.executemany("DELETE FROM run_variables WHERE run_id = ?", run_ids)
+                self.connection.executemany("DELETE FROM run_iterators WHERE run_id = ?", run_ids)
+                self.connection.executemany("INSERT OR REPLACE INTO runs (run_id, time) VALUES (?, ?)",
+                                            [(run_id, now) for run_id, _, _ in records])
+                self.connection.executemany("INSERT INTO run_variables (run_id, name_id, value) VALUES (?, ?, ?)",
+                                            [(run_id, name_ids[name], value)
+                                             for run_id, variables, _ in records for name, value in variables.items()])
+                self.connection.executemany(
+                    "INSERT INTO run_iterators (run_id, name_id, %s) VALUES (?, ?, %s)" %
+                    (", ".join(column for column, _ in ITERATOR_FIELDS), ", ".join("?" for _ in ITERATOR_FIELDS)),
+                    [(run_id, name_ids[name]) + tuple(iterator.get(key) for _, key in ITERATOR_FIELDS)
+                     for run_id, _, iterators in records for name, iterator in iterators.items()])
+            # The new names are only cached once the transaction has been committed
+            self.name_ids = name_ids
+
+    def get_latest_run_id(self):
+        with self.lock:
+            run_id, = self.connection.execute("SELECT MAX(run_id) FROM runs").fetchone()
+        return run_id if run_id is not None else 0
+
+    # The next free run id is kept in `counters`. BEGIN IMMEDIATE takes the write lock of the file before reading it, so
+    # that two instances can't reserve the same ids.
+    def reserve_run_ids(self, count):
+        with self.lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                row = self.connection.execute("SELECT value FROM counters WHERE name = 'next_run_id'").fetchone()
+                latest_run_id, = self.connection.execute("SELECT MAX(run_id) FROM runs").fetchone()
+                first = max(row[0] if row is not None else 1, (latest_run_id or 0) + 1)
+                self.connection.execute("INSERT OR REPLACE INTO counters (name, value) VALUES ('next_run_id', ?)",
+                                        (first + count,))
+                self.connection.commit()
+            except Exception:
+                self.connection.rollback()
+                raise
+        return first
+
+    # Returns (variables, iterators) of the run in the format of store_run_parameters, None if it wasn't stored
+    def get_run_parameters(self, run_id):
+        with self.lock:
+            if self.connection.execute("SELECT 1 FROM runs WHERE run_id = ?", (run_id,)).fetchone() is None:
+                return None
+            variables = dict(self.connection.execute(
+                "SELECT name, value FROM run_variables JOIN names USING (name_id) WHERE run_id = ?", (run_id,)))
+            rows = self.connection.execute(
+                "SELECT name, %s FROM run_iterators JOIN names USING (name_id) WHERE run_id = ?" %
+                ", ".join(column for column, _ in ITERATOR_FIELDS), (run_id,)).fetchall()
+        iterators = {row[0]: {key: value for (_, key), value in zip(ITERATOR_FIELDS, row[1:])} for row in rows}
+        return variables, iterators
+
+    # Returns the run_ids of the runs where the variable `name` was scanned, optionally only those stored between
+    # `start_time` and `end_time` (seconds since the epoch)
+    def find_scanned_runs(self, name, start_time=None, end_time=None):
+        query = "SELECT run_id FROM run_iterators JOIN names USING (name_id)"
+        conditions = ["name = ?"]
+        parameters = [name]
+        if start_time is not None or end_time is not None:
+            query += " JOIN runs USING (run_id)"
+            if start_time is not None:
+                conditions.append("time >= ?")
+                parameters.append(start_time)
+            if end_time is not None:
+                conditions.append("time <= ?")
+                parameters.append(end_time)
+        query += " WHERE %s ORDER BY run_id" % " AND ".join(conditions)
+        with self.lock:
+            return [run_id for run_id, in self.connection.execute(query, parameters)]
+
+    def close(self, timeout=10):
+        with self.lock:
+            self.connection.close()
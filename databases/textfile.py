@@ -1,18 +1,150 @@
-class TextfileDatabase:
+# Run log in a text file with one JSON line per run: {"run_id", "time", "variables", "iterators"}.
+# Runs are only ever appended, and the file is synced to disk at most every `fsync_interval` seconds (and when flushed
+# or closed), so storing a run costs one buffered write. When the file reaches `max_size` bytes it is renamed to
+# <filepath>.1, <filepath>.2... (the highest number is the most recent) and a new one is started.
+# After a crash the last line may be incomplete, it is ignored when reading and the next run starts on a new line.
+# The next run id that hasn't been reserved is kept in <filepath>.next_run_id, see reserve_run_ids.
+import glob
+import json
+import os
+import threading
+import time
 
-    def __init__(self, filepath):
+try:
+    import fcntl
+except ImportError: # Windows
+    fcntl = None
+    import msvcrt
+
+import database
+
+TAIL_CHUNK = 4096 # bytes read at a time from the end of the file to find the last run
+
+
+class TextfileDatabase(database.Database):
+
+    def __init__(self, filepath, max_size=100*1024*1024, fsync_interval=1.0):
         self.filepath=filepath
+        self.max_size = max_size
+        self.fsync_interval = fsync_interval
+        self.lock = threading.Lock()
+        self.last_fsync = time.monotonic()
+        self.unsynced = False
+        self.file = None
+        self._open()
+
+    def _open(self):
+        self.file = open(self.filepath, mode="ab")
+        # Terminate the line that was being written if the program stopped in the middle of it
+        if self.file.tell() > 0:
+            with open(self.filepath, mode="rb") as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    self.file.write(b"\n")
+
+    # Returns the rotated files from the oldest to the most recent
+    def rotated_files(self):
+        suffixes = [path[len(self.filepath)+1:] for path in glob.glob(glob.escape(self.filepath) + ".*")]
+        return ["%s.%d" % (self.filepath, n) for n in sorted(int(s) for s in suffixes if s.isdigit())]
+
+    def _rotate(self):
+        self._sync()
+        self.file.close()
+        rotated = self.rotated_files()
+        number = int(rotated[-1].rsplit(".", 1)[1]) + 1 if rotated else 1
+        os.replace(self.filepath, "%s.%d" % (self.filepath, number))
+        self._open()
+
+    def _sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.last_fsync = time.monotonic()
+        self.unsynced = False
 
     def store_run_parameters(self, run_id, variables, iterators):
-        with open(self.filepath, encoding='utf-8', mode="w") as f:
-            f.write(str(run_id))
+        self.store_run_parameters_batch([(run_id, variables, iterators)])
+
+    def store_run_parameters_batch(self, records):
+        now = time.time()
+        data = b"".join(json.dumps({"run_id": run_id, "time": now, "variables": variables, "iterators": iterators})
+                        .encode("utf-8") + b"\n" for run_id, variables, iterators in records)
+        with self.lock:
+            if self.file.tell() > 0 and self.file.tell() + len(data) > self.max_size:
+                self._rotate()
+            self.file.write(data)
+            self.file.flush()
+            self.unsynced = True
+            if time.monotonic() - self.last_fsync >= self.fsync_interval:
+                self._sync()
+
+    def flush(self, timeout=None):
+        with self.lock:
+            if self.unsynced:
+                self._sync()
+        return True
 
-    # perform file operations
+    def close(self, timeout=10):
+        with self.lock:
+            self._sync()
+            self.file.close()
+
+    # Reads the file backwards until it finds a complete line with a run, so it doesn't depend on the size of the log.
+    # Files written by older versions only contain the run_id.
+    @staticmethod
+    def last_run_id(path):
+        with open(path, mode="rb") as f:
+            position = f.seek(0, os.SEEK_END)
+            tail = b""
+            while position > 0:
+                size = min(TAIL_CHUNK, position)
+                position -= size
+                f.seek(position)
+                tail = f.read(size) + tail
+                lines = tail.split(b"\n")
+                # The first line may be incomplete unless the start of the file has been reached
+                complete = lines if position == 0 else lines[1:]
+                for line in reversed(complete):
+                    try:
+                        run = json.loads(line)
+                    except ValueError: # empty or incomplete line
+                        continue
+                    return run if isinstance(run, int) else run["run_id"]
+                tail = lines[0]
+        return None
 
     def get_latest_run_id(self):
-        with open(self.filepath, encoding='utf-8', mode="r") as f:
+        with self.lock:
+            return self._latest_run_id()
+
+    def _latest_run_id(self):
+        self.file.flush()
+        for path in [self.filepath] + self.rotated_files()[::-1]:
+            run_id = self.last_run_id(path)
+            if run_id is not None:
+                return run_id
+        return 0
+
+    # The counter file is locked while it is read and updated so that instances sharing the log reserve different ids
+    def reserve_run_ids(self, count):
+        with self.lock, open(self.filepath + ".next_run_id", mode="a+") as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
             try:
-                run_id = int(f.readline())
-            except ValueError:
-                run_id=1
-        return run_id
+                f.seek(0)
+                content = f.read().strip()
+                first = max(int(content) if content.isdigit() else 1, self._latest_run_id() + 1)
+                f.seek(0)
+                f.truncate()
+                f.write(str(first + count))
+                f.flush()
+                os.fsync(f.fileno())
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+                else:
+                    f.seek(0)
+                    msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+        return first
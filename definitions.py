@@ -0,0 +1,39 @@
+# Definitions shared by the whole application that don't depend on Qt.
+
+# TrackTypes
+DigitalTrack = 0
+AnalogTrack = 1
+
+# VariableTypes
+NumericVariable = 0
+CodeVariable = 1
+
+# Playlist item types
+Routine = 0
+Gap = 1
+
+# Function Types
+Constant = 0
+Linear = 1
+ExpRise = 2
+ExpFall = 3
+Sine = 4
+
+
+class SequenceException(Exception):
+    pass
+
+class ConfigException(Exception):
+    pass
+
+class DatabaseException(Exception):
+    pass
+
+# Raised by Hardware when some of the output systems fail. `errors` maps the name of each failed output system to its
+# exception.
+class HardwareException(Exception):
+    def __init__(self, operation, errors):
+        self.operation = operation
+        self.errors = errors
+        details = ", ".join("%s (%s: %s)" % (name, type(e).__name__, e) for name, e in errors.items())
+        super().__init__("%s failed in %s" % (operation, details))
@@ -0,0 +1,60 @@
+# Minimal stand-in for the ARTIQ master to test ARTIQOutputSystem without hardware.
+# It serves the master_schedule RPC target (only submit) on the control port and publishes the schedule on the notify
+# port. Submitted experiments are run one after the other: each one is "running" for --duration seconds and then
+# removed from the schedule, like the real master does.
+from sipyco.pc_rpc import Server
+from sipyco.sync_struct import Notifier, Publisher
+import argparse
+import asyncio
+
+
+class StandInSchedule:
+    def __init__(self, notifier, duration):
+        self.notifier = notifier
+        self.duration = duration
+        self.next_rid = 0
+        self.queue = asyncio.Queue()
+
+    def submit(self, pipeline_name, expid, priority=0, due_date=None, flush=False):
+        rid = self.next_rid
+        self.next_rid += 1
+        self.notifier[rid] = {"pipeline": pipeline_name, "expid": expid, "priority": priority, "due_date": due_date,
+                              "flush": flush, "status": "pending"}
+        self.queue.put_nowait(rid)
+        return rid
+
+    async def run(self):
+        while True:
+            rid = await self.queue.get()
+            self.notifier[rid]["status"] = "running"
+            print("Running rid %d: %s" % (rid, self.notifier.raw_view[rid]["expid"]["class_name"]))
+            await asyncio.sleep(self.duration)
+            del self.notifier[rid]
+
+
+async def main(args):
+    notifier = Notifier(dict())
+    schedule = StandInSchedule(notifier, args.duration)
+
+    server = Server({"master_schedule": schedule}, builtin_terminate=True)
+    await server.start(args.bind, args.port_control)
+    publisher = Publisher({"schedule": notifier})
+    await publisher.start(args.bind, args.port_notify)
+    print("Stand-in master on %s, control port %d, notify port %d" % (args.bind, args.port_control, args.port_notify))
+
+    try:
+        await schedule.run()
+    finally:
+        await publisher.stop()
+        await server.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='ARTIQ master stand-in')
+    parser.add_argument('--bind', help='IP address to bind the server to.', default="127.0.0.1")
+    parser.add_argument('--port-control', help='Control (RPC) port', default=3251, type=int)
+    parser.add_argument('--port-notify', help='Notify (schedule) port', default=3250, type=int)
+    parser.add_argument('--duration', help='Duration of every experiment in seconds', default=0.5, type=float)
+    args = parser.parse_args()
+
+    asyncio.run(main(args))
@@ -12,14 +12,16 @@ class QuantumPlayer(EnvExperiment):
             self.setattr_device('ttl%d'%i)
         self.setattr_device('zotino0')
         self.ttls = [self.get_device("ttl%d"%i) for i in range(Nttl)]
-        self.setattr_argument("sequence", PYONValue(default=[]))
+        # Dictionary of arrays with one entry per event sorted by time: "time" (int64, mu), "type", "channel" and "value"
+        self.setattr_argument("sequence", PYONValue(default={}))
         self.setattr_argument("last_delay", NumberValue(default=0,type='int',ndecimals=0,step=1,scale=1))
         
     def prepare(self):
         self.last_delay64 = numpy.int64(self.last_delay)
-        self.sequence64 = []
-        for t,events in self.sequence:
-            self.sequence64.append((numpy.int64(t), events))
+        self.times = numpy.asarray(self.sequence.get("time", []), dtype=numpy.int64)
+        self.channel_types = numpy.asarray(self.sequence.get("type", []), dtype=numpy.int32)
+        self.channel_nums = numpy.asarray(self.sequence.get("channel", []), dtype=numpy.int32)
+        self.values = numpy.asarray(self.sequence.get("value", []), dtype=numpy.int32)
 
     @kernel
     def run(self):
@@ -36,20 +38,22 @@ class QuantumPlayer(EnvExperiment):
         print("After Init", self.core.mu_to_seconds(now_mu() - self.core.get_rtio_counter_mu()))
         delay(10*ms)
 
-        tprev = 0
-        for time, events in self.sequence64:
-            delay_mu(time-tprev)
-            for channel_type, channel_num, value in events:
-                if channel_type == DIGITAL:
-                    ttl = self.ttls[channel_num]
-                    if value == 1:
-                        ttl.on()
-                    else:
-                        ttl.off()
+        tprev = numpy.int64(0)
+        for i in range(len(self.times)):
+            time = self.times[i]
+            delay_mu(time-tprev) # Events at the same time have no delay between them
+            channel_num = self.channel_nums[i]
+            value = self.values[i]
+            if self.channel_types[i] == DIGITAL:
+                ttl = self.ttls[channel_num]
+                if value == 1:
+                    ttl.on()
+                else:
+                    ttl.off()
 
-                if channel_type == ANALOG:
-                    self.zotino0.write_dac_mu(channel_num, value)
-                    self.zotino0.load()
+            if self.channel_types[i] == ANALOG:
+                self.zotino0.write_dac_mu(channel_num, value)
+                self.zotino0.load()
             tprev = time
             
         # Add last delay
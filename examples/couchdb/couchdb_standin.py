@@ -0,0 +1,145 @@
+# Minimal in-memory stand-in for CouchDB to test CouchDBDatabase without a server.
+# It implements the part of the HTTP API used by the player: checking that a database exists, reading and writing
+# single documents, creating Mango indexes, _bulk_docs and _find with simple selectors (equality, $gt, $gte, $lt, $lte),
+# sort on one field, fields and limit.
+# Authentication is ignored and nothing is persisted.
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import argparse
+import json
+import threading
+import uuid
+
+
+OPERATORS = {"$gt": lambda a, b: a > b, "$gte": lambda a, b: a >= b, "$lt": lambda a, b: a < b,
+             "$lte": lambda a, b: a <= b, "$eq": lambda a, b: a == b}
+
+
+def matches(doc, selector):
+    for field, condition in selector.items():
+        if field not in doc:
+            return False
+        if isinstance(condition, dict):
+            for operator, value in condition.items():
+                if not OPERATORS[operator](doc[field], value):
+                    return False
+        elif doc[field] != condition:
+            return False
+    return True
+
+
+class StandInCouchDB:
+    def __init__(self, databases):
+        self.lock = threading.Lock()
+        self.databases = {name: {} for name in databases} # database name -> {document id: document}
+        self.indexes = {name: {} for name in databases} # database name -> {index name: fields}
+
+    def bulk_docs(self, db_name, docs):
+        results = []
+        with self.lock:
+            db = self.databases[db_name]
+            for doc in docs:
+                doc_id = doc.get("_id") or uuid.uuid4().hex
+                if doc_id in db and db[doc_id]["_rev"] != doc.get("_rev"):
+                    results.append({"id": doc_id, "error": "conflict", "reason": "Document update conflict."})
+                    continue
+                revision = int(db[doc_id]["_rev"].split("-")[0]) + 1 if doc_id in db else 1
+                doc = dict(doc, _id=doc_id, _rev="%d-%s" % (revision, uuid.uuid4().hex))
+                db[doc_id] = doc
+                results.append({"ok": True, "id": doc_id, "rev": doc["_rev"]})
+        return results
+
+    def find(self, db_name, query):
+        with self.lock:
+            docs = [doc for doc in self.databases[db_name].values() if matches(doc, query.get("selector", {}))]
+        for sort in reversed(query.get("sort", [])):
+            field, direction = next(iter(sort.items())) if isinstance(sort, dict) else (sort, "asc")
+            docs.sort(key=lambda doc: doc[field], reverse=direction == "desc")
+        docs = docs[query.get("skip", 0):][:query.get("limit", 25)]
+        if "fields" in query:
+            docs = [{field: doc[field] for field in query["fields"] if field in doc} for doc in docs]
+        return {"docs": docs}
+
+    def create_index(self, db_name, query):
+        name = query.get("name") or uuid.uuid4().hex
+        with self.lock:
+            exists = name in self.indexes[db_name]
+            self.indexes[db_name][name] = query["index"]["fields"]
+        return {"result": "exists" if exists else "created", "id": "_design/%s" % query.get("ddoc", name),
+                "name": name}
+
+
+def make_handler(couch):
+    class Handler(BaseHTTPRequestHandler):
+        def reply(self, status, body=None):
+            data = json.dumps(body).encode() if body is not None else b""
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            if self.command != "HEAD":
+                self.wfile.write(data)
+
+        def path_parts(self):
+            return [part for part in self.path.split("?")[0].split("/") if part]
+
+        def request_json(self):
+            length = int(self.headers.get("Content-Length", 0))
+            return json.loads(self.rfile.read(length)) if length else {}
+
+        def do_HEAD(self):
+            self.do_GET()
+
+        def do_GET(self):
+            parts = self.path_parts()
+            if not parts:
+                self.reply(200, {"couchdb": "Welcome", "version": "stand-in"})
+            elif parts[0] in couch.databases and len(parts) == 1:
+                self.reply(200, {"db_name": parts[0], "doc_count": len(couch.databases[parts[0]])})
+            elif parts[0] in couch.databases and len(parts) == 2 and parts[1] in couch.databases[parts[0]]:
+                with couch.lock:
+                    self.reply(200, couch.databases[parts[0]][parts[1]])
+            else:
+                self.reply(404, {"error": "not_found", "reason": "missing"})
+
+        def do_PUT(self):
+            parts = self.path_parts()
+            if len(parts) == 1 and parts[0] not in couch.databases:
+                couch.databases[parts[0]] = {}
+                couch.indexes[parts[0]] = {}
+                self.reply(201, {"ok": True})
+            elif len(parts) == 2 and parts[0] in couch.databases:
+                result, = couch.bulk_docs(parts[0], [dict(self.request_json(), _id=parts[1])])
+                self.reply(409 if "error" in result else 201, result)
+            else:
+                self.reply(412, {"error": "file_exists", "reason": "The database could not be created."})
+
+        def do_POST(self):
+            parts = self.path_parts()
+            if len(parts) != 2 or parts[0] not in couch.databases:
+                self.reply(404, {"error": "not_found", "reason": "missing"})
+            elif parts[1] == "_bulk_docs":
+                self.reply(201, couch.bulk_docs(parts[0], self.request_json()["docs"]))
+            elif parts[1] == "_find":
+                self.reply(200, couch.find(parts[0], self.request_json()))
+            elif parts[1] == "_index":
+                self.reply(200, couch.create_index(parts[0], self.request_json()))
+            else:
+                self.reply(404, {"error": "not_found", "reason": "missing"})
+
+        def log_message(self, format, *args):
+            if args and not str(args[1]).startswith("2"):
+                super().log_message(format, *args)
+
+    return Handler
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='CouchDB stand-in')
+    parser.add_argument('--bind', help='IP address to bind the server to.', default="127.0.0.1")
+    parser.add_argument('--port', help='HTTP port', default=5984, type=int)
+    parser.add_argument('--database', help='Name of a database to create, can be repeated.', action='append')
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer((args.bind, args.port), make_handler(StandInCouchDB(args.database or ["qplayer"])))
+    print("Stand-in CouchDB on %s:%d" % (args.bind, args.port))
+    server.serve_forever()
@@ -0,0 +1,170 @@
+# Helpers to analyse the python expressions and code snippets that users write in variables, events and playlists.
+# This module must not depend on Qt so that it can be used outside of the GUI.
+
+import ast
+import functools
+import re
+
+# Maximum number of compiled sources kept in memory, the least recently used ones are discarded first
+CACHE_SIZE = 4096
+
+# Match plain numeric literals such as "10", "-2.5" or "1e-3" that eval accepts. Integers with leading zeros ("010"),
+# underscores and non-ASCII digits are left to the parser so that they give the same result or error as eval.
+_INTEGER_RE = re.compile(r"\s*[+-]?([1-9][0-9]*|0+)\s*$")
+_FLOAT_RE = re.compile(r"\s*[+-]?([0-9]+\.[0-9]*|\.[0-9]+|[0-9]+(?=[eE]))([eE][+-]?[0-9]+)?\s*$")
+
+
+class CompiledSource:
+    __slots__ = ("source", "code", "names", "value")
+
+    def __init__(self, source, code, names, value=None):
+        self.source = source
+        self.code = code # None for numeric literals
+        self.names = names # frozenset of the free names of the source
+        self.value = value # value of numeric literals
+
+
+# Compiles `source` with the given mode ("eval" or "exec") and finds the names it reads.
+# Results are cached, so every distinct expression is parsed only once. Numeric literals are not compiled at all.
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def compile_source(source, mode="eval"):
+    if not isinstance(source, str):
+        raise TypeError("Source must be a string, not %s" % type(source).__name__)
+
+    if mode == "eval" and _INTEGER_RE.match(source):
+        return CompiledSource(source, None, frozenset(), int(source))
+    if mode == "eval" and _FLOAT_RE.match(source):
+        return CompiledSource(source, None, frozenset(), float(source))
+
+    tree = ast.parse(source.strip() if mode == "eval" else source, mode=mode)
+    code = compile(tree, "<%s>" % mode, mode)
+    return CompiledSource(source, code, frozenset(_free_names(tree)))
+
+
+# Evaluates the expression `source` using `namespace` as globals. Equivalent to eval(source, namespace).
+def evaluate(source, namespace):
+    compiled = compile_source(source)
+    if compiled.code is None:
+        return compiled.value
+    return eval(compiled.code, namespace)
+
+
+# Executes the code in `source`. Equivalent to exec(source, namespace, local_namespace).
+def execute(source, namespace, local_namespace=None):
+    exec(compile_source(source, "exec").code, namespace, local_namespace)
+
+
+# Returns the set of names that `source` reads before defining them itself (x is included in "x = x + 1").
+# Names only used after being assigned inside the snippet (local variables, function arguments, loop variables...) are
+# not included.
+def free_names(source, mode="exec"):
+    return compile_source(source, mode).names
+
+
+def _position(node):
+    return node.lineno, node.col_offset
+
+
+# A name is free if it is read before the first place where it is bound. The value of an assignment is evaluated
+# before its targets are bound, and the variables of a comprehension are bound before its elements are evaluated.
+def _free_names(tree):
+    binding_positions = {} # Name node -> position where it is bound, when it is not the position of the node
+    for node in ast.walk(tree):
+        if isinstance(node, (ast.Assign, ast.AnnAssign, ast.AugAssign)):
+            end = (node.end_lineno, node.end_col_offset)
+            for target in (node.targets if isinstance(node, ast.Assign) else [node.target]):
+                for name in ast.walk(target):
+                    binding_positions[name] = end
+        elif isinstance(node, (ast.ListComp, ast.SetComp, ast.GeneratorExp, ast.DictComp)):
+            for generator in node.generators:
+                for name in ast.walk(generator.target):
+                    binding_positions[name] = _position(node)
+
+    loads = {} # name -> position of the first read
+    stores = {} # name -> position of the first binding
+    def add(positions, name, position):
+        if name not in positions or position < positions[name]:
+            positions[name] = position
+
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name):
+            if isinstance(node.ctx, ast.Load):
+                add(loads, node.id, _position(node))
+            else:
+                add(stores, node.id, binding_positions.get(node, _position(node)))
+        elif isinstance(node, ast.AugAssign) and isinstance(node.target, ast.Name): # x += 1 reads x
+            add(loads, node.target.id, _position(node))
+        elif isinstance(node, ast.arg):
+            add(stores, node.arg, _position(node))
+        elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            add(stores, node.name, _position(node))
+        elif isinstance(node, (ast.Import, ast.ImportFrom)):
+            for alias in node.names:
+                add(stores, (alias.asname or alias.name).split(".")[0], _position(node))
+    return {name for name, position in loads.items() if name not in stores or position < stores[name]}
+
+
+# Sorts the nodes of a dependency graph so that every node comes after the nodes it depends on.
+# `dependencies` maps each node to the set of nodes it needs; names that are not keys of `dependencies` are ignored.
+# Returns (order, cycles) where `order` is the list of nodes that can be evaluated in that order and `cycles` is a list
+# of sets of nodes that depend on each other circularly. Runs in O(nodes + edges) (iterative Tarjan's algorithm).
+def dependency_order(dependencies):
+    order = []
+    cycles = []
+
+    index_of = {}
+    lowlink = {}
+    stack = []
+    on_stack = set()
+    counter = 0
+
+    for root in dependencies:
+        if root in index_of:
+            continue
+
+        # Each frame is (node, iterator over its dependencies)
+        work = [(root, iter(dependencies[root]))]
+        index_of[root] = lowlink[root] = counter
+        counter += 1
+        stack.append(root)
+        on_stack.add(root)
+
+        while work:
+            node, children = work[-1]
+            advanced = False
+            for child in children:
+                if child not in dependencies:
+                    continue
+                if child not in index_of:
+                    index_of[child] = lowlink[child] = counter
+                    counter += 1
+                    stack.append(child)
+                    on_stack.add(child)
+                    work.append((child, iter(dependencies[child])))
+                    advanced = True
+                    break
+                elif child in on_stack:
+                    lowlink[node] = min(lowlink[node], index_of[child])
+
+            if advanced:
+                continue
+
+            work.pop()
+            if work:
+                parent = work[-1][0]
+                lowlink[parent] = min(lowlink[parent], lowlink[node])
+
+            if lowlink[node] == index_of[node]:
+                component = set()
+                while True:
+                    member = stack.pop()
+                    on_stack.discard(member)
+                    component.add(member)
+                    if member == node:
+                        break
+                if len(component) > 1 or node in dependencies[node]:
+                    cycles.append(component)
+                else:
+                    order.append(node)
+
+    return order, cycles
@@ -1,5 +1,10 @@
 # The Hardware class is basically a way to control a collection of OutputSystems which are the
 # abstraction of a specific piece of hardware that will output a sequence.
+import definitions
+
+import concurrent.futures
+import time
+
 
 class Hardware:
     def __init__(self, output_systems):
@@ -10,36 +15,126 @@ class Hardware:
             self.output_system_running[outsys_name] = False
             self.output_systems[outsys_name].add_sequence_end_listener(self.output_system_sequence_finished)
 
+        # Output systems are called in parallel so that each operation takes as long as the slowest system
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=max(1, len(self.output_systems)),
+                                                              thread_name_prefix="hardware")
+        self.timings = {} # {operation: {output system name: duration in seconds}} of the last call of each operation
+
+        self.card_routes = None # {card name: output system name}, built when needed by get_card_routes
+
+        self.tracer = None # tracing.Tracer that receives the events of every run_id, set by the Scheduler
+        self.playing_run_id = None
+
+    # Calls function(outsys_name, outsys) for every output system and returns the results in a dictionary by output
+    # system name. Output systems run in parallel in the thread pool, except those that are main_thread_only which run
+    # in the calling thread (unless `any_thread` is True, for operations that every output system must allow in any
+    # thread). When some of them fail, the others still run and a HardwareException with all the errors is raised at
+    # the end.
+    def _dispatch(self, operation, function, any_thread=False):
+        timings = {}
+
+        def timed_call(outsys_name):
+            start = time.perf_counter()
+            try:
+                return function(outsys_name, self.output_systems[outsys_name])
+            finally:
+                timings[outsys_name] = time.perf_counter() - start
+
+        parallel = len(self.output_systems) > 1
+        futures = {}
+        for outsys_name in self.output_systems:
+            if parallel and (any_thread or not self.output_systems[outsys_name].main_thread_only):
+                futures[outsys_name] = self.executor.submit(timed_call, outsys_name)
+
+        results = {}
+        errors = {}
+        for outsys_name in self.output_systems:
+            if outsys_name not in futures:
+                try:
+                    results[outsys_name] = timed_call(outsys_name)
+                except Exception as e:
+                    errors[outsys_name] = e
+
+        for outsys_name in futures:
+            try:
+                results[outsys_name] = futures[outsys_name].result()
+            except Exception as e:
+                errors[outsys_name] = e
+
+        self.timings[operation] = timings
+        if errors:
+            errors = {outsys_name: errors[outsys_name] for outsys_name in self.output_systems if outsys_name in errors}
+            raise definitions.HardwareException(operation, errors)
+        return {outsys_name: results[outsys_name] for outsys_name in self.output_systems}
+
+    def _trace(self, run_id, event):
+        if self.tracer is not None:
+            self.tracer.mark(run_id, event)
+
     def get_cards(self):
         cards = {}
         for outsys in self.output_systems:
             cards.update(self.output_systems[outsys].get_cards())
         return cards
 
+    # Returns the table that maps each card name to the name of its output system. It is built once and kept until
+    # invalidate_card_routes is called.
+    def get_card_routes(self):
+        if self.card_routes is None:
+            card_routes = {}
+            for outsys in self.output_systems:
+                for card_name in self.output_systems[outsys].get_cards():
+                    card_routes[card_name] = outsys
+            self.card_routes = card_routes
+        return self.card_routes
+
+    # Must be called when the output systems or their cards change
+    def invalidate_card_routes(self):
+        self.card_routes = None
+
     # This function is called before play_once/play
     def process_sequence(self, sequence, run_id):
-        # separate the sequence by the cards corresponding to each output system and forward the request.
-        for outsys in self.output_systems:
+        self.load_prepared_sequence(self.prepare_sequence(sequence, run_id), run_id)
 
-            outsys_sequence = {}
-            cards = self.output_systems[outsys].get_cards().keys()
-
-            for chan in sequence:
-                if chan[0] in cards:
-                    outsys_sequence[chan] = sequence[chan]
-
-            self.output_systems[outsys].process_sequence(outsys_sequence, run_id)
+    # Does the processing of the sequence that doesn't change the state of the output systems (see
+    # OutputSystem.prepare_sequence). It can be called from a worker thread while another sequence is playing, so
+    # main_thread_only doesn't apply to it.
+    def prepare_sequence(self, sequence, run_id):
+        self._trace(run_id, "process_start")
+        # separate the sequence by the cards corresponding to each output system and forward the request.
+        card_routes = self.get_card_routes()
+        outsys_sequences = {outsys: {} for outsys in self.output_systems}
+        for chan in sequence:
+            outsys = card_routes.get(chan[0])
+            if outsys is not None:
+                outsys_sequences[outsys][chan] = sequence[chan]
+
+        prepared = self._dispatch("prepare_sequence",
+                                  lambda name, outsys: outsys.prepare_sequence(outsys_sequences[name], run_id),
+                                  any_thread=True)
+        self._trace(run_id, "process_end")
+        return prepared
+
+    # Sends a sequence returned by prepare_sequence to the output systems. This function is called before play_once.
+    def load_prepared_sequence(self, prepared, run_id):
+        self._trace(run_id, "dispatch_load")
+        self._dispatch("load_prepared_sequence", lambda name, outsys: outsys.load_prepared_sequence(prepared[name], run_id))
 
     def cycle_init(self):
-        for outsys_name in self.output_systems:
-            outsys = self.output_systems[outsys_name]
-            outsys.cycle_init()
+        self._dispatch("cycle_init", lambda name, outsys: outsys.cycle_init())
 
     def play_once(self, run_id):
+        # Mark all the systems as running first, a system could finish before the others have been started
         for outsys_name in self.output_systems:
-            outsys = self.output_systems[outsys_name]
-            outsys.play_once(run_id)
             self.output_system_running[outsys_name] = True
+        self.playing_run_id = run_id
+        self._trace(run_id, "dispatch_start")
+        try:
+            self._dispatch("play_once", lambda name, outsys: outsys.play_once(run_id))
+        except definitions.HardwareException as e:
+            for outsys_name in e.errors:
+                self.output_system_running[outsys_name] = False
+            raise
 
     def stop(self):
         for outsys_name in self.output_systems:
@@ -52,6 +147,7 @@ class Hardware:
     # This sequence_finished signal is called when ALL of the output systems  are ready to receive a new sequence
     def sequence_finished(self):
         print("hardware: Sequence finished")
+        self._trace(self.playing_run_id, "hardware_finish")
         for callback in self.sequence_end_listeners:
             callback()
 
@@ -62,6 +158,12 @@ class Hardware:
 
 
 class OutputSystem:
+    # Must be True for output systems that can only be called from the thread that created them (e.g. because they use
+    # Qt timers). Other output systems are called from a thread pool, in parallel with the rest.
+    # prepare_sequence is the exception: it is called from the precompile thread of the Scheduler whatever the value of
+    # main_thread_only, so it must be thread-safe in every output system.
+    main_thread_only = False
+
     # initialize OutputSystem
     # `system_spec` is the part of the configuration related to this output system
     def __init__(self, system_spec):
@@ -76,6 +178,17 @@ class OutputSystem:
     def process_sequence(self, sequence, run_id):
         pass
 
+    # Converts the sequence to what the hardware needs without changing the state of the OutputSystem, so that it can
+    # run in a worker thread while another sequence is playing (even if main_thread_only is True, it must not use
+    # anything that belongs to the main thread). The result is passed to load_prepared_sequence.
+    # Subclasses can override both functions to do the heavy processing in advance, by default all the work is done by
+    # process_sequence when the sequence is loaded.
+    def prepare_sequence(self, sequence, run_id):
+        return sequence
+
+    def load_prepared_sequence(self, prepared, run_id):
+        self.process_sequence(prepared, run_id)
+
     # Cycle initialization, this is called before a sequence or set of sequences is executed to prepare the hardware
     def cycle_init(self):
         pass
@@ -100,7 +213,7 @@ class OutputSystem:
 
 class Card:
     num_channels = None
-    type = None # can be utils.DigitalTrack or utils.AnalogTrack
+    type = None # can be definitions.DigitalTrack or definitions.AnalogTrack
 
     # TODO: add 'name' as abstract property
 
@@ -111,7 +224,7 @@ class Card:
     def get_card_dict(self):
         pass
 
-    # If type == utils.AnalogTrack vmax() and vmin() must be implemented by sublcasses
+    # If type == definitions.AnalogTrack vmax() and vmin() must be implemented by sublcasses
     def vmax(self):
         pass
 
@@ -1,11 +1,20 @@
-import utils
+import definitions
 from hardware import OutputSystem, Card, Channel
 import numpy as np
 
-from sipyco.pc_rpc import Client
-from sipyco.sync_struct import Subscriber
+# sipyco is needed to talk to the master and to encode the arguments of the experiments. Without it only offline output
+# systems can be created and sequences can only be converted with encode_sequence (e.g. in benchmark.py).
+try:
+    from sipyco.pc_rpc import AsyncioClient
+    from sipyco import pyon
+    from sipyco.sync_struct import Subscriber
+except ImportError:
+    AsyncioClient = pyon = Subscriber = None
 import asyncio
+import collections
 import os
+import threading
+import time
 
 # Returns maximum output voltage
 def vmax():
@@ -20,38 +29,250 @@ def vmin():
     vmin = (0x0000-offset_dacs * 0x4)*4*vref/(1<<16)
     return vmin
 
+# Accepts a single voltage or an array of voltages
 def voltage_to_mu(voltage):
-    # Copied from artiq source code
+    # Copied from artiq source code, vectorized
     vref = 5
     offset_dacs = 8192
-    code = int(round((1 << 16) * (voltage / (4. * vref)) + offset_dacs * 0x4))
-    if code < 0x0 or code > 0xffff:
+    code = np.rint((1 << 16) * (np.asarray(voltage, dtype=np.float64) / (4. * vref)) + offset_dacs * 0x4)
+    if np.any(code < 0x0) or np.any(code > 0xffff):
         raise ValueError("Invalid DAC voltage!")
-    return code
-
-
-def seconds_to_mu(seconds):
-    # Copied from artiq source code
-    ref_period = 1e-9
-    return np.int64(seconds // ref_period)
-
-
+    if code.ndim == 0:
+        return int(code)
+    return code.astype(np.int64)
+
+
+# Returns the arrays (times, values) of the points that the DAC has to output for an analog event.
+# Ramps are sampled with `ramp_points` points including both ends.
+def render_analog_event(event, ramp_points):
+    ftype = event['type']
+    t0 = event['time']
+    duration = event['duration']
+    if ftype == 'constant':
+        return np.array([t0], dtype=np.float64), np.array([event['value']], dtype=np.float64)
+
+    t = np.linspace(t0, t0 + duration, ramp_points)
+    if ftype == 'linear':
+        v = np.linspace(event['start_val'], event['end_val'], ramp_points)
+    elif ftype == 'exp':
+        egd = np.exp(event['gamma'] * duration)
+        if egd == 1: # A flat exponential is a linear ramp
+            v = np.linspace(event['start_val'], event['end_val'], ramp_points)
+        else:
+            c1 = (event['end_val'] - event['start_val']) / (egd - 1)
+            c2 = (event['start_val'] * egd - event['end_val']) / (egd - 1)
+            v = c1 * np.exp(event['gamma'] * (t - t0)) + c2
+    elif ftype == 'sin':
+        v = event['amplitude'] * np.sin(2 * np.pi * event['frequency'] * (t - t0) + event['phase']) + event['offset']
+    else:
+        raise definitions.SequenceException("Unknown analog event type '%s'" % ftype)
+    return t, v
+
+
+# Renders all the events of an analog track, returns the arrays (times, values)
+def render_analog_events(events, ramp_points):
+    if len(events) == 0:
+        return np.zeros(0, dtype=np.float64), np.zeros(0, dtype=np.float64)
+    rendered = [render_analog_event(event, ramp_points) for event in events]
+    return np.concatenate([t for t, _ in rendered]), np.concatenate([v for _, v in rendered])
+
+
+# Converts times in ms to machine units, rounded to the nearest unit so that times that only differ by floating point
+# errors (e.g. 0.1+0.2 and 0.3) become the same integer. Accepts a single time or an array of times.
+def ms_to_mu(ms):
+    ref_period_ms = 1e-6
+    return np.int64(np.rint(np.asarray(ms, dtype=np.float64) / ref_period_ms))
+
+
+# Merges the event streams of all the channels into the arrays that the QuantumPlayer experiment plays: one entry per
+# event, sorted by time. `streams` is a list of (times, card type, channel, values) with times in machine units.
+# Coincident events keep the order of `streams` because the sort is stable.
+def pack_events(streams):
+    if len(streams) == 0:
+        streams = [(np.zeros(0, dtype=np.int64), 0, 0, np.zeros(0, dtype=np.int32))]
+    times = np.concatenate([stream[0] for stream in streams])
+    order = np.argsort(times, kind="stable")
+    types = np.concatenate([np.full(len(stream[0]), stream[1], dtype=np.int32) for stream in streams])
+    channels = np.concatenate([np.full(len(stream[0]), stream[2], dtype=np.int32) for stream in streams])
+    values = np.concatenate([np.asarray(stream[3], dtype=np.int32) for stream in streams])
+    return {"time": times[order],
+            "type": types[order],
+            "channel": channels[order],
+            "value": values[order]}
+
+
+# Keeps the connections to the ARTIQ master on an asyncio event loop running in its own thread, so that submitting an
+# experiment never blocks the GUI. The control connection (master_schedule RPC) is opened when needed and reopened after
+# errors; the notify connection (schedule subscriber) reconnects automatically when it is lost.
+# `schedule_setup` and `schedule_update` are the target_builder and notify_cb of the schedule Subscriber, they are
+# called from the transport thread.
+class ARTIQTransport:
+    LATENCY_HISTORY = 1000 # number of latencies (and of submissions waiting for their start) that are kept
+
+    def __init__(self, host, control_port, notify_port, schedule_setup, schedule_update, reconnect_delay=1.0):
+        self.host = host
+        self.control_port = control_port
+        self.notify_port = notify_port
+        self.schedule_setup = schedule_setup
+        self.schedule_update = schedule_update
+        self.reconnect_delay = reconnect_delay
+
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self._run_loop, name="artiq-transport", daemon=True)
+        self.control = None
+        self.control_lock = None # created on the transport loop, serializes the setup of the control connection
+        self.subscriber_task = None
+        self.closing = False
+
+        # Submit-to-start latency: submit and start times by rid until both are known (or the experiment leaves the
+        # schedule), and the last LATENCY_HISTORY latencies by run_id
+        self.submit_times = {}
+        self.start_times = {}
+        self.run_ids = {}
+        self.latencies = collections.OrderedDict()
+
+    def start(self):
+        self.thread.start()
+        self.subscriber_task = asyncio.run_coroutine_threadsafe(self._keep_subscribed(), self.loop)
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def close(self):
+        self.closing = True
+        if self.subscriber_task is not None:
+            self.subscriber_task.cancel()
+        asyncio.run_coroutine_threadsafe(self._close_control(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+
+    # Submits the experiment without waiting for the master. Returns a concurrent.futures.Future with the rid of the
+    # experiment. `run_id` is used to report the latency between the submission and the start of the experiment.
+    def submit(self, expid, run_id=None):
+        future = asyncio.run_coroutine_threadsafe(self._submit(expid, run_id), self.loop)
+        future.add_done_callback(self._submit_done)
+        return future
+
+    def _submit_done(self, future):
+        if not future.cancelled() and future.exception() is not None:
+            print("Could not submit experiment to ARTIQ: %s" % future.exception())
+
+    async def _submit(self, expid, run_id):
+        submit_time = time.monotonic()
+        for attempt in range(2): # A broken control connection is reopened once before giving up
+            try:
+                control = await self._get_control()
+                rid = await control.submit(pipeline_name="main", expid=expid, priority=0, due_date=None, flush=False)
+                break
+            except (OSError, EOFError) as e:
+                print("ARTIQ control connection error: %s" % e)
+                await self._close_control()
+                if attempt == 1:
+                    raise
+                await asyncio.sleep(self.reconnect_delay)
+
+        self.submit_times[rid] = submit_time
+        self.run_ids[rid] = run_id
+        if rid in self.start_times: # The experiment was already reported as running
+            self._report_latency(rid)
+        elif len(self.submit_times) > self.LATENCY_HISTORY:
+            # The experiment left the schedule before the submission returned, its start was never seen
+            self._forget(next(iter(self.submit_times)))
+        return rid
+
+    # Concurrent submissions wait for the same connection, the client is only visible once it is connected
+    async def _get_control(self):
+        if self.control_lock is None:
+            self.control_lock = asyncio.Lock()
+        async with self.control_lock:
+            if self.control is None:
+                control = AsyncioClient()
+                await control.connect_rpc(self.host, self.control_port, "master_schedule")
+                self.control = control
+        return self.control
+
+    async def _close_control(self):
+        if self.control is not None:
+            try:
+                self.control.close_rpc()
+            except (OSError, EOFError):
+                pass
+            self.control = None
+
+    async def _keep_subscribed(self):
+        while not self.closing:
+            subscriber = Subscriber("schedule", target_builder=self.schedule_setup, notify_cb=self._schedule_update)
+            try:
+                await subscriber.connect(self.host, self.notify_port)
+                print("Connected to ARTIQ master %s:%d" % (self.host, self.notify_port))
+                await subscriber.receive_task
+            except (OSError, EOFError) as e:
+                print("ARTIQ notify connection error: %s" % e)
+            finally:
+                try:
+                    await subscriber.close()
+                except (OSError, EOFError):
+                    pass
+            if not self.closing:
+                print("ARTIQ notify connection lost, reconnecting in %g s" % self.reconnect_delay)
+                await asyncio.sleep(self.reconnect_delay)
+
+    def _schedule_update(self, mod):
+        # An experiment changes to the "running" status when it starts
+        if mod.get('action') == 'setitem' and mod.get('key') == 'status' and mod.get('value') == 'running' \
+                and len(mod.get('path', [])) == 1:
+            rid = mod['path'][0]
+            self.start_times[rid] = time.monotonic()
+            if rid in self.submit_times:
+                self._report_latency(rid)
+        # The experiment has left the schedule, forget it if it never started or wasn't submitted by us
+        elif mod.get('action') == 'delitem' and not mod.get('path'):
+            self._forget(mod.get('key'))
+        self.schedule_update(mod)
+
+    def _forget(self, rid):
+        self.start_times.pop(rid, None)
+        self.submit_times.pop(rid, None)
+        self.run_ids.pop(rid, None)
+
+    def _report_latency(self, rid):
+        latency = self.start_times.pop(rid) - self.submit_times.pop(rid)
+        run_id = self.run_ids.pop(rid)
+        if run_id is not None:
+            self.latencies[run_id] = latency
+            if len(self.latencies) > self.LATENCY_HISTORY:
+                self.latencies.popitem(last=False)
+        print("ARTIQ run %s (rid %d) started %.1f ms after submission" % (run_id, rid, latency*1e3))
+
+
+# With "offline": true in `system_spec` the output system never connects to the master (the master_* settings are not
+# needed): sequences are prepared and loaded but can't be played, e.g. to measure the encoding in benchmark.py.
 class ARTIQOutputSystem(OutputSystem):
     def __init__(self, system_spec):
         self.name = system_spec["name"]
         self.cards = {}
         self.sequence_end_listeners = []
-        self.master_host = system_spec["master_host"]
-        self.master_control_port = system_spec["master_control_port"]
-        self.master_notify_port = system_spec["master_notify_port"]
-        self.master_scheduler = Client(self.master_host, self.master_control_port, "master_schedule")
-        self.master_experiment_db = Client(self.master_host, self.master_control_port, "master_experiment_db")
-        self.schedule_subscriber = Subscriber("schedule",
-                                              target_builder=self.artiq_schedule_setup,
-                                              notify_cb=self.artiq_schedule_update)
+        self.offline = system_spec.get("offline", False)
+        self.master_host = None
+        self.master_control_port = None
+        self.master_notify_port = None
         self.experiment_schedule = {}
-        loop = asyncio.get_event_loop()
-        loop.run_until_complete(self.schedule_subscriber.connect(self.master_host, self.master_notify_port))
+        self.main_loop = None
+        self.transport = None
+        if not self.offline:
+            if AsyncioClient is None:
+                raise ImportError("ARTIQ output system %s needs sipyco to connect to the master" % self.name)
+            self.master_host = system_spec["master_host"]
+            self.master_control_port = system_spec["master_control_port"]
+            self.master_notify_port = system_spec["master_notify_port"]
+            # Schedule notifications arrive on the transport thread and are handled in the thread that created the
+            # output system (the GUI thread, which runs the qasync event loop)
+            self.main_loop = asyncio.get_event_loop()
+            self.transport = ARTIQTransport(self.master_host, self.master_control_port, self.master_notify_port,
+                                            schedule_setup=self.artiq_schedule_setup,
+                                            schedule_update=self.artiq_schedule_notified)
+            self.transport.start()
 
         self.exp_str = None
         self.last_delay = 0
@@ -70,99 +291,47 @@ class ARTIQOutputSystem(OutputSystem):
 
     # Process the sequence and send it to the hardware
     def process_sequence(self, sequence, run_id):
-
+        self.load_prepared_sequence(self.prepare_sequence(sequence, run_id), run_id)
+
+    # Converts the sequence to the arguments of the experiment. It doesn't change the state of the output system so it
+    # can run in a worker thread while another sequence is playing.
+    def prepare_sequence(self, sequence, run_id):
+        if pyon is None:
+            raise ImportError("sipyco is needed to encode the sequences of ARTIQ output system %s" % self.name)
+        packed, last_delay = self.encode_sequence(sequence)
+        # PYON encodes numpy arrays as raw buffers, so the experiment gets the arrays back without parsing every event
+        return pyon.encode(packed), last_delay
+
+    # Returns the events of the sequence packed by pack_events and the delay after the last event in machine units (as a
+    # string), which are the arguments of the experiment before they are encoded
+    def encode_sequence(self, sequence):
         sequence_duration = 0
-        # Convert analog sequences to actual values for the DAC and calculate sequence duration
+        # Each channel is converted to a stream of events with int64 times in machine units. Analog values are
+        # converted to DAC machine units.
+        streams = []
         for chan in sequence:
             track_duration = 0
             for event in sequence[chan]["events"]:
                 track_duration += event['duration']
             sequence_duration = max(sequence_duration, track_duration)
 
-            if sequence[chan]['chan'].card.type == utils.DigitalTrack:
-                pass
-            elif sequence[chan]['chan'].card.type == utils.AnalogTrack:
-                samplerate = sequence[chan]['chan'].card.samplerate
+            events = sequence[chan]["events"]
+            if sequence[chan]['chan'].card.type == definitions.DigitalTrack:
+                times = ms_to_mu(np.fromiter((event['time'] for event in events), dtype=np.float64, count=len(events)))
+                states = np.fromiter((event['state'] for event in events), dtype=np.int32, count=len(events))
+                streams.append((times, 0, chan[1], states))
+            elif sequence[chan]['chan'].card.type == definitions.AnalogTrack:
                 ramp_points = sequence[chan]['chan'].card.ramp_points
-                exploded_events = []
-                events = sequence[chan]["events"]
-                for event in events:
-                    if event['type'] == 'constant':
-                        new_event = {'duration': event['duration'],
-                                     'value': event['value'],
-                                     'time': event['time']}
-                        exploded_events.append(new_event)
-
-                    elif event['type'] == 'linear':
-                        start_val = event['start_val']
-                        end_val = event['end_val']
-                        duration = event['duration']
-                        t0 = event['time']
-                        t = np.linspace(t0, duration + t0, ramp_points)
-                        dt = t[1] - t[0]
-                        v = np.linspace(start_val, end_val, ramp_points)
-                        for i in range(ramp_points - 1):
-                            new_event = {'duration': dt,
-                                         'value': v[i],
-                                         'time': t[i]}
-                            exploded_events.append(new_event)
-
-                        new_event = {'duration': 0,
-                                     'value': v[-1],
-                                     'time': t[-1]}
-                        exploded_events.append(new_event)
-
-                    elif event['type'] == 'sin':
-                        pass
-                    elif event['type'] == 'exp':
-                        pass
-
-                sequence[chan]["events"] = exploded_events
-
-        # an event dictionary where key is the time of the event.
-        # the channel is added to the event so that the sequence can be created
-        all_events = {}
-        for chan in sequence:
-            for event in sequence[chan]['events']:
-                event['chan_id'] = chan
-                event['chan'] = sequence[chan]['chan']
-                t = event['time']
-                if t in all_events:
-                    all_events[t].append(event)
-                else:
-                    all_events[t] = [event]
-
-        self.exp_str = self.create_experiment_str(all_events)
-        last_t = max(all_events.keys())
-        self.last_delay = str(seconds_to_mu((sequence_duration-last_t)*1e-3))
+                times, values = render_analog_events(events, ramp_points)
+                streams.append((ms_to_mu(times), 1, chan[1], voltage_to_mu(values)))
 
-    def create_experiment_str(self, all_events):
-        times = list(all_events.keys())
-        times.sort()
+        packed = pack_events(streams)
+        last_t = packed["time"][-1] if len(packed["time"]) > 0 else 0
+        last_delay = str(ms_to_mu(sequence_duration) - last_t)
+        return packed, last_delay
 
-        experiment_str = ""
-
-        for t in times:
-            events = all_events[t]
-            time_events_str = ""
-            for event in events:
-                # TODO: cleanup by moving each code generation part to the corresponding card
-                event_str = ""
-                if event['chan'].card.type == utils.DigitalTrack:
-                    event_str = "(0,%d,%d)" % (event['chan_id'][1], event['state'])
-
-                elif event['chan'].card.type == utils.AnalogTrack:
-                    # TODO: subtract from the following delay the time for write_dac and load
-                    event_str = "(1,%d,%d)" % (event['chan_id'][1], voltage_to_mu(event['value']))
-
-                time_events_str += event_str+','
-
-            time_events_str = time_events_str.strip(',')
-            experiment_str += ("(%d, ["%seconds_to_mu(t*1e-3)) + time_events_str + "]),"
-
-        experiment_str = experiment_str.strip(',')
-
-        return "["+experiment_str+"]"
+    def load_prepared_sequence(self, prepared, run_id):
+        self.exp_str, self.last_delay = prepared
 
     def cycle_init(self):
         expid = {
@@ -172,8 +341,9 @@ class ARTIQOutputSystem(OutputSystem):
             "log_level": 0,
             "repo_rev": "N/A",
         }
+        self._check_online()
         self.initializing = True
-        self.master_scheduler.submit(pipeline_name="main", expid=expid, priority=0, due_date=None, flush=False)
+        self.transport.submit(expid)
         print("Play artiq cycle init first")
 
     def play_once(self, run_id):
@@ -185,17 +355,25 @@ class ARTIQOutputSystem(OutputSystem):
             "repo_rev": "N/A",
         }
 
-        self.master_scheduler.submit(pipeline_name="main", expid=expid, priority=0, due_date=None, flush=False)
+        self._check_online()
+        self.transport.submit(expid, run_id)
         print("Play artiq sequence once")
 
+    def _check_online(self):
+        if self.offline:
+            raise RuntimeError("ARTIQ output system %s is offline, it can't submit experiments" % self.name)
+
     def artiq_schedule_setup(self, schedule):
         self.experiment_schedule.clear()
         self.experiment_schedule.update(schedule)
         return self.experiment_schedule
 
-    def artiq_schedule_update(self, mod: dict):
-
+    # Called from the transport thread. The size of the queue is read there because the schedule keeps changing.
+    def artiq_schedule_notified(self, mod: dict):
         queue_size = len(self.experiment_schedule)
+        self.main_loop.call_soon_threadsafe(self.artiq_schedule_update, mod, queue_size)
+
+    def artiq_schedule_update(self, mod: dict, queue_size):
 
         if 'path' in mod and len(mod['path']) == 0: # If the number of tasks changes
             print("ARTIQ queue size: %d" % queue_size)
@@ -229,12 +407,12 @@ class ARTIQCard(Card):
 
 class TTLOutARTIQCard(ARTIQCard):
     num_channels = 32
-    type = utils.DigitalTrack
+    type = definitions.DigitalTrack
 
 
 class ZotinoARTIQCard(ARTIQCard):
     num_channels = 32
-    type = utils.AnalogTrack
+    type = definitions.AnalogTrack
 
     def __init__(self, name, channels, samplerate, ramp_points):
         super().__init__(name, channels)
@@ -1,4 +1,4 @@
-import utils
+import definitions
 from hardware import OutputSystem, Card, Channel
 
 
@@ -37,12 +37,12 @@ class BusCard(Card):
 
 class DigitalBusCard(BusCard):
     num_channels = 8
-    type = utils.DigitalTrack
+    type = definitions.DigitalTrack
 
 
 class AnalogBusCard(BusCard):
     num_channels = 2
-    type = utils.AnalogTrack
+    type = definitions.AnalogTrack
 
     def __init__(self, name, address, channels, samplerate):
         super().__init__(name, address, channels)
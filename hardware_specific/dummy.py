@@ -1,10 +1,12 @@
-import utils
+import definitions
 from hardware import OutputSystem, Card, Channel
 
 from PyQt5.QtCore import QTimer
 
 
 class DummyOutputSystem(OutputSystem):
+    main_thread_only = True # Uses QTimer
+
     def __init__(self, system_spec):
         self.name = system_spec["name"]
         self.cards = {}
@@ -49,12 +51,12 @@ class DummyCard(Card):
 
 class DigitalDummyCard(DummyCard):
     num_channels = 32
-    type = utils.DigitalTrack
+    type = definitions.DigitalTrack
 
 
 class AnalogDummyCard(DummyCard):
     num_channels = 32
-    type = utils.AnalogTrack
+    type = definitions.AnalogTrack
 
     def __init__(self, name, address, channels, samplerate):
         super().__init__(name, address, channels)
@@ -0,0 +1,197 @@
+# Runs a sequence without the GUI: loads a config and a sequence file, plays it through the Scheduler and prints a
+# timing report at the end. Only QtCore/QtGui are used (no widgets, .ui files or matplotlib) and Qt runs on the
+# offscreen platform unless QT_QPA_PLATFORM says otherwise, so it works on machines without a display.
+#
+#   python headless.py config.json sequence.json --mode iterate --iterations 10
+import time
+startup_begin = time.perf_counter() # The report includes the time spent importing
+
+import os
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+import argparse
+import asyncio
+import json
+import signal
+
+from PyQt5.QtCore import QTimer
+from PyQt5.QtGui import QGuiApplication
+
+import config
+import definitions
+from variables import VariablesModel
+from routines import RoutinesModel
+from playlist import PlaylistModel
+from sequence import Sequence
+from scheduler import Scheduler
+
+
+class HeadlessRunner:
+    def __init__(self, config_path, sequence_path, playlist=None, shots=None, iterations=None, shuffle=False):
+        self.config = config.Config(config_path)
+        self.hardware = self.config.get_hardware()
+
+        self.variables_model = VariablesModel()
+        self.routines_model = RoutinesModel(self.variables_model, self.hardware)
+        self.playlist_model = PlaylistModel(self.variables_model, self.routines_model)
+        self.sequence = Sequence(self.variables_model, self.routines_model, self.playlist_model)
+
+        with open(sequence_path) as sequence_file:
+            self.sequence.load_sequence_from_dict(json.load(sequence_file))
+        self.playlist_model.set_active_playlist(self.find_playlist(playlist))
+
+        self.database = self.config.get_database()
+        self.publisher = self.config.get_publisher()
+
+        self.scheduler = Scheduler(self.sequence, self.hardware, self.database, tracer=self.config.get_tracer())
+        if shuffle:
+            self.scheduler.shuffle_on()
+        self.scheduler.add_sequence_start_listener(self.sequence_started)
+        self.scheduler.add_sequence_end_listener(self.sequence_finished)
+        self.scheduler.add_sequence_stopped_listener(self.sequence_stopped)
+        self.scheduler.add_sequence_iteration_finished_listener(self.sequence_iteration_finished)
+
+        self.shots = shots # stop after this number of sequences, None to never stop
+        self.iterations = iterations # stop after this number of complete iterations, None to never stop
+        self.stopping = False
+        self.finished_callback = None
+
+        # Timing
+        self.shot_starts = [] # perf_counter when each sequence started
+        self.shot_ends = [] # perf_counter when each sequence finished
+        self.completed_iterations = 0
+        self.run_start = None
+
+    # Returns the row of the playlist given its name or row number, the first one if `playlist` is None
+    def find_playlist(self, playlist):
+        if self.playlist_model.rowCount() == 0:
+            raise definitions.SequenceException("The sequence has no playlists")
+        if playlist is None:
+            return 0
+        for row in range(self.playlist_model.rowCount()):
+            if self.playlist_model.item(row, 0).text() == playlist:
+                return row
+        if playlist.isdigit() and int(playlist) < self.playlist_model.rowCount():
+            return int(playlist)
+        raise definitions.SequenceException("Playlist not found: %s" % playlist)
+
+    # Starts playing. `finished_callback` is called once the runner is done.
+    def start(self, mode, finished_callback):
+        self.finished_callback = finished_callback
+        self.run_start = time.perf_counter()
+        if mode == "once":
+            self.scheduler.play_once()
+        elif mode == "continuous":
+            self.scheduler.play_continuous()
+        elif mode == "iterate":
+            if not self.scheduler.iterate():
+                self.finish()
+
+    def stop(self):
+        if not self.stopping:
+            self.stopping = True
+            self.scheduler.stop()
+            # The scheduler only reports the stop after the sequence being played is finished
+            if len(self.shot_starts) == len(self.shot_ends):
+                self.finish()
+
+    def finish(self):
+        if self.finished_callback is not None:
+            callback, self.finished_callback = self.finished_callback, None
+            callback()
+
+    # This function is called by the scheduler
+    def sequence_started(self, run_id, vars_dict, iter_dict):
+        self.shot_starts.append(time.perf_counter())
+        parameters = {'variables': vars_dict, 'iterators': iter_dict, 'run_id': run_id}
+        id_dict = {'run_id': run_id}
+        self.publisher.publish(f'starting@{json.dumps(id_dict)}@{json.dumps(parameters)}')
+
+    # This function is called by the scheduler
+    def sequence_finished(self, run_id, vars_dict, iter_dict):
+        self.shot_ends.append(time.perf_counter())
+        parameters = {'variables': vars_dict, 'iterators': iter_dict, 'run_id': run_id}
+        id_dict = {'run_id': run_id}
+        self.publisher.publish(f'finished@{json.dumps(id_dict)}@{json.dumps(parameters)}')
+        if self.shots is not None and len(self.shot_ends) >= self.shots:
+            self.stop()
+
+    # This function is called by the scheduler
+    def sequence_stopped(self, run_id):
+        self.finish()
+
+    # This function is called by the scheduler
+    def sequence_iteration_finished(self):
+        self.completed_iterations += 1
+        iters_dict = {'completed_iterations': self.completed_iterations}
+        self.publisher.publish(f'iteration_finished@{json.dumps(iters_dict)}')
+        if self.iterations is not None and self.completed_iterations >= self.iterations:
+            self.stop()
+
+    def timing_report(self, startup_time):
+        shot_times = [end - start for start, end in zip(self.shot_starts, self.shot_ends)]
+        dead_times = [start - end for end, start in zip(self.shot_ends, self.shot_starts[1:])]
+        total = time.perf_counter() - self.run_start if self.run_start is not None else 0
+
+        lines = ["===Timing Report===",
+                 "Startup: %.3f s" % startup_time,
+                 "Sequences played: %d" % len(shot_times),
+                 "Completed iterations: %d" % self.completed_iterations,
+                 "Total run time: %.3f s" % total]
+        for label, values in (("Sequence", shot_times), ("Dead time", dead_times)):
+            if values:
+                lines.append("%s: mean %.2f ms, min %.2f ms, max %.2f ms" %
+                             (label, 1e3*sum(values)/len(values), 1e3*min(values), 1e3*max(values)))
+        if total > 0 and shot_times:
+            lines.append("Rate: %.2f sequences/s" % (len(shot_times)/total))
+        lines.append(self.scheduler.tracer.summary_text())
+        lines.append("===Timing Report===")
+        return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    from qasync import QEventLoop
+
+    parser = argparse.ArgumentParser(description='Quantum Player without GUI.')
+    parser.add_argument('config_file', help='Path to JSON config file.')
+    parser.add_argument('sequence_file', help='Path to JSON sequence file.')
+    parser.add_argument('--mode', choices=['once', 'continuous', 'iterate'], default='once',
+                        help='Play the sequence once, continuously or iterating over the iterator variables.')
+    parser.add_argument('--playlist', help='Name or row of the playlist to play (default: the first one).')
+    parser.add_argument('--shots', type=int, help='Stop after this number of sequences.')
+    parser.add_argument('--iterations', type=int,
+                        help='Stop after this number of complete iterations (iterate mode, default: 1).')
+    parser.add_argument('--shuffle', action='store_true', help='Shuffle the points of the iterations.')
+    args = parser.parse_args()
+
+    iterations = args.iterations
+    if args.mode == 'iterate' and iterations is None and args.shots is None:
+        iterations = 1
+
+    app = QGuiApplication([])
+    loop = QEventLoop(app)
+    asyncio.set_event_loop(loop)
+
+    runner = HeadlessRunner(args.config_file, args.sequence_file, args.playlist, args.shots, iterations, args.shuffle)
+    startup_time = time.perf_counter() - startup_begin
+
+    # Ctrl+C stops the sequence, a second one quits right away. The timer gives Python the chance to handle the signal
+    # while Qt is running.
+    def interrupt(signum, frame):
+        if runner.stopping:
+            loop.stop()
+        else:
+            print("Stopping...")
+            runner.stop()
+    signal.signal(signal.SIGINT, interrupt)
+    signal_timer = QTimer()
+    signal_timer.timeout.connect(lambda: None)
+    signal_timer.start(200)
+
+    QTimer.singleShot(0, lambda: runner.start(args.mode, loop.stop))
+    with loop:
+        loop.run_forever()
+    runner.database.close()
+    runner.publisher.close()
+
+    print(runner.timing_report(startup_time))
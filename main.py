@@ -45,7 +45,7 @@ class ControlSystemGUI(QMainWindow):
 
         # SEQUENCE MANAGER
         self.sequence = Sequence(self.variables_model, self.routines_model, self.playlist_model)
-        self.scheduler = Scheduler(self.sequence, self.hardware, self.database)
+        self.scheduler = Scheduler(self.sequence, self.hardware, self.database, tracer=self.config.get_tracer())
         self.scheduler.add_sequence_stopped_listener(self.sequence_stopped)
         self.scheduler.add_sequence_end_listener(self.sequence_finished)
         self.scheduler.add_sequence_start_listener(self.sequence_started)
@@ -55,7 +55,7 @@ class ControlSystemGUI(QMainWindow):
         self.sequence_editor = SequenceEditor(self.routines_model)
         self.ui.sequence_editor_scroll_area.setWidget(self.sequence_editor)
 
-        self.ui.run_number_label.setText(str(self.database.get_latest_run_id()+1))
+        self.ui.run_number_label.setText(str(self.scheduler.run_id))
 
         # PROXY MODELS
         self.static_variables_model = VariablesProxyModel(["name","set","value","comment"], True, False, True)
@@ -110,13 +110,13 @@ class ControlSystemGUI(QMainWindow):
         self.ui.config_routine_button.clicked.connect(self.config_routine)
         self.ui.remove_routine_button.clicked.connect(self.remove_routine)
         self.ui.routine_combo_box.currentIndexChanged.connect(self.changed_routine)
-        self.variables_model.dataChanged.connect(self.routines_model.update_values)
+        self.variables_model.values_changed.connect(self.routines_model.update_changed_values)
         ## Playlist
         self.ui.playlist_view.customContextMenuRequested.connect(self.playlist_context_menu_requested)
         self.ui.add_playlist_button.clicked.connect(self.add_playlist)
-        self.variables_model.dataChanged.connect(self.playlist_model.update_values)
+        self.variables_model.values_changed.connect(self.playlist_model.update_values)
         ## Inspector
-        self.variables_model.dataChanged.connect(self.inspector_widget.update_plot)
+        self.variables_model.values_changed.connect(self.inspector_widget.update_plot)
         self.ui.fix_scale.toggled.connect(self.inspector_widget.fix_scale_toggled)
 
 
@@ -569,6 +569,8 @@ if __name__ == "__main__":
     myapp.show()
     with loop:
         loop.run_forever()
+    myapp.database.close()
+    myapp.publisher.close()
 
     """
     app = QApplication(sys.argv)
@@ -1,17 +1,150 @@
-
+import collections
+import select
 import socket
+import threading
+import time
 
+# Publishes messages to the NotificationServer over a connection that is kept open.
+# publish() only queues the message, a background thread sends it. Messages published within `coalesce_delay` seconds
+# of each other are sent together in a single write. If the connection fails the messages are kept and sent again once
+# it has been reestablished, waiting `reconnect_delay` seconds (doubled after every failure up to `max_reconnect_delay`)
+# between attempts. Only the messages that weren't completely written are sent again, the server ignores the incomplete
+# line at the end of a connection. At most `max_queue` messages are kept, the oldest ones are dropped first.
 class PublisherClient:
 
-    def __init__(self, server_host, server_port=9193):
+    def __init__(self, server_host, server_port=9193, max_queue=1000, coalesce_delay=0.002, reconnect_delay=0.5,
+                 max_reconnect_delay=10.0, connect_timeout=2.0):
         self.server_host = server_host
         self.server_port = server_port
+        self.max_queue = max_queue
+        self.coalesce_delay = coalesce_delay
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        self.connect_timeout = connect_timeout
+
+        self.socket = None
+        self.condition = threading.Condition()
+        self.queue = collections.deque() # encoded lines waiting to be sent
+        self.sending = 0 # number of lines being sent by the thread
+        self.dropped = 0
+        self.closing = False
+
+        self.thread = threading.Thread(target=self._run, name="publisher", daemon=True)
+        self.thread.start()
 
     def publish(self, msg):
+        line = b"P"+bytes(str(msg+"\r\n"),'utf8')
+        with self.condition:
+            if len(self.queue) >= self.max_queue:
+                self.queue.popleft()
+                self.dropped += 1
+            self.queue.append(line)
+            self.condition.notify_all()
+
+    # Waits at most `timeout` seconds until the queued messages have been sent. Returns True if they have.
+    def flush(self, timeout=None):
+        with self.condition:
+            return self.condition.wait_for(lambda: not self.queue and not self.sending, timeout)
+
+    # Sends what is left (waiting at most `timeout` seconds) and closes the connection. Once closing, a failed send isn't
+    # retried, the messages that are left are dropped.
+    def close(self, timeout=2.0):
+        with self.condition:
+            self.closing = True
+            self.condition.notify_all()
+        self.thread.join(timeout)
+        if self.dropped:
+            print("Publisher: %d messages were dropped" % self.dropped)
+
+    def _connect(self):
+        self.socket = socket.create_connection((self.server_host, self.server_port), timeout=self.connect_timeout)
+        self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.socket.settimeout(None)
+
+    # The server never sends anything to publishers, so the socket is only readable once the server has closed it.
+    # Without this check the first write after the server is gone would look successful and its messages lost.
+    def _connection_closed(self):
+        readable, _, _ = select.select([self.socket], [], [], 0)
+        return bool(readable)
+
+    # Writes `lines`. If the connection fails, the OSError raised has the attribute `lines_sent` with the number of lines
+    # that were written completely.
+    def _send(self, lines):
+        data = memoryview(b"".join(lines))
+        total = 0
+        try:
+            if self.socket is not None and self._connection_closed():
+                self._disconnect()
+            if self.socket is None:
+                self._connect()
+            while total < len(data):
+                total += self.socket.send(data[total:])
+        except OSError as e:
+            lines_sent = 0
+            for line in lines:
+                if total < len(line):
+                    break
+                total -= len(line)
+                lines_sent += 1
+            e.lines_sent = lines_sent
+            raise
+
+    def _disconnect(self):
+        if self.socket is not None:
+            try:
+                self.socket.close()
+            except OSError:
+                pass
+            self.socket = None
+
+    # This function runs in the publisher thread
+    def _run(self):
+        delay = self.reconnect_delay
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.queue or self.closing)
+                if not self.queue: # closing and everything has been sent
+                    self._disconnect()
+                    return
+                closing = self.closing
+            # Give the messages that are published right after this one the chance to go in the same write
+            if not closing:
+                time.sleep(self.coalesce_delay)
+            with self.condition:
+                lines = list(self.queue)
+                self.queue.clear()
+                self.sending = len(lines)
+
+            try:
+                self._send(lines)
+                delay = self.reconnect_delay
+                unsent = []
+            except OSError as e:
+                unsent = lines[e.lines_sent:]
+                error = e
+                self._disconnect()
+
+            with self.condition:
+                self.sending = 0
+                if unsent and self.closing:
+                    self.dropped += len(unsent) + len(self.queue)
+                    self.queue.clear()
+                    print("Publisher: could not send to %s:%s (%s) while closing" %
+                          (self.server_host, self.server_port, error))
+                elif unsent:
+                    print("Publisher: could not send to %s:%s (%s), retrying in %g s" %
+                          (self.server_host, self.server_port, error, delay))
+                    # Put the messages back in front of the ones published in the meantime
+                    self.queue.extendleft(reversed(unsent))
+                    while len(self.queue) > self.max_queue:
+                        self.queue.popleft()
+                        self.dropped += 1
+                self.condition.notify_all()
+                if unsent and not self.closing:
+                    self.condition.wait_for(lambda: self.closing, delay)
+            if unsent:
+                delay = min(2*delay, self.max_reconnect_delay)
 
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-            s.connect((self.server_host, self.server_port))
-            s.sendall(b"P"+bytes(str(msg+"\r\n"),'utf8'))
 
 class DummyPublisherClient:
 
@@ -21,9 +154,16 @@ class DummyPublisherClient:
     def publish(self, msg):
         print(msg)
 
+    def flush(self, timeout=None):
+        return True
+
+    def close(self, timeout=2.0):
+        pass
+
 if __name__ == "__main__":
 
     p = PublisherClient("192.168.52.2")
 
     p.publish("Message 1")
-    p.publish("Message 2")
\ No newline at end of file
+    p.publish("Message 2")
+    p.close()
@@ -1,49 +1,130 @@
 import asyncio
 import argparse
+import collections
+
+# What to do when the queue of a subscriber is full because it doesn't read fast enough
+DROP_OLDEST = "drop-oldest" # discard its oldest message
+DISCONNECT = "disconnect" # close its connection
+
+
+# A subscriber has its own queue of outgoing messages and its own task that writes them, so that a slow subscriber
+# doesn't delay the others nor the publishers.
+class Subscriber:
+    def __init__(self, writer, queue_size):
+        self.writer = writer
+        self.addr = writer.get_extra_info('peername')
+        self.queue_size = queue_size
+        self.queue = collections.deque()
+        self.ready = asyncio.Event() # set when there are messages in the queue
+        self.dropped = 0
+        self.task = None
+
+    # Returns False if the queue is full
+    def put(self, data):
+        if len(self.queue) >= self.queue_size:
+            return False
+        self.queue.append(data)
+        self.ready.set()
+        return True
+
+    def drop_oldest(self):
+        self.queue.popleft()
+        self.dropped += 1
+
+    # Writes the queued messages, all the messages that are waiting go in the same write. Returns when the connection
+    # fails.
+    async def send_loop(self):
+        while True:
+            await self.ready.wait()
+            data = "".join(self.queue)
+            self.queue.clear()
+            self.ready.clear()
+            try:
+                self.writer.write(bytes(data,'utf8'))
+                await self.writer.drain()
+            except ConnectionError:
+                return
+
+    def close(self):
+        if self.task is not None:
+            self.task.cancel()
+        self.writer.close()
 
 
 class NotificationServer:
-    def __init__(self, server_address, server_port):
-        self.subscriber_writers = []
+    # `queue_size` is the number of messages that can wait to be sent to each subscriber and `overflow_policy`
+    # (DROP_OLDEST or DISCONNECT) says what happens to a subscriber whose queue is full
+    def __init__(self, server_address, server_port, queue_size=1000, overflow_policy=DROP_OLDEST):
+        self.subscribers = []
         self.server_address = server_address
         self.server_port = server_port
+        self.queue_size = queue_size
+        self.overflow_policy = overflow_policy
 
     async def handle_message(self, reader, writer):
-        data = await reader.readline()
-        message = data.decode()
         addr = writer.get_extra_info('peername')
 
-        print(f"Received {message!r} from {addr!r}")
-
         # PROTOCOL: messages starting with S are requests for subscription
-        #           messages starting with P are publications
-
-        if message[0] == "S": # From subscriber
-            self.subscriber_writers.append(writer)
-            print(f"Subscribed {addr!r}")
-            print("===Current Clients===")
-            for subscriber in self.subscriber_writers:
-                caddr = subscriber.get_extra_info('peername')
-                print(f"{caddr!r}")
-            print("===Current Clients===")
-
-        if message[0] == "P": # From publisher
-            data = message[1:]
-            dead_subscribers = [] # list of dead clients
-            for subscriber in self.subscriber_writers:
-                caddr = subscriber.get_extra_info('peername')
-                print(f"Send: {data!r} to {caddr!r}")
-                subscriber.write(bytes(data,'utf8'))
-                try:
-                    await subscriber.drain()
-                except ConnectionResetError:
-                    print(f"Client from {caddr!r} removed")
-                    dead_subscribers.append(subscriber)
-
-            # We remove the dead clients in a separate loop to not make a mess
-            for dead_subscriber in dead_subscribers:
-                self.subscriber_writers.remove(dead_subscriber)
-            writer.close()
+        #           messages starting with P are publications, a publisher can send several of them on the same
+        #           connection, one per line
+
+        while True:
+            try:
+                data = await reader.readline()
+            except ConnectionResetError:
+                break
+            # The publisher closed the connection. An incomplete line at the end is dropped, the publisher sends it
+            # again on its next connection.
+            if not data.endswith(b"\n"):
+                break
+            message = data.decode()
+
+            print(f"Received {message!r} from {addr!r}")
+
+            if message[0] == "S": # From subscriber
+                await self.serve_subscriber(reader, writer)
+                return
+
+            if message[0] == "P": # From publisher
+                self.publish(message[1:])
+                # readline doesn't give control back while there are lines buffered, let the subscribers send
+                await asyncio.sleep(0)
+        writer.close()
+
+    # Keeps the subscriber until it closes the connection or is removed
+    async def serve_subscriber(self, reader, writer):
+        subscriber = Subscriber(writer, self.queue_size)
+        subscriber.task = asyncio.ensure_future(subscriber.send_loop())
+        self.subscribers.append(subscriber)
+        print(f"Subscribed {subscriber.addr!r}")
+        print("===Current Clients===")
+        for s in self.subscribers:
+            print(f"{s.addr!r}")
+        print("===Current Clients===")
+
+        # Subscribers don't send anything else, reading only tells when they are gone
+        read_task = asyncio.ensure_future(reader.read())
+        await asyncio.wait([read_task, subscriber.task], return_when=asyncio.FIRST_COMPLETED)
+        read_task.cancel()
+        self.remove_subscriber(subscriber)
+
+    def remove_subscriber(self, subscriber):
+        if subscriber in self.subscribers:
+            self.subscribers.remove(subscriber)
+            subscriber.close()
+            print(f"Client from {subscriber.addr!r} removed")
+
+    # Queues the message for every subscriber without waiting for any of them
+    def publish(self, data):
+        print(f"Send: {data!r} to {len(self.subscribers)} subscribers")
+        for subscriber in list(self.subscribers):
+            if not subscriber.put(data):
+                if self.overflow_policy == DISCONNECT:
+                    print(f"Client from {subscriber.addr!r} is too slow")
+                    self.remove_subscriber(subscriber)
+                else:
+                    subscriber.drop_oldest()
+                    subscriber.put(data)
 
     async def main(self):
         suscriber_server = await asyncio.start_server(self.handle_message, self.server_address, self.server_port)
@@ -62,9 +143,13 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Notification Server')
     parser.add_argument('--address', help='IP address to bind the server to.')
     parser.add_argument('--port', help='Port to operate the server on', nargs='?', default=9193, type=int)
+    parser.add_argument('--queue-size', help='Messages that can wait to be sent to each subscriber', default=1000,
+                        type=int)
+    parser.add_argument('--overflow', help='What to do with subscribers whose queue is full',
+                        choices=[DROP_OLDEST, DISCONNECT], default=DROP_OLDEST)
     args = parser.parse_args()
 
     print(args)
 
-    ns = NotificationServer(args.address, args.port)
-    ns.start()
\ No newline at end of file
+    ns = NotificationServer(args.address, args.port, args.queue_size, args.overflow)
+    ns.start()
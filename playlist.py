@@ -1,6 +1,8 @@
 from PyQt5.QtCore import Qt, QModelIndex, QIdentityProxyModel, pyqtSlot
 from PyQt5.QtGui import QStandardItemModel, QStandardItem, QFont, QColor
 import utils
+import core
+import expressions
 from routines import RoutinesModel
 from variables import VariablesModel
 import numpy as np
@@ -120,6 +122,14 @@ class PlaylistModel(QStandardItemModel):
 
     # Returns a python dictionary containing the playlist info por the purpose of saving to a file
     def get_playlist_pystruct(self):
+        parsed_playlist = []
+        for i in range(self.rowCount()):
+            parsed_playlist.append(self._playlist_pystruct(i))
+
+        return parsed_playlist
+
+    # Returns a python dictionary containing the info of the playlist in row `row`, see get_playlist_pystruct
+    def _playlist_pystruct(self, row):
         # This recursive function is use to travel through the tree
         def inner_get_parsed_playlist(children_items, children_list):
             for child_item in children_items: # type: QStandardItem
@@ -140,17 +150,12 @@ class PlaylistModel(QStandardItemModel):
                 inner_get_parsed_playlist(child_children,child_dict["children"])
                 children_list.append(child_dict)
 
-        parsed_playlist = []
-        for i in range(self.rowCount()):
-            playlist_index = self.index(i,0)
-            playlist_item = self.itemFromIndex(playlist_index)
-            playlist_name = playlist_item.data(Qt.DisplayRole)
-            playlist_dict = {"name": playlist_name,"children": []}
-            playlist_children_items = [playlist_item.child(j) for j in range(playlist_item.rowCount())]
-            inner_get_parsed_playlist(playlist_children_items, playlist_dict["children"])
-            parsed_playlist.append(playlist_dict)
-
-        return parsed_playlist
+        playlist_item = self.item(row)
+        playlist_name = playlist_item.data(Qt.DisplayRole)
+        playlist_dict = {"name": playlist_name,"children": []}
+        playlist_children_items = [playlist_item.child(j) for j in range(playlist_item.rowCount())]
+        inner_get_parsed_playlist(playlist_children_items, playlist_dict["children"])
+        return playlist_dict
 
     @pyqtSlot()
     def update_values(self):
@@ -175,7 +180,7 @@ class PlaylistModel(QStandardItemModel):
                     if item.data(utils.PlaylistItemTypeRole) == utils.Routine:
                         routine_name = item.data(Qt.DisplayRole)
                         routine_repeat_str = item.parent().child(item.row(), self.column_names.index("repeat")).data(Qt.DisplayRole)
-                        routine_repeat = int(eval(routine_repeat_str, variables))
+                        routine_repeat = int(expressions.evaluate(routine_repeat_str, variables))
                         routine_duration = float(self.routines_model.get_routine_duration(routine_name))*routine_repeat
 
                         if item.parent().child(item.row(), self.column_names.index("start")).data(Qt.DisplayRole) != "0":
@@ -208,7 +213,7 @@ class PlaylistModel(QStandardItemModel):
                     if item.data(utils.PlaylistItemTypeRole) == utils.Routine: # if item is a routine
                         routine_name = item.data(Qt.DisplayRole)
                         routine_repeat_str = item.parent().child(item.row(), self.column_names.index("repeat")).data(Qt.DisplayRole)
-                        routine_repeat = int(eval(routine_repeat_str, variables))
+                        routine_repeat = int(expressions.evaluate(routine_repeat_str, variables))
                         routine_duration = float(self.routines_model.get_routine_duration(routine_name))*routine_repeat
 
                         if item.parent().child(item.row(), self.column_names.index("start")).data(Qt.DisplayRole) != parent_end_time:
@@ -239,7 +244,7 @@ class PlaylistModel(QStandardItemModel):
                                 item.parent().child(item.row(), self.column_names.index("end")).setData("%g"%(float(parent_end_time)+float(gap_duration)), Qt.DisplayRole)
                                 value_changed = True
                         except ValueError:
-                            gap_duration_time = eval(gap_duration, variables)
+                            gap_duration_time = expressions.evaluate(gap_duration, variables)
                             if item.parent().child(item.row(), self.column_names.index("end")).data(Qt.DisplayRole) != "%g"%(float(parent_end_time)+gap_duration_time):
                                 item.parent().child(item.row(), self.column_names.index("end")).setData("%g"%(float(parent_end_time)+gap_duration_time), Qt.DisplayRole)
                                 value_changed = True
@@ -256,83 +261,28 @@ class PlaylistModel(QStandardItemModel):
     def set_active_playlist(self, index):
         self.active_playlist = index
 
+    # Returns a plain python copy of the playlist in row `row` that doesn't depend on Qt (see core.PlaylistNode)
+    def get_core_playlist(self, row) -> core.PlaylistNode:
+        return core.PlaylistNode.from_pystruct(self._playlist_pystruct(row))
+
     # Returns a representation of the sequence written in absolute times with all variable values replaced.
     # The return structure is a dict where the key is a channel and the value is a list of output instructions.
     # An output instruction is a dict with the necessary parameters:
     # * For a digital channel an output instruction contains 'time' and 'state' (1 or 0).
     # * For an analog channel an output instruction structure can vary depending on the type of instruction
     #   but all have 'type' (constant, sin, exp, etc.), 'time', 'duration' and the necessary additional parameters.
-    # TODO: delete get_active_playlist_points() and replace usages with get_compiled_active_playlist()
+    # The compilation itself is done by core.PlaylistNode.compile
     def compile_active_playlist(self):
+        if self.active_playlist is None:
+            return None
 
-        def _compile_playlist_branch(routine_item : QStandardItem, variables):
-            sequence = {}
-            tend = 0 # end time of current routine (including repeats)
-
-            if routine_item.data(utils.PlaylistItemTypeRole) == utils.Routine:
-                # find routine points relative to routine start
-
-                routine_name = routine_item.data(Qt.DisplayRole)
-                routine_points = self.routines_model.compile_routine(routine_name)
-                routine_repeat_str = routine_item.parent().child(routine_item.row(), self.column_names.index("repeat")).data(Qt.DisplayRole)
-                routine_repeat = int(eval(routine_repeat_str, variables))
-
-                tstart = 0 # When we repeat a routine we need to keep track of the duration to know the start time of the next one
-
-                for _ in range(routine_repeat):
-                    tstart = tend
-                    for chan_key in routine_points:
-                        offset = routine_points[chan_key]["offset"]
-                        events = routine_points[chan_key]["events"]
-                        channel = routine_points[chan_key]["chan"]
-
-                        if chan_key not in sequence:
-                            sequence[chan_key] = {'chan': channel, 'events': []}
-                        t = offset + tstart
-                        if len(events) > 0:
-                            for event in events:
-                                event['time'] = t
-                                sequence[chan_key]['events'].append(event.copy())
-                                t += event['duration']
-                                tend = max(tend, t)
-
-            elif routine_item.data(utils.PlaylistItemTypeRole) == utils.Gap:
-                # if gap has children add children points with gap delay added
-                #
-                # else if gap is last in sequence add points at end with previous value (can this be even done with a
-                # recursive function?)
-                #
-                # Is this really necessary? Children of gaps are already added but with the gap missing.
-                #
-                # TODO
-                pass
-
-            for i in range(routine_item.rowCount()):
-                child_item = routine_item.child(i)
-                child_points = _compile_playlist_branch(child_item, variables)
-
-                for chan_key in child_points:
-                    if chan_key not in sequence:
-                        sequence[chan_key] = {'chan': child_points[chan_key]['chan'], 'events': []}
-                    for chan_point in child_points[chan_key]['events']:
-                        chan_point['time'] = chan_point['time']+tend
-                        sequence[chan_key]['events'].append(chan_point)
-
-            return sequence
-
-        variables = self.variables_model.get_variables_dict()
-        # __builtins__ is added so eval treats 'variables' as we want
-        # (it doesn't add the builtin python variables)
-        variables["__builtins__"] = {}
-
-        # Make numpy available
-        variables['np'] = np
+        variables_dict = self.variables_model.get_variables_dict()
+        variables = core.sequence_namespace(variables_dict)
+        # Routines that don't use the variables that changed since the last call are not compiled again
+        def compile_routine(routine_name):
+            return self.routines_model.get_core_routine(routine_name).compile_cached(variables_dict, variables)
 
-        if self.active_playlist is not None:
-            active_pl_item = self.item(self.active_playlist) # type: QStandardItem
-            return _compile_playlist_branch(active_pl_item, variables)
-        else:
-            return None
+        return self.get_core_playlist(self.active_playlist).compile(compile_routine, variables)
 
 
 class PlaylistMoveRoutineProxyModel(QIdentityProxyModel): #Used for playlist move dialog
@@ -1,6 +1,8 @@
-from PyQt5.QtCore import Qt, QModelIndex, QSortFilterProxyModel, pyqtSlot, pyqtSignal
+from PyQt5.QtCore import Qt, QModelIndex, QPersistentModelIndex, QSortFilterProxyModel, pyqtSlot, pyqtSignal
 from PyQt5.QtGui import QStandardItemModel, QStandardItem, QFont, QColor
 import utils
+import core
+import expressions
 from variables import VariablesModel
 from hardware import Hardware
 
@@ -16,7 +18,17 @@ class RoutinesModel(QStandardItemModel):
         self.variables_model = variables_model
         self.hardware = hardware # type: Hardware
         self.cards = self.hardware.get_cards()
+        self.core_routines = {} # name -> core.Routine, kept until the routines are edited (see get_core_routine)
+        self.routine_durations = {} # name -> duration, calculated by update_values (see get_routine_duration)
+        self.routine_rows = None # name -> persistent index of the routine, built when needed by get_routine_item_by_name
         self.dataChanged.connect(self.update_values)
+        self.dataChanged.connect(self._routine_data_changed)
+        self.rowsInserted.connect(self._invalidate_caches)
+        self.rowsRemoved.connect(self._invalidate_caches)
+        self.rowsMoved.connect(self._invalidate_caches)
+        self.modelReset.connect(self._invalidate_caches)
+        # Durations depend on the variables, this is connected before anything else can ask for them
+        self.variables_model.values_changed.connect(self._invalidate_routine_durations)
 
     def clear(self):
         self.cleared.emit()
@@ -125,98 +137,88 @@ class RoutinesModel(QStandardItemModel):
         self.dataChanged.emit(routine_index, routine_index)
 
     def get_routine_item_by_name(self, routine_name) -> QStandardItem:
+        if self.routine_rows is None:
+            self._build_routine_rows()
+        if routine_name not in self.routine_rows:
+            return None
+
+        routine_index = QModelIndex(self.routine_rows[routine_name])
+        if not routine_index.isValid() or routine_index.data(Qt.DisplayRole) != routine_name: # Out of date
+            self._build_routine_rows()
+            if routine_name not in self.routine_rows:
+                return None
+            routine_index = QModelIndex(self.routine_rows[routine_name])
+        return self.itemFromIndex(routine_index)
+
+    def _build_routine_rows(self):
+        self.routine_rows = {}
         num_routines = self.rowCount()
         for i in range(num_routines):
-            name = self.index(i,0).data(Qt.DisplayRole)
-            if name == routine_name:
-                return self.itemFromIndex(self.index(i,0))
-
-        return None
+            self.routine_rows.setdefault(self.index(i,0).data(Qt.DisplayRole), QPersistentModelIndex(self.index(i,0)))
 
+    # Durations are calculated by update_values, which runs after every edit of the routines or the variables. They are
+    # only recalculated here when they have been invalidated in between.
     def get_routine_duration(self, routine_name):
-        self.update_values()
-        routine_item = self.get_routine_item_by_name(routine_name)
-        num_channels = routine_item.rowCount()
-        duration = 0
-        for c in range(num_channels):
-            channel_duration = 0
-            channel_item = routine_item.child(c)
-            channel_duration = channel_item.data(utils.ChannelDurationRole)
-            duration = max(duration, channel_duration)
-        return duration
+        if routine_name not in self.routine_durations:
+            self.update_values()
+        return self.routine_durations[routine_name]
+
+    # Returns a plain python copy of the named routine that doesn't depend on Qt (see core.Routine)
+    # The copy is reused until the routines are edited, together with the compiled versions that it keeps.
+    def get_core_routine(self, routine_name) -> core.Routine:
+        if routine_name not in self.core_routines:
+            routine_item = self.get_routine_item_by_name(routine_name)
+            self.core_routines[routine_name] = core.Routine.from_pystruct(routine_name,
+                                                                          self._routine_pystruct(routine_item),
+                                                                          self.cards)
+        return self.core_routines[routine_name]
+
+    def _invalidate_caches(self):
+        self.core_routines.clear()
+        self.routine_durations.clear()
+        self.routine_rows = None
+
+    # Forgets the durations of the routines that read any of the variables `var_names`, or of all the routines if it is
+    # None (see VariablesModel.values_changed)
+    def _invalidate_routine_durations(self, var_names=None):
+        if var_names is None:
+            self.routine_durations.clear()
+            return
+        var_names = set(var_names)
+        for routine_name in list(self.routine_durations):
+            if self.get_routine_item_by_name(routine_name) is None:
+                del self.routine_durations[routine_name]
+                continue
+            try:
+                used_names = self.get_core_routine(routine_name).used_names()
+            except Exception: # e.g. SequenceException, KeyError or SyntaxError from a routine that can't be built
+                used_names = var_names # its duration is calculated again
+            if not var_names.isdisjoint(used_names):
+                del self.routine_durations[routine_name]
+
+    # Connected to VariablesModel.values_changed after _invalidate_routine_durations, the calculated values are only
+    # refreshed if a routine reads one of the variables that changed
+    @pyqtSlot(object)
+    def update_changed_values(self, var_names):
+        if any(name not in self.routine_durations for name in self.get_routine_names()):
+            self.update_values()
+
+    # The refresh of calculated values emits dataChanged without a valid index (see update_values), it doesn't change
+    # the definition of the routines
+    def _routine_data_changed(self, top_left, bottom_right):
+        if top_left.isValid():
+            self.core_routines.clear()
+            if not top_left.parent().isValid(): # A routine was renamed
+                self.routine_rows = None
 
     # Returns a dict representing the named routine in which the variables have been replaced by their numerical values.
     # The dict has the structure key->{'offset':num, 'events':[], 'chan':cards.Channel} where key is a pair  (card, chan_num)
-    # TODO: delete get_routine_points
-    def compile_routine(self, routine_name):
-        points = {}
-
-        variables = self.variables_model.get_variables_dict()
-        # __builtins__ is added so eval treats 'variables' as we want
-        # (it doesn't add the builtin python variables)
-        variables["__builtins__"] = {}
-
-        # Make numpy available
-        variables['np'] = np
-
-        routine_item = self.get_routine_item_by_name(routine_name)
-        num_tracks = routine_item.rowCount()
-        for c in range(num_tracks):
-            track_item = routine_item.child(c)
-            chan = track_item.data(utils.ChannelRole)
-            chan_dict = chan.get_channel_dict()
-            chan_key = (chan_dict['card'], chan_dict['index'])
-            track_offset = eval(track_item.data(utils.TrackOffsetRole), variables)
-
-            points[chan_key] = {"offset": track_offset, "events": [], "chan": chan}
-            for k in range(track_item.rowCount()):
-                event_item = track_item.child(k)
-                event_duration = eval(event_item.data(utils.EventDurationRole), variables)
-
-                if track_item.data(utils.TrackTypeRole) == utils.DigitalTrack:
-                    event_state = int(event_item.data(Qt.CheckStateRole) == Qt.Checked)
-                    points[chan_key]['events'].append({'type': 'boolean',
-                                                       'duration': event_duration,
-                                                       'state': event_state })
-
-                elif track_item.data(utils.TrackTypeRole) == utils.AnalogTrack:
-                    if event_item.data(utils.AEventFunctionRole) == 'constant':
-                        value = eval(event_item.data(utils.AEventValueRole), variables)
-                        points[chan_key]['events'].append({'type': 'constant',
-                                                           'duration': event_duration,
-                                                           'value': value})
-                    elif event_item.data(utils.AEventFunctionRole) == 'linear':
-                        start_val = eval(event_item.data(utils.AEventStartValRole), variables)
-                        end_val = eval(event_item.data(utils.AEventEndValRole), variables)
-                        points[chan_key]['events'].append({'type': 'linear',
-                                                           'duration': event_duration,
-                                                           'start_val': start_val,
-                                                           'end_val': end_val})
-                    elif event_item.data(utils.AEventFunctionRole) == 'exp':
-                        start_val = eval(event_item.data(utils.AEventStartValRole), variables)
-                        end_val = eval(event_item.data(utils.AEventEndValRole), variables)
-                        gamma = eval(event_item.data(utils.AEventGammaRole), variables)
-                        points[chan_key]['events'].append({'type': 'exp',
-                                                           'duration': event_duration,
-                                                           'start_val': start_val,
-                                                           'end_val': end_val,
-                                                           'gamma': gamma})
-
-                    elif event_item.data(utils.AEventFunctionRole) == 'sin':
-                        frequency = eval(event_item.data(utils.AEventFrequencyRole), variables)
-                        amplitude = eval(event_item.data(utils.AEventAmplitudeRole), variables)
-                        offset = eval(event_item.data(utils.AEventOffsetRole), variables)
-                        phase = eval(event_item.data(utils.AEventPhaseRole), variables)
-                        points[chan_key]['events'].append({'type': 'sin',
-                                                           'duration': event_duration,
-                                                           'frequency': frequency,
-                                                           'amplitude': amplitude,
-                                                           'offset': offset,
-                                                           'phase': phase})
-
-                    # TODO other function
-
-        return points
+    # The returned dict is shared with later calls and must not be modified.
+    def compile_routine(self, routine_name, variables_dict=None):
+        if variables_dict is None:
+            variables_dict = self.variables_model.get_variables_dict()
+        namespace = core.sequence_namespace(variables_dict)
+        return self.get_core_routine(routine_name).compile_cached(variables_dict, namespace)
 
     def load_routines_from_pystruct(self, routines_dict):
         routine_names = routines_dict.keys()
@@ -274,45 +276,48 @@ class RoutinesModel(QStandardItemModel):
             routine_index = self.index(i,0)
             routine_item = self.itemFromIndex(routine_index)
             routine_name = routine_index.data()
-            parsed_tracks = []
-            for j in range(routine_item.rowCount()):
-                track_item = routine_item.child(j)
-                track_name = track_item.data(Qt.DisplayRole)
-                parsed_track = {}
-                parsed_track["chan"] = track_item.data(utils.ChannelRole).get_channel_dict()
-                parsed_track["offset"] = track_item.data(utils.TrackOffsetRole)
-
-                parsed_events = []
-                for k in range(track_item.rowCount()):
-                    event_item = track_item.child(k)
-                    event_duration = event_item.data(Qt.DisplayRole)
-                    parsed_event = {"duration": event_duration}
-                    if track_item.data(utils.TrackTypeRole) == utils.DigitalTrack:
-                        parsed_event["state"] = (event_item.data(Qt.CheckStateRole) == Qt.Checked)
-                    elif track_item.data(utils.TrackTypeRole) == utils.AnalogTrack:
-                        ftype = event_item.data(utils.AEventFunctionRole)
-                        parsed_event['function'] = ftype
-                        if ftype == "constant":
-                            parsed_event['val'] = event_item.data(utils.AEventValueRole)
-                        elif ftype == "linear":
-                            parsed_event['start_val'] = event_item.data(utils.AEventStartValRole)
-                            parsed_event['end_val'] = event_item.data(utils.AEventEndValRole)
-                        elif ftype == "exp":
-                            parsed_event['start_val'] = event_item.data(utils.AEventStartValRole)
-                            parsed_event['end_val'] = event_item.data(utils.AEventEndValRole)
-                            parsed_event['gamma'] = event_item.data(utils.AEventGammaRole)
-                        elif ftype == "sin":
-                            parsed_event['frequency'] = event_item.data(utils.AEventFrequencyRole)
-                            parsed_event['amplitude'] = event_item.data(utils.AEventAmplitudeRole)
-                            parsed_event['offset'] = event_item.data(utils.AEventOffsetRole)
-                            parsed_event['phase'] = event_item.data(utils.AEventPhaseRole)
-                    parsed_events.append(parsed_event)
-                parsed_track["events"] = parsed_events
-                parsed_tracks.append(parsed_track)
-            parsed_routines[routine_name] = parsed_tracks
+            parsed_routines[routine_name] = self._routine_pystruct(routine_item)
 
         return parsed_routines
 
+    @staticmethod
+    def _routine_pystruct(routine_item: QStandardItem):
+        parsed_tracks = []
+        for j in range(routine_item.rowCount()):
+            track_item = routine_item.child(j)
+            parsed_track = {}
+            parsed_track["chan"] = track_item.data(utils.ChannelRole).get_channel_dict()
+            parsed_track["offset"] = track_item.data(utils.TrackOffsetRole)
+
+            parsed_events = []
+            for k in range(track_item.rowCount()):
+                event_item = track_item.child(k)
+                event_duration = event_item.data(Qt.DisplayRole)
+                parsed_event = {"duration": event_duration}
+                if track_item.data(utils.TrackTypeRole) == utils.DigitalTrack:
+                    parsed_event["state"] = (event_item.data(Qt.CheckStateRole) == Qt.Checked)
+                elif track_item.data(utils.TrackTypeRole) == utils.AnalogTrack:
+                    ftype = event_item.data(utils.AEventFunctionRole)
+                    parsed_event['function'] = ftype
+                    if ftype == "constant":
+                        parsed_event['val'] = event_item.data(utils.AEventValueRole)
+                    elif ftype == "linear":
+                        parsed_event['start_val'] = event_item.data(utils.AEventStartValRole)
+                        parsed_event['end_val'] = event_item.data(utils.AEventEndValRole)
+                    elif ftype == "exp":
+                        parsed_event['start_val'] = event_item.data(utils.AEventStartValRole)
+                        parsed_event['end_val'] = event_item.data(utils.AEventEndValRole)
+                        parsed_event['gamma'] = event_item.data(utils.AEventGammaRole)
+                    elif ftype == "sin":
+                        parsed_event['frequency'] = event_item.data(utils.AEventFrequencyRole)
+                        parsed_event['amplitude'] = event_item.data(utils.AEventAmplitudeRole)
+                        parsed_event['offset'] = event_item.data(utils.AEventOffsetRole)
+                        parsed_event['phase'] = event_item.data(utils.AEventPhaseRole)
+                parsed_events.append(parsed_event)
+            parsed_track["events"] = parsed_events
+            parsed_tracks.append(parsed_track)
+        return parsed_tracks
+
     @pyqtSlot()
     def update_values(self):
         value_changed = False # Flag to decide if dataChanged signal should be emited
@@ -328,9 +333,11 @@ class RoutinesModel(QStandardItemModel):
         # Make numpy available
         variables['np'] = np
 
+        routine_durations = {}
         num_routines = self.rowCount()
         for r in range(num_routines):
             routine_index = self.index(r,0)
+            routine_duration = 0
             num_channels = self.rowCount(routine_index)
             for c in range(num_channels):
                 channel_index = self.index(c,0,routine_index)
@@ -338,7 +345,7 @@ class RoutinesModel(QStandardItemModel):
                 try:
                     start_time = float(start)
                 except ValueError:
-                    start_time = eval(start, variables)
+                    start_time = expressions.evaluate(start, variables)
                 except TypeError:
                     if start is None:
                         start_time = 0
@@ -357,7 +364,7 @@ class RoutinesModel(QStandardItemModel):
                         self.itemFromIndex(event_index).setBackground(Qt.white)
                     except ValueError:
                         try:
-                            dur_num = eval(duration, variables) # duration of event
+                            dur_num = expressions.evaluate(duration, variables) # duration of event
                             self.setData(event_index, dur_num, utils.EventDurationRoleNum)
                             start_time += dur_num  #Start time of next event
                             self.itemFromIndex(event_index).setBackground(Qt.white)
@@ -376,7 +383,7 @@ class RoutinesModel(QStandardItemModel):
                         if event_index.data(utils.AEventFunctionRole) == "constant":
                             value = event_index.data(utils.AEventValueRole)
                             try:
-                                val = eval(value, variables)
+                                val = expressions.evaluate(value, variables)
                                 if event_index.data(utils.AEventValueNumericRole) != val:
                                     self.setData(event_index, val, utils.AEventValueNumericRole)
                                     value_changed = True
@@ -394,6 +401,11 @@ class RoutinesModel(QStandardItemModel):
                 if start_time != self.data(channel_index, utils.ChannelDurationRole):
                     value_changed = True
                     self.setData(channel_index,start_time, utils.ChannelDurationRole)
+                routine_duration = max(routine_duration, start_time)
+
+            routine_durations[routine_index.data(Qt.DisplayRole)] = routine_duration
+
+        self.routine_durations = routine_durations
 
         self.blockSignals(False)
         if value_changed:
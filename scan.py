@@ -0,0 +1,81 @@
+# The points of an iteration over several nested variables, computed when they are needed instead of being stored.
+
+import random
+
+_MASK64 = (1 << 64) - 1
+
+
+# Mixes the bits of a 64 bit integer (splitmix64 finalizer)
+def _mix(x):
+    x = ((x ^ (x >> 30)) * 0xbf58476d1ce4e5b9) & _MASK64
+    x = ((x ^ (x >> 27)) * 0x94d049bb133111eb) & _MASK64
+    return x ^ (x >> 31)
+
+
+# A pseudo-random bijection of range(size) determined by `seed`. It is computed on the fly with a small Feistel network
+# over the smallest power of 4 that contains `size` and cycle walking, so it uses O(1) memory whatever the size.
+class Permutation:
+    rounds = 4
+
+    def __init__(self, size, seed):
+        self.size = size
+        bits = max(2, (size - 1).bit_length())
+        bits += bits % 2
+        self.half_bits = bits // 2
+        self.half_mask = (1 << self.half_bits) - 1
+        self.keys = [_mix((seed + i) & _MASK64) for i in range(self.rounds)]
+
+    def _feistel(self, x):
+        left = x >> self.half_bits
+        right = x & self.half_mask
+        for key in self.keys:
+            left, right = right, left ^ (_mix(right ^ key) & self.half_mask)
+        return (left << self.half_bits) | right
+
+    def __getitem__(self, index):
+        if not 0 <= index < self.size:
+            raise IndexError("permutation index out of range")
+        x = self._feistel(index)
+        while x >= self.size: # Walk the cycle until we are back in range, it takes less than 4 steps on average
+            x = self._feistel(x)
+        return x
+
+    def __len__(self):
+        return self.size
+
+
+# The indices of the iterating variables for every point of a nested iteration.
+# `variables` is a list of (variable name, number of values) sorted from the outermost to the innermost variable.
+# Point `run_idx` is a dict {variable name: index} computed with mixed-radix arithmetic, the innermost variable changes
+# fastest. When shuffled, the points are visited in the order of a random Permutation.
+class ScanSpace:
+    def __init__(self, variables):
+        self.names = [name for name, _ in variables]
+        self.sizes = [num_values for _, num_values in variables]
+        self.size = 1
+        for num_values in self.sizes:
+            self.size *= num_values
+        self.permutation = None
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, run_idx):
+        if not 0 <= run_idx < self.size:
+            raise IndexError("scan index out of range")
+        if self.permutation is not None:
+            run_idx = self.permutation[run_idx]
+
+        indices = {}
+        for name, num_values in zip(reversed(self.names), reversed(self.sizes)):
+            run_idx, indices[name] = divmod(run_idx, num_values)
+        return {name: indices[name] for name in self.names}
+
+    # Visits the points in a new random order. The same seed always gives the same order.
+    def shuffle(self, seed=None):
+        if seed is None:
+            seed = random.getrandbits(64)
+        self.permutation = Permutation(self.size, seed)
+
+    def unshuffle(self):
+        self.permutation = None
@@ -1,34 +1,51 @@
 import database
 import hardware
+import scan
 import sequence
+import tracing
 
-import random
+import concurrent.futures
 
 
 class Scheduler:
 
-    def __init__(self, seq: sequence.Sequence, hw: hardware.Hardware, db: database.Database):
+    # During iterations the next `precompile_depth` points are compiled and processed in a background thread while the
+    # current one is playing, so that they can be submitted as soon as the hardware is ready. 0 disables it.
+    # `tracer` records the timestamps of the stages of every shot, a Tracer without sink is used if it is None.
+    def __init__(self, seq: sequence.Sequence, hw: hardware.Hardware, db: database.Database, precompile_depth=1,
+                 tracer: tracing.Tracer = None):
         self.sequence = seq
         self.hardware = hw
         self.database = db
         self.hardware.add_sequence_end_listener(self.sequence_finished)
+        self.tracer = tracer if tracer is not None else tracing.Tracer()
+        self.hardware.tracer = self.tracer
         self.sequence_start_listeners = []
         self.sequence_end_listeners = []
         self.sequence_stopped_listeners = []
         self.sequence_iteration_finished_listeners = []
 
-        # TODO: run_id and iter_id should be loaded and saved into a database
-        self.run_id = self.database.get_latest_run_id()+1
+        # Run ids are reserved from the database in blocks so that instances sharing it don't use the same ones.
+        # self.run_id is the id of the current run, it changes only when iterating.
+        self.run_ids = database.RunIdAllocator(self.database)
+        self.run_id = self.run_ids.peek()
+        # TODO: iter_id should be loaded and saved into a database
         self.iter_id = 0
 
         self.run_idx = 0 # used for iterations
-        self.iter_indices = None
+        self.iter_indices = None # scan.ScanSpace
 
         self.continuous = False
         self.advance_indices = False
         self.shuffle = False
         self.playing = False
 
+        self.precompile_depth = precompile_depth
+        self.precompile_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self.precompiled = {} # run_idx -> future of (prepared sequence, vars_dict, iter_dict)
+        self.core_sequence = None # copy of the sequence used to precompile, see Sequence.get_core_sequence
+        self.core_sequence_version = None
+
     def play_once(self):
         print("Run single")
         self.hardware.cycle_init()
@@ -38,18 +55,83 @@ class Scheduler:
     def play(self):
         if self.playing:
             pass
+        elif self.advance_indices and self.precompile_depth > 0:
+            self.playing = True
+            self.play_precompiled()
         else:
             self.playing = True
-            csequence = self.sequence.playlist.compile_active_playlist()
-            if csequence is not None:
-                vars_dict = self.sequence.variables.get_variables_dict()
-                iter_dict = self.sequence.variables.get_iterating_variables()
+            self.play_compiled()
+
+    # Compiles the sequence shown in the GUI and plays it
+    def play_compiled(self):
+        self.tracer.mark(self.run_id, "compile_start")
+        csequence = self.sequence.playlist.compile_active_playlist()
+        self.tracer.mark(self.run_id, "compile_end")
+        if csequence is not None:
+            vars_dict = self.sequence.variables.get_variables_dict()
+            iter_dict = self.sequence.variables.get_iterating_variables()
+
+            self.hardware.process_sequence(csequence, self.run_id)
+            self.hardware.play_once(self.run_id)
+            self.notify_sequence_started(self.run_id, vars_dict, iter_dict)
+            if self.advance_indices: # Only save stuff if iterating
+                self.store_run_parameters(self.run_id, vars_dict, iter_dict)
+
+    # Plays the current point of the iteration using the precompiled sequence, and starts precompiling the next ones
+    def play_precompiled(self):
+        self.precompile_point(self.run_idx)
+        try:
+            prepared, vars_dict, iter_dict = self.precompiled.pop(self.run_idx).result()
+        except Exception as e:
+            # e.g. the last point of a scan whose increment doesn't divide its range has no value. The GUI keeps the
+            # previous value in that case, so the point is played from the GUI as it is done without precompiling.
+            print("Error: Point %d of the scan cannot be precompiled: %r" % (self.run_idx, e))
+            self.sequence.set_iterating_variables_indices(self.iter_indices[self.run_idx])
+            self.play_compiled()
+            return
+        if prepared is not None:
+            self.hardware.load_prepared_sequence(prepared, self.run_id)
+            self.hardware.play_once(self.run_id)
+            for k in range(1, self.precompile_depth+1):
+                # Points of the next iteration are not precompiled because the indices may be shuffled again
+                if self.run_idx + k < len(self.iter_indices):
+                    self.precompile_point(self.run_idx + k)
+            self.notify_sequence_started(self.run_id, vars_dict, iter_dict)
+            self.store_run_parameters(self.run_id, vars_dict, iter_dict)
 
-                self.hardware.process_sequence(csequence, self.run_id)
-                self.hardware.play_once(self.run_id)
-                self.notify_sequence_started(self.run_id, vars_dict, iter_dict)
-                if self.advance_indices: # Only save stuff if iterating
-                    self.database.store_run_parameters(self.run_id, vars_dict, iter_dict)
+    def store_run_parameters(self, run_id, vars_dict, iter_dict):
+        self.tracer.mark(run_id, "database_start")
+        self.database.store_run_parameters(run_id, vars_dict, iter_dict)
+        self.tracer.mark(run_id, "database_end")
+
+    # Starts compiling the point `run_idx` of the iteration in the background thread if it hasn't been done yet
+    def precompile_point(self, run_idx):
+        # Discard what has been precompiled if the sequence has been modified
+        if self.core_sequence is None or self.core_sequence_version != self.sequence.version or \
+                self.core_sequence.playlist.active_playlist != self.sequence.playlist.active_playlist:
+            self.discard_precompiled()
+            self.core_sequence = self.sequence.get_core_sequence()
+            self.core_sequence_version = self.sequence.version
+
+        if run_idx not in self.precompiled:
+            run_id = self.run_ids.peek(run_idx - self.run_idx)
+            self.precompiled[run_idx] = self.precompile_executor.submit(
+                self.precompile, self.core_sequence, self.iter_indices[run_idx], run_id)
+
+    # This function runs in the background thread
+    def precompile(self, core_sequence, scanvars_indices, run_id):
+        self.tracer.mark(run_id, "compile_start")
+        csequence, vars_dict, iter_dict = core_sequence.compile_point(scanvars_indices)
+        self.tracer.mark(run_id, "compile_end")
+        if csequence is None:
+            return None, vars_dict, iter_dict
+        return self.hardware.prepare_sequence(csequence, run_id), vars_dict, iter_dict
+
+    def discard_precompiled(self):
+        for future in self.precompiled.values():
+            future.cancel()
+        self.precompiled = {}
+        self.core_sequence = None
 
 
     def play_continuous(self):
@@ -73,29 +155,19 @@ class Scheduler:
             levels = list(by_nesting_level.keys())
             levels.sort()
 
-            # Generate all indices
-            self.iter_indices = []
-            for level in levels:
-                num_values = by_nesting_level[level]['num_values']
-                var_name = by_nesting_level[level]['var_name']
-                if level == 0:
-                    for i in range(num_values):
-                        self.iter_indices.append({var_name:i})
-                else:
-                    new_index_list = []
-                    for index_dict in self.iter_indices:
-                        for i in range(num_values):
-                            index_dict[var_name] = i
-                            new_index_list.append(index_dict.copy())
-                    self.iter_indices = new_index_list
+            # The indices of each point are computed when needed, the outermost variable has the lowest nesting level
+            self.iter_indices = scan.ScanSpace([(by_nesting_level[level]['var_name'], by_nesting_level[level]['num_values'])
+                                                for level in levels])
 
             if self.shuffle:
-                random.shuffle(self.iter_indices)
+                self.iter_indices.shuffle()
 
             self.continuous = True
             self.advance_indices = True
             self.run_idx = 0
+            self.discard_precompiled()
             self.sequence.variables.reset_indices()
+            self.sequence.set_iterating_variables_indices(self.iter_indices[0]) # The indices may be shuffled
             self.hardware.cycle_init()
             self.play()
             return True
@@ -105,7 +177,9 @@ class Scheduler:
 
     def stop(self):
         self.continuous = False
+        self.discard_precompiled()
         self.hardware.stop()
+        self.database.flush(timeout=0) # Write the runs that are still queued without waiting
 
     def shuffle_on(self):
         self.shuffle = True
@@ -116,19 +190,24 @@ class Scheduler:
     # This function is called when the hardware is ready to receive the next new sequence
     def sequence_finished(self):
         self.notify_sequence_finished(self.run_id, self.sequence.variables.get_variables_dict(), self.sequence.variables.get_iterating_variables())  #################################################################
+        self.tracer.mark(self.run_id, "finish_published")
+        self.tracer.close(self.run_id)
         print("scheduler: Ready for next one")
+        next_indices = None
         if self.advance_indices:
-            self.run_id += 1
+            self.run_ids.take()
+            self.run_id = self.run_ids.peek()
             self.run_idx += 1
             if self.run_idx == len(self.iter_indices):
                 self.notify_sequence_iteration_finished()
                 self.iter_id += 1
                 self.run_idx = 0
                 if self.shuffle:
-                    random.shuffle(self.iter_indices)
+                    self.iter_indices.shuffle()
             next_indices = self.iter_indices[self.run_idx]
             print(next_indices)
-            self.sequence.variables.set_iterating_variables_indices(next_indices)
+            if self.precompile_depth == 0:
+                self.sequence.set_iterating_variables_indices(next_indices)
 
         self.playing = False
         if self.continuous:
@@ -139,6 +218,10 @@ class Scheduler:
             self.advance_indices = False
             self.notify_sequence_stopped()
 
+        # When precompiling, the next sequence is submitted before updating the variables shown in the GUI
+        if next_indices is not None and self.precompile_depth > 0:
+            self.sequence.set_iterating_variables_indices(next_indices)
+
     # The callbacks registered with this function will be called whenever a sequences starts
     # callback(run_id, variables_dict)
     def add_sequence_start_listener(self, callback):
@@ -163,8 +246,10 @@ class Scheduler:
     # Notify listeners
     def notify_sequence_started(self, run_id, vars_dict, iter_dict):
         print("scheduler: Sequence finished")
+        self.tracer.mark(run_id, "publish_start")
         for callback in self.sequence_start_listeners:
             callback(run_id, vars_dict, iter_dict)
+        self.tracer.mark(run_id, "publish_end")
 
     def notify_sequence_finished(self, run_id, vars_dict, iter_dict):##########################################################################
         print("scheduler: Sequence finished")
@@ -173,6 +258,7 @@ class Scheduler:
 
     def notify_sequence_stopped(self):
         print("scheduler: Sequence stopped")
+        self.tracer.break_chain()
         for callback in self.sequence_stopped_listeners:
             callback(self.run_id)
 
@@ -1,6 +1,7 @@
 from variables import VariablesModel
 from routines import RoutinesModel
 from playlist import PlaylistModel
+import core
 
 from PyQt5.QtCore import Qt
 
@@ -12,6 +13,30 @@ class Sequence:
         self.routines = routines
         self.playlist = playlist
 
+        # version is increased whenever the sequence is modified, except when only the iteration indices change. It is
+        # used to know when copies of the sequence (see get_core_sequence) are outdated.
+        self.version = 0
+        self._setting_indices = False
+        for model in (self.variables, self.routines, self.playlist):
+            model.dataChanged.connect(self._modified)
+            model.rowsInserted.connect(self._modified)
+            model.rowsRemoved.connect(self._modified)
+            model.rowsMoved.connect(self._modified)
+            model.modelReset.connect(self._modified)
+
+    def _modified(self, *args):
+        if not self._setting_indices:
+            self.version += 1
+
+    # Sets the indices of the iterating variables (see VariablesModel.set_iterating_variables_indices) without
+    # increasing the version of the sequence
+    def set_iterating_variables_indices(self, scanvars_indices):
+        self._setting_indices = True
+        try:
+            self.variables.set_iterating_variables_indices(scanvars_indices)
+        finally:
+            self._setting_indices = False
+
     def load_sequence_from_dict(self, sequence):
         self.clear()
 
@@ -27,6 +52,13 @@ class Sequence:
         sequence = {"variables": variables, "routines": routines, "playlist": playlist}
         return sequence
 
+    # Returns a copy of the sequence that doesn't depend on Qt, with the same active playlist (see core.Sequence).
+    # It can be compiled outside of the GUI thread.
+    def get_core_sequence(self) -> core.Sequence:
+        core_sequence = core.Sequence.from_pystruct(self.sequence_to_dict(), self.routines.cards)
+        core_sequence.playlist.set_active_playlist(self.playlist.active_playlist)
+        return core_sequence
+
     def clear(self):
         self.variables.clear()
         self.routines.clear()
@@ -0,0 +1,79 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import expressions
+
+
+class FreeNamesTest(unittest.TestCase):
+    def test_expression(self):
+        self.assertEqual(expressions.free_names("a + b*sin(c)", "eval"), {"a", "b", "sin", "c"})
+
+    def test_assigned_before_read(self):
+        self.assertEqual(expressions.free_names("y = 2*a\n_return_ = y + 1"), {"a"})
+
+    # The name is read before the snippet assigns it, it comes from outside
+    def test_reassignment(self):
+        self.assertEqual(expressions.free_names("x = x + 1\n_return_ = x"), {"x"})
+        self.assertEqual(expressions.free_names("x += 1\n_return_ = x"), {"x"})
+        self.assertEqual(expressions.free_names("y = x\nx = 2\n_return_ = x + y"), {"x"})
+
+    def test_local_names(self):
+        source = "total = 0\nfor i in range(n):\n    total = total + i\n_return_ = total"
+        self.assertEqual(expressions.free_names(source), {"range", "n"})
+        self.assertEqual(expressions.free_names("_return_ = sum([k*a for k in ks])"), {"sum", "a", "ks"})
+        self.assertEqual(expressions.free_names("f = lambda q: q + w\n_return_ = f(1)"), {"w"})
+        self.assertEqual(expressions.free_names("def g(u):\n    return u + v\n_return_ = g(2)"), {"v"})
+        self.assertEqual(expressions.free_names("import math\n_return_ = math.pi*T"), {"T"})
+
+
+# Numeric literals are not compiled, their value (or error) must still be the one that eval gives
+class NumericLiteralTest(unittest.TestCase):
+    def assert_same_as_eval(self, source):
+        try:
+            expected = eval(source.strip(), {})
+        except SyntaxError:
+            with self.assertRaises(SyntaxError):
+                expressions.evaluate(source, {})
+            return
+        value = expressions.evaluate(source, {})
+        self.assertEqual((type(value), value), (type(expected), expected), source)
+
+    def test_literals(self):
+        for source in ["10", " -2 ", "+3", "0", "00", "-0", "010", "007", "0.5", "00.5", "1.", ".5", "-2.5e3", "1e-3",
+                       "01e3", "1E5", "1_000", "1_000.5", "1__0", "0x10", "1e", "1.2.3", "\u0663", "5 ", "- 5"]:
+            self.assert_same_as_eval(source)
+
+
+class DependencyOrderTest(unittest.TestCase):
+    def test_order(self):
+        order, cycles = expressions.dependency_order({"c": {"b"}, "b": {"a", "unknown"}, "a": set()})
+        self.assertEqual(order, ["a", "b", "c"])
+        self.assertEqual(cycles, [])
+
+    def test_cycles(self):
+        order, cycles = expressions.dependency_order({"a": {"b"}, "b": {"a"}, "c": {"c"}, "d": {"a"}, "e": set()})
+        self.assertEqual(sorted(order), ["d", "e"])
+        self.assertEqual(sorted(map(sorted, cycles)), [["a", "b"], ["c"]])
+
+    # A variable that reassigns another one still depends on it
+    def test_reassignment(self):
+        code = {"y": "x = x + 1\n_return_ = x", "z": "y = 3\n_return_ = y"}
+        dependencies = {name: set(expressions.free_names(source)) & {"x", "y", "z"} for name, source in code.items()}
+        dependencies["x"] = set()
+        self.assertEqual(dependencies, {"x": set(), "y": {"x"}, "z": set()})
+        order, cycles = expressions.dependency_order(dependencies)
+        self.assertLess(order.index("x"), order.index("y"))
+        self.assertEqual(cycles, [])
+
+    def test_long_chain(self):
+        dependencies = {i: {i - 1} for i in range(1, 100000)}
+        dependencies[0] = set()
+        order, cycles = expressions.dependency_order(dependencies)
+        self.assertEqual(order, list(range(100000)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,55 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+from PyQt5.QtGui import QGuiApplication
+
+import core
+from variables import VariablesModel
+
+
+def scan_variables(start, stop, increment):
+    return {"parameters": [
+        {"name": "a", "set": "2", "value": "2", "iterator": False, "start": None, "stop": None, "increment": None,
+         "comment": None, "scan index": None, "nesting level": None},
+        {"name": "x", "set": "0", "value": "0", "iterator": True, "start": start, "stop": stop,
+         "increment": increment, "comment": None, "scan index": "0", "nesting level": "0"},
+    ]}
+
+
+# The scans that the GUI compiles (VariablesModel) and the ones compiled in the background (core.Variables) must agree
+class IteratingVariablesTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.app = QGuiApplication.instance() or QGuiApplication([])
+
+    def assert_same_iterating_variables(self, start, stop, increment):
+        variables_dict = scan_variables(start, stop, increment)
+        model = VariablesModel()
+        model.load_variables_from_pystruct(variables_dict)
+        iter_vars = core.Variables.from_pystruct(variables_dict).get_iterating_variables()
+        self.assertEqual(model.get_iterating_variables(), iter_vars)
+        return iter_vars
+
+    def test_ascending_scan_is_rejected(self):
+        self.assertEqual(self.assert_same_iterating_variables("1", "3", "1"), {})
+
+    def test_descending_scan(self):
+        iter_vars = self.assert_same_iterating_variables("3", "1", "-1")
+        self.assertEqual(iter_vars["x"], {"start": 3.0, "stop": 1.0, "increment": -1.0, "nesting level": 0,
+                                          "num_values": 3, "scan_index": 0})
+
+    def test_non_integer_step(self):
+        self.assertEqual(self.assert_same_iterating_variables("1", "0", "-0.1")["x"]["num_values"], 11)
+        self.assertEqual(self.assert_same_iterating_variables("1", "0", "-0.3")["x"]["num_values"], 5)
+
+    def test_invalid_fields(self):
+        self.assertEqual(self.assert_same_iterating_variables("3", "1", "step"), {})
+        self.assertEqual(self.assert_same_iterating_variables("3", None, "-1"), {})
+
+
+if __name__ == "__main__":
+    unittest.main()
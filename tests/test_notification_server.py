@@ -0,0 +1,101 @@
+import asyncio
+import os
+import socket
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from notify import server
+
+
+class NotificationServerTest(unittest.IsolatedAsyncioTestCase):
+    async def start_server(self, queue_size=1000, overflow_policy=server.DROP_OLDEST):
+        self.server = server.NotificationServer("127.0.0.1", 0, queue_size, overflow_policy)
+        self.tcp_server = await asyncio.start_server(self.server.handle_message, "127.0.0.1", 0)
+        self.port = self.tcp_server.sockets[0].getsockname()[1]
+        self.connections = []
+
+    async def asyncTearDown(self):
+        for writer in self.connections:
+            writer.close()
+        for subscriber in list(self.server.subscribers):
+            self.server.remove_subscriber(subscriber)
+        self.tcp_server.close()
+        await self.tcp_server.wait_closed()
+
+    async def wait_for(self, condition, timeout=5):
+        for _ in range(int(timeout / 0.01)):
+            if condition():
+                return
+            await asyncio.sleep(0.01)
+        self.fail("timeout")
+
+    # Returns the reader of a new subscriber once the server has registered it
+    async def subscribe(self, sock=None):
+        count = len(self.server.subscribers)
+        if sock is None:
+            reader, writer = await asyncio.open_connection("127.0.0.1", self.port)
+        else:
+            sock.connect(("127.0.0.1", self.port))
+            reader, writer = await asyncio.open_connection(sock=sock)
+        self.connections.append(writer)
+        writer.write(b"S\r\n")
+        await self.wait_for(lambda: len(self.server.subscribers) > count)
+        return reader
+
+    # Subscriber that never reads: its buffers are so small that its queue on the server fills up at once
+    async def subscribe_slow(self):
+        sock = socket.socket()
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1024)
+        await self.subscribe(sock)
+        subscriber = self.server.subscribers[-1]
+        subscriber.writer.get_extra_info("socket").setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 1024)
+        subscriber.writer.transport.set_write_buffer_limits(high=1024)
+        return subscriber
+
+    async def publish(self, messages):
+        _, writer = await asyncio.open_connection("127.0.0.1", self.port)
+        writer.write("".join("P%s\n" % message for message in messages).encode())
+        await writer.drain()
+        writer.close()
+
+    async def read_lines(self, reader, count):
+        return [(await asyncio.wait_for(reader.readline(), 5)).decode() for _ in range(count)]
+
+    async def test_several_publications_per_connection(self):
+        await self.start_server()
+        reader = await self.subscribe()
+        await self.publish(["a", "b", "c"])
+        await self.publish(["d"])
+        self.assertEqual(await self.read_lines(reader, 4), ["a\n", "b\n", "c\n", "d\n"])
+
+    def messages(self):
+        return ["%d %s" % (i, "x"*1000) for i in range(500)]
+
+    async def test_drop_oldest(self):
+        await self.start_server(queue_size=20, overflow_policy=server.DROP_OLDEST)
+        slow = await self.subscribe_slow()
+        fast = await self.subscribe()
+        messages = self.messages()
+        await self.publish(messages)
+        # The fast subscriber gets every message while the slow one only loses the oldest ones
+        self.assertEqual(await self.read_lines(fast, len(messages)), [m + "\n" for m in messages])
+        self.assertIn(slow, self.server.subscribers)
+        self.assertGreater(slow.dropped, 0)
+        self.assertLessEqual(len(slow.queue), 20)
+        self.assertEqual(slow.queue[-1], messages[-1] + "\n")
+
+    async def test_disconnect(self):
+        await self.start_server(queue_size=20, overflow_policy=server.DISCONNECT)
+        slow = await self.subscribe_slow()
+        fast = await self.subscribe()
+        messages = self.messages()
+        await self.publish(messages)
+        self.assertEqual(await self.read_lines(fast, len(messages)), [m + "\n" for m in messages])
+        self.assertNotIn(slow, self.server.subscribers)
+        self.assertEqual(len(self.server.subscribers), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,73 @@
+import json
+import os
+import sys
+import unittest
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+from PyQt5.QtGui import QGuiApplication
+
+import config
+import database
+from variables import VariablesModel
+from routines import RoutinesModel
+from playlist import PlaylistModel
+from sequence import Sequence
+from scheduler import Scheduler
+
+
+class RecordingDatabase(database.Database):
+    def __init__(self):
+        self.records = []
+
+    def store_run_parameters(self, run_id, variables, iterators):
+        self.records.append((run_id, variables, iterators))
+
+
+# A scan played with precompilation must store the same parameters as the one compiled from the models of the GUI
+class PrecompiledScanTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.app = QGuiApplication.instance() or QGuiApplication([])
+
+    def play_scan(self, precompile_depth, shots):
+        hardware = config.Config(os.path.join(REPO, "examples", "dummy", "config_dummy.json")).get_hardware()
+        variables_model = VariablesModel()
+        routines_model = RoutinesModel(variables_model, hardware)
+        playlist_model = PlaylistModel(variables_model, routines_model)
+        sequence = Sequence(variables_model, routines_model, playlist_model)
+
+        with open(os.path.join(REPO, "examples", "sequences", "pulses.json")) as sequence_file:
+            sequence_dict = json.load(sequence_file)
+        parameters = sequence_dict["variables"]["parameters"]
+        parameters[2].update({"start": "5", "stop": "1", "increment": "-1.5"})
+        parameters.append({"name": "T2", "set": None, "iterator": True, "start": "30", "stop": "10",
+                           "increment": "-10", "scan index": "0", "nesting level": 1})
+        parameters[0]["set"] = "return T2"
+        sequence.load_sequence_from_dict(sequence_dict)
+        playlist_model.set_active_playlist(0)
+
+        db = RecordingDatabase()
+        scheduler = Scheduler(sequence, hardware, db, precompile_depth=precompile_depth)
+        # The hardware is not played, the end of every sequence is reported right away
+        self.assertTrue(scheduler.iterate())
+        for _ in range(shots - 1):
+            scheduler.sequence_finished()
+        scheduler.stop()
+        scheduler.precompile_executor.shutdown()
+        return db.records
+
+    def test_same_parameters_with_and_without_precompilation(self):
+        shots = 14 # more than one complete iteration of the 4 x 3 points
+        records = self.play_scan(0, shots)
+        self.assertEqual(len(records), shots)
+        self.assertEqual(self.play_scan(2, shots), records)
+        self.assertEqual(records[0][2]["T2"]["num_values"], 3)
+        # The last point of num_pulses (0.5) is below stop, it has no value and is played from the GUI
+        self.assertEqual(records[0][2]["num_pulses"]["num_values"], 4)
+
+
+if __name__ == "__main__":
+    unittest.main()
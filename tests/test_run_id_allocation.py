@@ -0,0 +1,73 @@
+import os
+import sys
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+from databases.sqlite import SQLiteDatabase
+from databases.textfile import TextfileDatabase
+
+
+# Two instances of the player sharing a database must get different run ids, after the runs already stored
+class RunIdAllocationTest:
+    def make_database(self, path):
+        raise NotImplementedError
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        path = os.path.join(self.directory.name, "runs")
+        self.databases = [self.make_database(path), self.make_database(path)]
+
+    def tearDown(self):
+        for db in self.databases:
+            db.close()
+        self.directory.cleanup()
+
+    def take_ids(self, count):
+        allocators = [database.RunIdAllocator(db, block_size=7) for db in self.databases]
+        ids = [[], []]
+        def take(index):
+            for _ in range(count):
+                ids[index].append(allocators[index].take())
+        threads = [threading.Thread(target=take, args=(index,)) for index in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return ids
+
+    def assert_disjoint_and_increasing(self, ids, latest_run_id):
+        for allocated in ids:
+            self.assertEqual(allocated, sorted(set(allocated)))
+            self.assertGreater(allocated[0], latest_run_id)
+        self.assertFalse(set(ids[0]) & set(ids[1]))
+
+    def test_disjoint_ids(self):
+        self.databases[0].store_run_parameters_batch([(run_id, {"a": 1.0}, {}) for run_id in range(1, 11)])
+        self.databases[0].flush()
+        self.assertEqual(self.databases[1].get_latest_run_id(), 10)
+        ids = self.take_ids(50)
+        self.assert_disjoint_and_increasing(ids, 10)
+
+        # Runs stored by an instance that doesn't reserve its ids (e.g. an older version) are skipped too
+        latest_run_id = max(ids[0] + ids[1]) + 100
+        self.databases[1].store_run_parameters(latest_run_id, {"a": 2.0}, {})
+        self.databases[1].flush()
+        self.assert_disjoint_and_increasing(self.take_ids(20), latest_run_id)
+
+
+class SQLiteRunIdAllocationTest(RunIdAllocationTest, unittest.TestCase):
+    def make_database(self, path):
+        return SQLiteDatabase(path + ".sqlite")
+
+
+class TextfileRunIdAllocationTest(RunIdAllocationTest, unittest.TestCase):
+    def make_database(self, path):
+        return TextfileDatabase(path + ".txt")
+
+
+if __name__ == "__main__":
+    unittest.main()
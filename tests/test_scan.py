@@ -0,0 +1,81 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import scan
+
+
+# The list of points that the Scheduler used to build before ScanSpace, `variables` sorted by nesting level
+def all_indices(variables):
+    indices = []
+    for level, (var_name, num_values) in enumerate(variables):
+        if level == 0:
+            for i in range(num_values):
+                indices.append({var_name: i})
+        else:
+            new_index_list = []
+            for index_dict in indices:
+                for i in range(num_values):
+                    index_dict[var_name] = i
+                    new_index_list.append(index_dict.copy())
+            indices = new_index_list
+    return indices
+
+
+class PermutationTest(unittest.TestCase):
+    def test_bijection(self):
+        for size in [1, 2, 3, 4, 5, 15, 16, 17, 63, 64, 65, 100, 1000, 4097]:
+            for seed in [0, 1, 12345]:
+                permutation = scan.Permutation(size, seed)
+                self.assertEqual(len(permutation), size)
+                self.assertEqual(sorted(permutation[i] for i in range(size)), list(range(size)), (size, seed))
+
+    def test_large_bijection(self):
+        size = 100003
+        permutation = scan.Permutation(size, 7)
+        self.assertEqual(sorted(permutation[i] for i in range(size)), list(range(size)))
+
+    def test_same_seed_same_order(self):
+        self.assertEqual([scan.Permutation(50, 3)[i] for i in range(50)], [scan.Permutation(50, 3)[i] for i in range(50)])
+        self.assertNotEqual([scan.Permutation(50, 3)[i] for i in range(50)], list(range(50)))
+
+    def test_out_of_range(self):
+        permutation = scan.Permutation(5, 0)
+        with self.assertRaises(IndexError):
+            permutation[5]
+        with self.assertRaises(IndexError):
+            permutation[-1]
+
+
+class ScanSpaceTest(unittest.TestCase):
+    def test_order(self):
+        for variables in [[("a", 4)], [("a", 3), ("b", 2)], [("a", 2), ("b", 3), ("c", 5)], [("a", 1), ("b", 4)]]:
+            space = scan.ScanSpace(variables)
+            self.assertEqual([space[i] for i in range(len(space))], all_indices(variables))
+
+    def test_innermost_changes_fastest(self):
+        space = scan.ScanSpace([("outer", 2), ("inner", 3)])
+        self.assertEqual(space[0], {"outer": 0, "inner": 0})
+        self.assertEqual(space[1], {"outer": 0, "inner": 1})
+        self.assertEqual(space[3], {"outer": 1, "inner": 0})
+
+    def test_shuffle(self):
+        variables = [("a", 3), ("b", 4), ("c", 5)]
+        space = scan.ScanSpace(variables)
+        space.shuffle(42)
+        shuffled = [space[i] for i in range(len(space))]
+        key = lambda point: sorted(point.items())
+        self.assertEqual(sorted(shuffled, key=key), sorted(all_indices(variables), key=key))
+        space.unshuffle()
+        self.assertEqual([space[i] for i in range(len(space))], all_indices(variables))
+
+    def test_out_of_range(self):
+        space = scan.ScanSpace([("a", 2), ("b", 2)])
+        with self.assertRaises(IndexError):
+            space[4]
+
+
+if __name__ == "__main__":
+    unittest.main()
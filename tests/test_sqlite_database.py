@@ -0,0 +1,35 @@
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from databases.sqlite import SQLiteDatabase
+
+
+class SQLiteDatabaseTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.db = SQLiteDatabase(os.path.join(self.directory.name, "runs.sqlite"))
+
+    def tearDown(self):
+        self.db.close()
+        self.directory.cleanup()
+
+    # A batch that fails is rolled back, the names it added must not stay in the cache of name ids
+    def test_good_batch_after_failed_batch(self):
+        with self.assertRaises(Exception):
+            self.db.store_run_parameters_batch([(1, {"a": 1.0, "bad": [1, 2]}, {})])
+        self.assertIsNone(self.db.get_run_parameters(1))
+
+        iterators = {"b": {"start": 10.0, "stop": 1.0, "increment": -1.0, "nesting level": 0, "num_values": 10,
+                           "scan_index": 0}}
+        self.db.store_run_parameters_batch([(2, {"a": 2.0}, {}), (3, {"c": 3.0}, iterators)])
+        self.assertEqual(self.db.get_run_parameters(2), ({"a": 2.0}, {}))
+        self.assertEqual(self.db.get_run_parameters(3), ({"c": 3.0}, iterators))
+        self.assertEqual(self.db.find_scanned_runs("b"), [3])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,156 @@
+import os
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+
+
+# Keeps the batches in memory. It can be made to fail a number of times or to block until `release` is set.
+class FakeDatabase(database.Database):
+    def __init__(self, failures=0):
+        self.batches = []
+        self.attempts = 0
+        self.failures = failures
+        self.flushes = 0
+        self.closed = False
+        self.release = threading.Event()
+        self.release.set()
+
+    def store_run_parameters_batch(self, records):
+        self.release.wait()
+        self.attempts += 1
+        if self.failures:
+            self.failures -= 1
+            raise IOError("database not available")
+        self.batches.append(list(records))
+
+    def flush(self, timeout=None):
+        self.flushes += 1
+        return True
+
+    def close(self, timeout=10):
+        self.closed = True
+
+    def stored(self):
+        return [record for batch in self.batches for record in batch]
+
+
+def records(first, count):
+    return [(run_id, {"a": float(run_id)}, {}) for run_id in range(first, first + count)]
+
+
+class WriteBehindDatabaseTest(unittest.TestCase):
+    def store(self, db, runs):
+        for record in runs:
+            db.store_run_parameters(*record)
+
+    def test_batches(self):
+        inner = FakeDatabase()
+        db = database.WriteBehindDatabase(inner, batch_size=3, flush_interval=10)
+        runs = records(1, 7)
+        self.store(db, runs)
+        self.assertTrue(db.flush(timeout=5))
+        self.assertEqual(inner.stored(), runs)
+        self.assertTrue(all(len(batch) <= 3 for batch in inner.batches))
+        self.assertGreaterEqual(len(inner.batches), 3)
+        self.assertGreater(inner.flushes, 0)
+        db.close()
+
+    def test_flush_timeout(self):
+        inner = FakeDatabase()
+        inner.release.clear()
+        db = database.WriteBehindDatabase(inner, flush_interval=10)
+        self.store(db, records(1, 2))
+        self.assertFalse(db.flush(timeout=0.2))
+        self.assertFalse(db.flush(timeout=0))
+        inner.release.set()
+        self.assertTrue(db.flush(timeout=5))
+        self.assertEqual(inner.stored(), records(1, 2))
+        db.close()
+
+    def test_close_drains_queue(self):
+        inner = FakeDatabase()
+        db = database.WriteBehindDatabase(inner, batch_size=2, flush_interval=10)
+        runs = records(1, 5)
+        self.store(db, runs)
+        db.close(timeout=5)
+        self.assertEqual(inner.stored(), runs)
+        self.assertTrue(inner.closed)
+        self.assertEqual(db.dropped, 0)
+
+        db.store_run_parameters(6, {}, {})
+        self.assertEqual(db.dropped, 1)
+
+    def test_failed_batches_are_retried(self):
+        inner = FakeDatabase(failures=2)
+        db = database.WriteBehindDatabase(inner, flush_interval=10, retry_delay=0.01)
+        runs = records(1, 4)
+        self.store(db, runs)
+        self.assertTrue(db.flush(timeout=5))
+        self.assertEqual(inner.stored(), runs)
+        self.assertEqual(inner.attempts, 3)
+        db.close()
+
+    def test_close_gives_up_on_failing_database(self):
+        inner = FakeDatabase(failures=10**6)
+        db = database.WriteBehindDatabase(inner, flush_interval=10, retry_delay=0.01)
+        self.store(db, records(1, 4))
+        db.close(timeout=0.3)
+        self.assertFalse(db.thread.is_alive())
+        self.assertEqual(inner.stored(), [])
+        self.assertEqual(db.dropped, 4)
+        self.assertTrue(inner.closed)
+
+    def test_full_queue_drops_new_records(self):
+        inner = FakeDatabase()
+        inner.release.clear()
+        db = database.WriteBehindDatabase(inner, max_pending=2, batch_size=1, flush_interval=10)
+        db.store_run_parameters(1, {}, {})
+        deadline = time.monotonic() + 5
+        while not db.writing and time.monotonic() < deadline: # wait until run 1 is being written
+            time.sleep(0.01)
+        self.store(db, records(2, 3))
+        self.assertEqual(db.dropped, 1)
+        inner.release.set()
+        self.assertTrue(db.flush(timeout=5))
+        self.assertEqual([record[0] for record in inner.stored()], [1, 2, 3])
+        db.close()
+
+    def test_latest_run_id_includes_queued_runs(self):
+        inner = FakeDatabase()
+        inner.release.clear()
+        db = database.WriteBehindDatabase(inner, flush_interval=10)
+        self.store(db, records(5, 3))
+        self.assertEqual(db.get_latest_run_id(), 7)
+        inner.release.set()
+        db.close()
+
+
+class RunIdAllocatorTest(unittest.TestCase):
+    def test_ids_follow_latest_run(self):
+        inner = FakeDatabase()
+        inner.get_latest_run_id = lambda: 41
+        allocator = database.RunIdAllocator(inner, block_size=10)
+        self.assertEqual(allocator.peek(), 42)
+        self.assertEqual(allocator.peek(3), 45)
+        self.assertEqual([allocator.take() for _ in range(25)], list(range(42, 67)))
+        self.assertEqual(allocator.peek(), 67)
+
+    def test_shared_database(self):
+        inner = FakeDatabase()
+        first = database.RunIdAllocator(inner, block_size=5)
+        write_behind = database.WriteBehindDatabase(inner)
+        second = database.RunIdAllocator(write_behind, block_size=5)
+        ids = [allocator.take() for _ in range(12) for allocator in (first, second)]
+        write_behind.close()
+        self.assertEqual(len(set(ids)), len(ids))
+        self.assertEqual(ids[0::2], sorted(ids[0::2]))
+        self.assertEqual(ids[1::2], sorted(ids[1::2]))
+
+
+if __name__ == "__main__":
+    unittest.main()
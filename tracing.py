@@ -0,0 +1,158 @@
+# Timestamps of the stages of every shot (sequence played), to find out where the time between shots goes.
+# The Scheduler and the Hardware mark the events of each run_id as they happen; a shot is closed once its end has been
+# notified and it is then kept in a ring buffer and, optionally, appended to a CSV or JSONL file.
+# This module must not depend on Qt so that it can be used outside of the GUI.
+
+import collections
+import csv
+import json
+import math
+import os
+import threading
+import time
+
+# Events in the order they normally happen. A shot does not necessarily have all of them: precompiled shots are
+# compiled in a background thread, the database is only written while iterating...
+# dispatch_load and dispatch_start are the times at which the sequence is handed to the output systems and they are
+# asked to play it, not the times at which the hardware starts: a system like ARTIQ starts the experiment later on its
+# own schedule.
+EVENTS = ("compile_start", "compile_end", "process_start", "process_end", "dispatch_load", "dispatch_start",
+          "publish_start", "publish_end", "database_start", "database_end", "hardware_finish", "finish_published")
+
+# Durations reported in the summary: name -> (first event, last event)
+PHASES = {"compile": ("compile_start", "compile_end"),
+          "process": ("process_start", "process_end"),
+          "load": ("dispatch_load", "dispatch_start"),
+          "hardware": ("dispatch_start", "hardware_finish"),
+          "publish": ("publish_start", "publish_end"),
+          "database": ("database_start", "database_end"),
+          "finish_publish": ("hardware_finish", "finish_published")}
+
+
+# Returns the p-th percentile of the sorted list `values` (nearest rank), None if it is empty
+def percentile(values, p):
+    if not values:
+        return None
+    return values[max(0, math.ceil(p/100*len(values)) - 1)]
+
+
+class Tracer:
+    # `capacity` is the number of finished shots kept in memory. `sink_path` is a file where every finished shot is
+    # appended, as CSV if it ends with .csv and as JSON lines otherwise.
+    def __init__(self, capacity=1000, sink_path=None):
+        self.capacity = capacity
+        self.sink_path = sink_path
+        self.lock = threading.Lock() # events can be marked from the precompile and hardware threads
+
+        self.open_shots = collections.OrderedDict() # run_id -> shot being played or prepared
+        self.shots = collections.deque(maxlen=capacity) # finished shots, oldest first
+        self.num_shots = 0
+        self.last_finish = None # hardware_finish of the previous shot, None after a stop
+
+    # Records that `event` happened now for the shot `run_id`. The shot is created if it isn't open yet.
+    def mark(self, run_id, event):
+        timestamp = time.perf_counter()
+        with self.lock:
+            shot = self.open_shots.get(run_id)
+            if shot is None:
+                shot = {"run_id": run_id, "wall_time": time.time(), "events": {}}
+                self.open_shots[run_id] = shot
+                # Shots that are discarded before being played (e.g. precompiled ones after a stop) are never closed
+                while len(self.open_shots) > self.capacity:
+                    self.open_shots.popitem(last=False)
+            shot["events"][event] = timestamp
+
+    # Finishes the shot `run_id`, it is moved to the ring buffer and written to the sink. Returns the shot or None.
+    def close(self, run_id):
+        with self.lock:
+            shot = self.open_shots.pop(run_id, None)
+            if shot is None:
+                return None
+            events = shot["events"]
+            shot["shot"] = self.num_shots
+            self.num_shots += 1
+            shot["dead_time"] = None
+            if self.last_finish is not None and "dispatch_start" in events:
+                shot["dead_time"] = events["dispatch_start"] - self.last_finish
+            if "hardware_finish" in events:
+                self.last_finish = events["hardware_finish"]
+            self.shots.append(shot)
+        if self.sink_path is not None:
+            self._write(shot)
+        return shot
+
+    # Must be called when the shots stop so that the idle time until the next one isn't counted as dead time
+    def break_chain(self):
+        with self.lock:
+            self.last_finish = None
+
+    def clear(self):
+        with self.lock:
+            self.open_shots.clear()
+            self.shots.clear()
+            self.last_finish = None
+
+    # Returns a copy of the finished shots in the ring buffer, oldest first
+    def get_shots(self):
+        with self.lock:
+            return list(self.shots)
+
+    # Returns a flat dictionary with the times of the events in ms relative to the first one
+    @staticmethod
+    def shot_row(shot):
+        events = shot["events"]
+        origin = min(events.values()) if events else 0
+        row = {"shot": shot["shot"], "run_id": shot["run_id"], "wall_time": shot["wall_time"],
+               "dead_time": None if shot["dead_time"] is None else 1e3*shot["dead_time"]}
+        for event in EVENTS:
+            row[event] = 1e3*(events[event] - origin) if event in events else None
+        return row
+
+    def _write(self, shot):
+        row = self.shot_row(shot)
+        try:
+            if self.sink_path.endswith(".csv"):
+                new_file = not os.path.exists(self.sink_path) or os.path.getsize(self.sink_path) == 0
+                with open(self.sink_path, "a", newline="") as sink_file:
+                    writer = csv.DictWriter(sink_file, fieldnames=list(row))
+                    if new_file:
+                        writer.writeheader()
+                    writer.writerow(row)
+            else:
+                with open(self.sink_path, "a") as sink_file:
+                    sink_file.write(json.dumps(row) + "\n")
+        except OSError as e:
+            print("Tracing: could not write to %s: %s" % (self.sink_path, e))
+
+    # Returns {"shots": number of shots in the buffer, "dead_time": {"p50", "p95", "max"}, "phases": {phase: {...}}}
+    # with times in ms computed over the shots in the ring buffer
+    def summary(self):
+        shots = self.get_shots()
+
+        def stats(values):
+            values = sorted(1e3*v for v in values)
+            return {"p50": percentile(values, 50), "p95": percentile(values, 95),
+                    "max": values[-1] if values else None}
+
+        phases = {}
+        for phase, (first, last) in PHASES.items():
+            phases[phase] = stats([shot["events"][last] - shot["events"][first] for shot in shots
+                                   if first in shot["events"] and last in shot["events"]])
+        return {"shots": len(shots),
+                "dead_time": stats([shot["dead_time"] for shot in shots if shot["dead_time"] is not None]),
+                "phases": phases}
+
+    def summary_text(self):
+        summary = self.summary()
+
+        def format_stats(stats):
+            if stats["max"] is None:
+                return "-"
+            return "p50 %.2f ms, p95 %.2f ms, max %.2f ms" % (stats["p50"], stats["p95"], stats["max"])
+
+        lines = ["Traced shots: %d" % summary["shots"],
+                 "Dead time: %s" % format_stats(summary["dead_time"])]
+        for phase, stats in summary["phases"].items():
+            if stats["max"] is not None:
+                lines.append("  %s: %s" % (phase, format_stats(stats)))
+        return "\n".join(lines)
@@ -1,6 +1,10 @@
 from PyQt5.QtCore import Qt, QModelIndex
 from PyQt5.QtGui import QStandardItem
 
+# Track, variable, playlist item and function types and the exceptions are defined in definitions.py, which doesn't
+# depend on Qt. They are also available from this module.
+from definitions import *
+
 # User-defined role to use with QStandardItemModel
 TrackTypeRole = Qt.UserRole + 1 # Digital/Analog
 ChannelRole = Qt.UserRole + 2 # An instance of cards.Channel
@@ -38,26 +42,6 @@ AEventPhaseNumericRole = Qt.UserRole + 28
 AEventFrequencyNumericRole = Qt.UserRole + 29
 AEventOffsetNumericRole = AEventValueNumericRole
 
-# TrackTypes
-DigitalTrack = 0
-AnalogTrack = 1
-
-# VariableTypes
-NumericVariable = 0
-CodeVariable = 1
-
-# Playlist item types
-Routine = 0
-Gap = 1
-
-# Function Types
-Constant = 0
-Linear = 1
-ExpRise = 2
-ExpFall = 3
-Sine = 4
-
-
 def iter_tree_rows(root: QStandardItem):
     if root is not None:
         stack = [root]
@@ -85,9 +69,3 @@ def is_descendant_of(ancestor : QModelIndex, index: QModelIndex):
         parent = parent.parent()
 
     return False
-
-class SequenceException(Exception):
-    pass
-
-class ConfigException(Exception):
-    pass
\ No newline at end of file
@@ -5,9 +5,11 @@
 #  
 #
 
-from PyQt5.QtCore import Qt, QModelIndex, QSortFilterProxyModel, pyqtSlot, pyqtSignal
+from PyQt5.QtCore import Qt, QModelIndex, QPersistentModelIndex, QSortFilterProxyModel, pyqtSlot, pyqtSignal
 from PyQt5.QtGui import QStandardItemModel, QStandardItem, QFont, QColor
 import utils
+import core
+import expressions
 
 import numpy as np
 import scipy
@@ -18,11 +20,42 @@ class VariablesModel(QStandardItemModel):
     EPS = 1e-12
     variable_fields = ["name", "set", "value", "iterator", "start", "stop", "increment", "comment", "scan index", "nesting level"]
     variable_types = [str, str, float, bool, float, float, float, str, int, int]
+    input_fields = ["set", "start", "stop", "increment", "scan index"] # fields from which values are calculated
+
+    # Emitted once every time the values have been evaluated again, with the names of the variables whose value changed
+    # or None if any of them may have changed. The models that depend on the values listen to it rather than to
+    # dataChanged, which is emitted for every group that contains a changed value.
+    values_changed = pyqtSignal(object)
 
     def __init__(self):
         super().__init__()
         self.setHorizontalHeaderLabels(self.variable_fields)
+
+        # Dependency graph between variables, it is rebuilt on every full evaluation of the variables and used to
+        # evaluate only the variables affected by an edit. _namespace is None when the graph must be rebuilt.
+        self._namespace = None
+        self._var_rows = {}
+        self._var_kinds = {}
+        self._code = {}
+        self._used_names = {}
+        self._dependencies = {}
+        self._dependents = {}
+        self._unresolvable = set()
+        self._order_position = {}
+
+        # name -> persistent index of the name cell of every variable, built when needed by get_variable_index
+        self._name_index = None
+        # True while the changes of the values are emitted, they don't need to be evaluated again
+        self._emitting_values = False
+
         self.dataChanged.connect(self.update_values)
+        self.dataChanged.connect(self._name_data_changed)
+        self.rowsInserted.connect(self._invalidate_dependency_graph)
+        self.rowsRemoved.connect(self._invalidate_dependency_graph)
+        self.rowsMoved.connect(self._invalidate_dependency_graph)
+        self.modelReset.connect(self._invalidate_dependency_graph)
+        for signal in (self.rowsInserted, self.rowsRemoved, self.rowsMoved, self.modelReset):
+            signal.connect(self._invalidate_name_index)
 
     def clear(self):
         self.removeRows(0, self.rowCount())
@@ -153,14 +186,32 @@ class VariablesModel(QStandardItemModel):
         return var_type == utils.CodeVariable
 
     def variable_exists(self, var_name) -> bool:
+        return self.get_variable_index(var_name) is not None
+
+    # Returns the index of the name cell of the variable or None if there is no variable with that name
+    def get_variable_index(self, var_name) -> QModelIndex:
+        if self._name_index is None:
+            self._build_name_index()
+        if var_name not in self._name_index:
+            return None
+
+        name_idx = QModelIndex(self._name_index[var_name])
+        if not name_idx.isValid() or name_idx.data() != var_name: # Out of date, e.g. after an edit with blocked signals
+            self._build_name_index()
+            if var_name not in self._name_index:
+                return None
+            name_idx = QModelIndex(self._name_index[var_name])
+        return name_idx
+
+    def _build_name_index(self):
+        self._name_index = {}
         num_groups = self.rowCount()
         for g in range(num_groups):
             group_index = self.index(g,0)
             num_variables = self.rowCount(group_index)
             for v in range(num_variables):
-                if var_name == self.index(v, self.variable_fields.index("name"), group_index).data():
-                    return True
-        return False
+                name_idx = self.index(v, self.variable_fields.index("name"), group_index)
+                self._name_index.setdefault(name_idx.data(), QPersistentModelIndex(name_idx))
 
 
     def set_var_type(self, var_index:QModelIndex, var_type):
@@ -231,23 +282,14 @@ class VariablesModel(QStandardItemModel):
             for v in range(num_variables):
                 # If it is an iterating variable
                 if self.index(v,self.variable_fields.index("iterator"),group_index).data(Qt.CheckStateRole) == Qt.Checked:
-                    try:
-                        var_name = self.index(v, self.variable_fields.index("name"), group_index).data()
-                        start = float(self.index(v, self.variable_fields.index("start"), group_index).data())
-                        stop = float(self.index(v, self.variable_fields.index("stop"), group_index).data())
-                        if (stop >= start) : raise ValueError # Error fixed: When stop value is greater than start value, an error ocurred and the program crashed.
-                        increment = float(self.index(v, self.variable_fields.index("increment"), group_index).data())
-                        nesting_lvl = int(self.index(v, self.variable_fields.index("nesting level"), group_index).data())
-                        scan_index = int(self.index(v, self.variable_fields.index("scan index"), group_index).data())
-                        # TODO: replace this with something that doesn't require allocating memory. Lazy Asaf from the past didn't do it.
-                        num_values = len(np.arange(start, stop + increment, increment))
-                        iter_vars[var_name] = {"start": start, "stop": stop, "increment": increment, "nesting level": nesting_lvl, "num_values": num_values, "scan_index":scan_index}
-                    except (TypeError, ValueError, ZeroDivisionError): # When values are not well defined
+                    var_name = self.index(v, self.variable_fields.index("name"), group_index).data()
+                    fields = [self.index(v, self.variable_fields.index(field), group_index).data()
+                              for field in ("start", "stop", "increment", "nesting level", "scan index")]
+                    description = core.iterator_description(*fields)
+                    if description is None: # When values are not well defined
                         # ToDo: give an indication of the problem (i.e. paint fields red maybe).
                         return { }
-                
-                else :
-                    pass 
+                    iter_vars[var_name] = description
 
         return iter_vars
 
@@ -270,12 +312,12 @@ class VariablesModel(QStandardItemModel):
         # print("Setting indices to: "+str(scanvars_indices))
         self.blockSignals(True)
         for (var_name,idx) in scanvars_indices.items():
-            # only one item should be returned since variable names should be unique
-            item = self.findItems(var_name, flags=Qt.MatchRecursive, column=0)[0] # type: QStandardItem
-            item.parent().child(item.row(), column=self.variable_fields.index("scan index")).setData(str(idx), Qt.DisplayRole)
+            name_idx = self.get_variable_index(var_name)
+            scan_index_idx = name_idx.sibling(name_idx.row(), self.variable_fields.index("scan index"))
+            self.setData(scan_index_idx, str(idx), Qt.DisplayRole)
 
         self.blockSignals(False)
-        self.update_values()
+        self._update_values(list(scanvars_indices.keys()))
 
     def to_number(self, expr, variables=None):
         if variables is None:
@@ -283,7 +325,7 @@ class VariablesModel(QStandardItemModel):
 
         return_value = None
         try:
-            return_value = eval(expr,variables)
+            return_value = expressions.evaluate(expr,variables)
         except (SyntaxError, ValueError):
             pass
 
@@ -303,153 +345,314 @@ class VariablesModel(QStandardItemModel):
         n = int(np.floor(steps_float + self.EPS)) + 1
         return max(n, 0)
 
-    @pyqtSlot()
-    def update_values(self):
-        value_changed = False # Flag to decide if dataChanged signal should be emitted
+    # Returns the names of the variables whose value may be affected by a change of the cells between `top_left` and
+    # `bottom_right`. Returns None if the change may affect the structure of the variables (e.g. a rename) and every
+    # variable has to be evaluated again.
+    def _edited_variables(self, top_left:QModelIndex, bottom_right:QModelIndex):
+        if not top_left.isValid() or not bottom_right.isValid() or not top_left.parent().isValid():
+            return None
+
+        fields = self.variable_fields[top_left.column():bottom_right.column()+1]
+        if "name" in fields or "iterator" in fields:
+            return None
+        if not any(field in self.input_fields for field in fields):
+            return []
+
+        parent = top_left.parent()
+        return [self.index(r, self.variable_fields.index("name"), parent).data()
+                for r in range(top_left.row(), bottom_right.row()+1)]
+
+    def _invalidate_dependency_graph(self):
+        self._namespace = None
+
+    def _invalidate_name_index(self):
+        self._name_index = None
+
+    def _name_data_changed(self, top_left, bottom_right):
+        name_column = self.variable_fields.index("name")
+        if not top_left.isValid() or top_left.column() <= name_column <= bottom_right.column():
+            self._invalidate_name_index()
+
+    # Returns (kind, definition) for the variable in the row of `name_idx`. kind is "iterator", "numeric" (definition is
+    # the value), "code" (definition is the code to execute) or None if the variable is not defined.
+    def _variable_definition(self, name_idx:QModelIndex):
+        if self.is_iterator(name_idx):
+            return "iterator", None
+
+        var_set = name_idx.parent().child(name_idx.row(), self.variable_fields.index("set")).data()
+        if type(var_set) != str:
+            return None, None
+        try:
+            return "numeric", float(var_set) # Cast variables which are numerical
+        except ValueError:
+            return "code", var_set.replace("return","_return_ =")
+
+    # Returns the current value of the iterating variable in the row of `name_idx` or None if it is not well defined
+    def _iterator_value(self, name_idx:QModelIndex):
+        group_index = name_idx.parent()
+        v = name_idx.row()
+        idx_start     = self.index(v, self.variable_fields.index("start"), group_index)
+        idx_stop      = self.index(v, self.variable_fields.index("stop"), group_index)
+        idx_inc       = self.index(v, self.variable_fields.index("increment"), group_index)
+        idx_scanidx   = self.index(v, self.variable_fields.index("scan index"), group_index)
+        val_idx       = self.index(v, self.variable_fields.index("value"), group_index)
+        var_start       = idx_start.data()
+        var_stop        = idx_stop.data()
+        var_increment   = idx_inc.data()
+        var_scan_index  = idx_scanidx.data()
+
+        try:
+            fstart = float(var_start)
+            fstop  = float(var_stop)
+            finc   = float(var_increment)
+
+            ok, _msg = self._validate_iter(fstart, fstop, finc)
+            print(_msg)
+
+            if not ok:
+                self.update_style(name_idx,  error=True)
+                self.update_style(idx_start, error=True)
+                self.update_style(idx_stop,  error=True)
+                self.update_style(idx_inc,   error=True)
+                self.update_style(val_idx,   error=True)
+                return None
+
+        except (TypeError, ValueError):
+            self.update_style(name_idx,  error=True)
+            self.update_style(idx_start, error=True)
+            self.update_style(idx_stop,  error=True)
+            self.update_style(idx_inc,   error=True)
+            self.update_style(val_idx,   error=True)
+            return None
+
+        try:
+            isidx = int(var_scan_index)
+        except (TypeError, ValueError):
+            isidx = None
+
+        n_steps = self._count_steps(fstart, fstop, finc)
+        if n_steps <= 0 or isidx is None or not (0 <= isidx < n_steps):
+            self.update_style(name_idx, error=True)
+            self.update_style(idx_scanidx, error=True)
+            self.update_style(val_idx, error=True)
+            if n_steps <= 0:
+                self.update_style(idx_start, error=True)
+                self.update_style(idx_stop, error=True)
+                self.update_style(idx_inc, error=True)
+            return None
+
+        self.update_style(name_idx, error=False)
+        self.update_style(idx_start, error=False)
+        self.update_style(idx_stop, error=False)
+        self.update_style(idx_inc, error=False)
+        self.update_style(idx_scanidx, error=False)
+        self.update_style(val_idx, error=False)
+
+        return round(fstart + isidx * finc, 10)
+
+    # Writes `value` in the value cell of the variable. Returns the index of the cell if it changed and None otherwise.
+    def _set_value(self, name_idx:QModelIndex, value):
+        val_idx = name_idx.parent().child(name_idx.row(), self.variable_fields.index("value"))
+        if "%.9g" % value != self.data(val_idx):
+            self.setData(val_idx, "%.9g" % value)
+            return val_idx
+        return None
+
+    # Executes the code of a code variable in the variables namespace. The namespace is updated with the result.
+    # Returns the index of the value cell if the value changed and None otherwise.
+    def _evaluate_code_variable(self, var_name):
+        name_idx = QModelIndex(self._var_rows[var_name])
+        missing = self._dependencies[var_name] - self._namespace.keys()
+        if var_name in self._unresolvable or len(missing) > 0:
+            if var_name not in self._unresolvable:
+                print("Error: Variable %s depends on variables that cannot be evaluated: %s" %
+                      (var_name, ", ".join(sorted(missing))))
+            self._namespace.pop(var_name, None)
+            self.update_style(name_idx, error=True)
+            return None
+
+        try:
+            var_val = core.evaluate_code_variable(self._code[var_name], self._namespace)
+        except Exception as e:
+            print("Error: Variable %s cannot be numerically evaluated: %r" % (var_name, e))
+            self._namespace.pop(var_name, None)
+            self.update_style(name_idx, error=True)
+            return None
+
+        self._namespace[var_name] = var_val
+        self.update_style(name_idx)
+        return self._set_value(name_idx, var_val)
+
+    # Evaluates all the variables and rebuilds the dependency graph between them.
+    # Returns the list of value cells that changed.
+    def _update_all_values(self):
+        changed = []
 
-        to_do = [] # reference to non-numerical variables
         variables_dict = {'np':np, 'int':int, 'scipy':scipy, 'print':print}
 
         # __builtins__ is added so eval treats 'variables' as we want
         # (it doesn't add the builtin python variables)
         variables_dict["__builtins__"] = {}
 
-        self.blockSignals(True)
+        self._namespace = variables_dict
+        self._var_rows = {} # name -> persistent index of the name cell
+        self._var_kinds = {}
+        self._code = {}
+        self._dependents = {} # variable name -> code variables that use it directly
 
         # Loop through all variables to find the numerical ones
         num_groups = self.rowCount()
         for g in range(num_groups):
-            # print("g=%d"%g)
             group_index = self.index(g,0)
             num_variables = self.rowCount(group_index)
-            # print("num_vars=%d"%num_variables)
             for v in range(num_variables):
                 name_idx = self.index(v, self.variable_fields.index("name"), group_index)
                 var_name = name_idx.data()
+                kind, definition = self._variable_definition(name_idx)
+                self._var_rows[var_name] = QPersistentModelIndex(name_idx)
+                self._var_kinds[var_name] = kind
 
                 # Set iterating variables
-                if self.is_iterator(name_idx):
-                    idx_start     = self.index(v, self.variable_fields.index("start"), group_index)
-                    idx_stop      = self.index(v, self.variable_fields.index("stop"), group_index)
-                    idx_inc       = self.index(v, self.variable_fields.index("increment"), group_index)
-                    idx_scanidx   = self.index(v, self.variable_fields.index("scan index"), group_index)
-                    val_idx       = self.index(v, self.variable_fields.index("value"), group_index)
-                    var_start       = idx_start.data()
-                    var_stop        = idx_stop.data()
-                    var_increment   = idx_inc.data()
-                    var_scan_index  = idx_scanidx.data()
-
-                    try:
-                        fstart = float(var_start)
-                        fstop  = float(var_stop)
-                        finc   = float(var_increment)
-
-                        ok, _msg = self._validate_iter(fstart, fstop, finc)
-                        print(_msg)
-    
-                        if not ok:
-                            self.update_style(name_idx,  error=True)
-                            self.update_style(idx_start, error=True)
-                            self.update_style(idx_stop,  error=True)
-                            self.update_style(idx_inc,   error=True)
-                            self.update_style(val_idx,   error=True)
-                            continue
-
-                    except (TypeError, ValueError):
-                        self.update_style(name_idx,  error=True)
-                        self.update_style(idx_start, error=True)
-                        self.update_style(idx_stop,  error=True)
-                        self.update_style(idx_inc,   error=True)
-                        self.update_style(val_idx,   error=True)
-                        continue
-                    
-                    try:
-                        isidx = int(var_scan_index)
-                    except (TypeError, ValueError):
-                        isidx = None
-
-                    n_steps = self._count_steps(fstart, fstop, finc)
-                    if n_steps <= 0 or isidx is None or not (0 <= isidx < n_steps):
-                        self.update_style(name_idx, error=True)
-                        self.update_style(idx_scanidx, error=True)
-                        self.update_style(val_idx, error=True)
-                        if n_steps <= 0:
-                            self.update_style(idx_start, error=True)
-                            self.update_style(idx_stop, error=True)
-                            self.update_style(idx_inc, error=True)
-                        continue 
-                    
-                    self.update_style(name_idx, error=False)
-                    self.update_style(idx_start, error=False)
-                    self.update_style(idx_stop, error=False)
-                    self.update_style(idx_inc, error=False)
-                    self.update_style(idx_scanidx, error=False)
-                    self.update_style(val_idx, error=False)
-
-                    curr_val = round(fstart + isidx * finc, 10)
-                    
-                    if "%.9g" % curr_val != self.data(val_idx):
-                        self.setData(val_idx, "%.9g" % curr_val)
-                        value_changed = True
+                if kind == "iterator":
+                    curr_val = self._iterator_value(name_idx)
+                    if curr_val is not None:
+                        val_idx = self._set_value(name_idx, curr_val)
+                        if val_idx is not None:
+                            changed.append(val_idx)
                         variables_dict[var_name] = curr_val
-                    
+
                 # Set numerical variables
-                else:
-                    var_set = self.index(v,self.variable_fields.index("set"),group_index).data()
-                    if type(var_set) == str:
-                        # print("%d %d %s=%s" % (g, v, var_name, var_set))
-                        try:
-                            var_val = float(var_set)  # Cast variables which are numerical
-                            val_idx = self.index(v, self.variable_fields.index("value"), group_index)
-                            if "%.9g"%var_val != self.data(val_idx):
-                                #print("Numeric var Changed from %s to %g"%(self.data(val_idx), var_val))
-                                self.setData(val_idx, "%.9g"%var_val)
-                                value_changed = True
-                                self.update_style(name_idx)
-                            variables_dict[var_name] = var_val
-                        except ValueError:
-                            to_do.append((g,v))
-
-        # Now we do our best to parse code variables
-        retry_attempts = 0
-        while len(to_do) > 0:
-            g, v = to_do.pop()
-            group_index = self.index(g, 0)
-            var_set = self.index(v, self.variable_fields.index("set"), group_index).data()
-            if type(var_set) == str:
-                var_set = var_set.replace("return","_return_ =")
-                loc_dict = {}
+                elif kind == "numeric":
+                    val_idx = self._set_value(name_idx, definition)
+                    if val_idx is not None:
+                        changed.append(val_idx)
+                        self.update_style(name_idx)
+                    variables_dict[var_name] = definition
+
+                elif kind == "code":
+                    self._code[var_name] = definition
+
+        # Now we parse the code variables. Each one is evaluated once, after all the variables it uses.
+        self._used_names, self._dependencies, order, self._unresolvable = core.analyse_code_variables(
+            self._code, self._var_rows.keys(), variables_dict.keys())
+        for var_name, dependencies in self._dependencies.items():
+            for dependency in dependencies:
+                self._dependents.setdefault(dependency, set()).add(var_name)
+        self._order_position = {var_name: position for position, var_name in enumerate(order)}
+
+        for var_name in order:
+            val_idx = self._evaluate_code_variable(var_name)
+            if val_idx is not None:
+                changed.append(val_idx)
+
+        return changed
+
+    # Evaluates the variables in `var_names` and the code variables that depend on them, directly or not.
+    # Returns the list of value cells that changed, or None if the dependency graph is not valid anymore and
+    # _update_all_values must be used instead.
+    def _update_dependent_values(self, var_names):
+        if self._namespace is None:
+            return None
+
+        changed = []
+        to_evaluate = set()
+        for var_name in var_names:
+            if var_name not in self._var_rows:
+                return None
+            name_idx = QModelIndex(self._var_rows[var_name])
+            if not name_idx.isValid() or name_idx.data() != var_name:
+                return None
+
+            kind, definition = self._variable_definition(name_idx)
+            if kind != self._var_kinds[var_name]:
+                return None
+
+            if kind == "iterator":
+                value = self._iterator_value(name_idx)
+            elif kind == "numeric":
+                value = definition
+            elif kind == "code":
                 try:
-                    exec(var_set,variables_dict,loc_dict)
-                    var_val = loc_dict["_return_"]
-                    val_idx = self.index(v, self.variable_fields.index("value"), group_index)
-                    var_name_idx = self.index(v, self.variable_fields.index("name"), group_index)
-                    self.update_style(var_name_idx)
-                    var_name = var_name_idx.data()
-                    if "%.9g" % var_val != self.data(val_idx):
-                        #print("Code var Changed from %s to %g"%(self.data(val_idx), var_val))
-                        self.setData(val_idx, "%.9g" % var_val)
-                        value_changed = True
-                    variables_dict[var_name] = var_val
-                    retry_attempts = 0
-                except (NameError, TypeError, KeyError, SyntaxError) as e:
-                    # Return to To-Do list if this doesn't work (if there is no error, it should eventually work once
-                    # all the required variables are evaluated)
-                    to_do.insert(0,(g,v))
-                    retry_attempts += 1
-                    if len(to_do) <= retry_attempts:  # Avoid infinite retrys, give up all hope after trying everything
-                        print("Error: Variable set cannot be numerically evaluated: %s %s" % (str(to_do), e))
-
-                        for g,v in to_do:
-                            group_index = self.index(g, 0)
-                            name_index = self.index(v, self.variable_fields.index("name"), group_index)
-                            self.update_style(name_index, error=True)
-                        break
+                    used_names = expressions.free_names(definition)
+                except SyntaxError:
+                    return None
+                if used_names != self._used_names[var_name]:
+                    return None
+                self._code[var_name] = definition
+                to_evaluate.add(var_name)
+                continue
+            else:
+                continue
+
+            if value is None:
+                self._namespace.pop(var_name, None)
+            else:
+                self._namespace[var_name] = value
+                val_idx = self._set_value(name_idx, value)
+                if val_idx is not None:
+                    changed.append(val_idx)
+                    self.update_style(name_idx)
+
+        # Find all the code variables that depend on the edited ones
+        pending = list(var_names)
+        while pending:
+            for dependent in self._dependents.get(pending.pop(), ()):
+                if dependent not in to_evaluate:
+                    to_evaluate.add(dependent)
+                    pending.append(dependent)
+
+        for var_name in sorted(to_evaluate, key=self._order_position.get):
+            val_idx = self._evaluate_code_variable(var_name)
+            if val_idx is not None:
+                changed.append(val_idx)
+
+        return changed
+
+    # Evaluates the variables in `var_names` and their dependents, or all the variables if `var_names` is None.
+    def _update_values(self, var_names=None):
+        self.blockSignals(True)
+
+        changed = None
+        if var_names is not None:
+            changed = self._update_dependent_values(var_names)
+        full_update = changed is None
+        if full_update:
+            changed = self._update_all_values()
 
         self.blockSignals(False)
-        if value_changed:
-            self.dataChanged.emit(QModelIndex(),QModelIndex())
-            # ToDo: maybe it's more efficient to call dataChanged for each QModelIndex that was changed]
+        self._emitting_values = True
+        try:
+            self._emit_values_changed(changed, full_update)
+        finally:
+            self._emitting_values = False
+
+    def _emit_values_changed(self, changed, full_update):
+        if full_update:
+            if len(changed) > 0:
+                self.dataChanged.emit(QModelIndex(),QModelIndex())
+            self.values_changed.emit(None)
+        elif len(changed) > 0:
+            # The views get one change per group, spanning only the value cells that changed
+            rows_by_group = {}
+            for val_idx in changed:
+                rows_by_group.setdefault(val_idx.parent().row(), []).append(val_idx.row())
+            value_column = self.variable_fields.index("value")
+            name_column = self.variable_fields.index("name")
+            for g, rows in rows_by_group.items():
+                group_index = self.index(g, 0)
+                self.dataChanged.emit(self.index(min(rows), value_column, group_index),
+                                      self.index(max(rows), value_column, group_index))
+            self.values_changed.emit([val_idx.sibling(val_idx.row(), name_column).data() for val_idx in changed])
+
+    @pyqtSlot()
+    @pyqtSlot(QModelIndex, QModelIndex)
+    def update_values(self, top_left=QModelIndex(), bottom_right=QModelIndex()):
+        if self._emitting_values:
+            return
+        var_names = self._edited_variables(top_left, bottom_right)
+        if var_names is not None and len(var_names) == 0:
+            return # Only cells that don't affect any value changed
+        self._update_values(var_names)
 
     def update_style(self, name_index:QModelIndex, error=False):
         color = QColor()
@@ -466,11 +669,6 @@ class VariablesModel(QStandardItemModel):
             self.itemFromIndex(name_index).setBackground(color)
             self.itemFromIndex(name_index).setFont(font)
 
-    def _count_steps(fstart, fstop, finc):
-        steps_float = (fstop - fstart) / finc
-        n = int(math.floor(steps_float + EPS)) + 1
-        return max(n, 0)
-
 class VariablesProxyModel(QSortFilterProxyModel):
     def __init__(self, accepted_fields, show_static, show_iterator, show_empty_groups):
         super().__init__()